@@ -0,0 +1,276 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, ClientError
+
+from router_utils import BodyTee, NoBackendAvailable, AdmissionRejected, RETRYABLE_STATUS, estimate_prompt_tokens, scan_prompt_tokens,\
+    scan_is_stream, scan_usage, needs_payload, affinity_key, filter_headers, handle_registry_request, is_cacheable, request_cache_key,\
+    priority_class
+
+
+class AsyncRouter:
+    """
+    asyncio reverse proxy in front of the vLLM replicas.
+
+      - One shared `ClientSession` whose connector keeps up to
+        `connections_per_backend` keep-alive connections open to each replica.
+      - Response bodies are relayed chunk by chunk, so `stream=True`
+        (SSE) completions reach the client as they are generated.
+      - Request bodies are relayed as raw bytes while they arrive; the JSON is only
+        decoded when routing needs it (cache lookup, affinity without a session header).
+      - With a `ResponseCache`, deterministic requests are answered from
+        the cache and identical concurrent ones share a single backend call.
+      - With a `Hedger`, slow non-streaming requests are duplicated to the least
+        loaded other replica; the first answer wins and the loser is cancelled.
+      - With an `AdmissionController`, requests beyond its in-flight cap wait in
+        per-priority queues, and overflow is answered with 429 right away.
+      - Every attempt sent to a replica is recorded in `metrics`, served at `/metrics`.
+    """
+
+    def __init__(self, pool, connections_per_backend=256, timeout=600, cache=None, forward_mode="raw", hedger=None,
+                 admission=None, metrics=None):
+        self.pool = pool
+        self.metrics = metrics
+        self.cache = cache
+        self.hedger = hedger
+        self.admission = admission
+        self.forward_mode = forward_mode
+        self.connections_per_backend = connections_per_backend
+        self.timeout = timeout
+        self.session = None
+
+    async def on_startup(self, app):
+        connector = TCPConnector(
+            limit=0,
+            limit_per_host=self.connections_per_backend,
+            keepalive_timeout=60,
+        )
+        self.session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(total=self.timeout),
+            auto_decompress=False,
+        )
+
+    async def on_cleanup(self, app):
+        if self.session:
+            await self.session.close()
+
+    async def proxy_vllm(self, request):
+        endpoint = request.match_info["endpoint"]
+        if request.method not in ("POST", "GET", "OPTIONS"):
+            return web.json_response({"error": f"Method {request.method} not supported"}, status=405)
+
+        payload = None
+        body = None
+        est_tokens = 0
+        if request.method == "POST":
+            decode = self.forward_mode == "json" or needs_payload(self.pool, self.cache, request.method, request.headers)
+            # Hedges send the same bytes twice, so they need the whole body up front
+            if decode or self.pool.policy == "least_tokens" or self.hedger is not None or request.content_length is None:
+                body = await request.read()
+                if decode:
+                    try:
+                        payload = json.loads(body)
+                    except ValueError:
+                        pass
+                est_tokens = estimate_prompt_tokens(payload) if payload is not None else scan_prompt_tokens(body)
+                if self.forward_mode == "json" and payload is not None:
+                    body = json.dumps(payload).encode("utf-8")
+            else:
+                # Nothing routing needs is in the body: relay it to the replica as it arrives
+                body = BodyTee(request.content, request.content_length)
+        key = affinity_key(request.headers, payload) if self.pool.policy == "affinity" else None
+
+        hedge = self.hedger is not None and isinstance(body, bytes) and not scan_is_stream(body)
+        priority = priority_class(request.headers, self.admission.weights) if self.admission is not None else None
+        if self.cache is None or not is_cacheable(request.method, endpoint, payload):
+            if hedge:
+                return await self.admitted(priority, self.hedged_forward(request, endpoint, body, est_tokens, key))
+            return await self.admitted(priority, self.forward(request, endpoint, body, est_tokens, key))
+
+        async def compute():
+            if hedge:
+                response = await self.admitted(priority, self.hedged_forward(request, endpoint, body, est_tokens, key))
+            else:
+                response = await self.admitted(priority, self.forward(request, endpoint, body, est_tokens, key, buffer=True))
+            return response.status, dict(response.headers), response.body
+
+        status, headers, content = await self.cache.get_or_compute_async(request_cache_key(endpoint, payload), compute)
+        return web.Response(body=content, status=status, headers=headers)
+
+    async def admitted(self, priority, forward):
+        """Await the `forward` coroutine once the admission controller grants a slot; a fast 429 if it won't."""
+        if self.admission is None:
+            return await forward
+        try:
+            await self.admission.admit_async(priority)
+        except AdmissionRejected as e:
+            forward.close()
+            return web.json_response({"error": str(e)}, status=429, headers={"Retry-After": str(e.retry_after)})
+        except asyncio.CancelledError:
+            forward.close()
+            raise
+        try:
+            return await forward
+        finally:
+            self.admission.release()
+
+    async def hedged_forward(self, request, endpoint, body, est_tokens, key):
+        start = time.perf_counter()
+        tried = []
+        primary = asyncio.ensure_future(self.forward(request, endpoint, body, est_tokens, key, buffer=True, tried=tried))
+        pending = {primary}
+        hedge = None
+        delay = self.hedger.delay(endpoint)
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and self.hedger.try_hedge(endpoint):
+                # Both share `tried` (one event loop, no locking needed), so neither one's retries land on the other's replica
+                hedge = asyncio.ensure_future(self.forward(request, endpoint, body, est_tokens, key, buffer=True,
+                                                           tried=tried, policy="least_requests"))
+                pending.add(hedge)
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    response = task.result()
+                    # An error only wins if there is nothing else left to wait for
+                    if response.status not in RETRYABLE_STATUS or not pending:
+                        if response.status < 400:
+                            self.hedger.record(endpoint, time.perf_counter() - start, hedge_won=task is hedge)
+                        return response
+        finally:
+            # Cancelling closes the loser's connection, which makes vLLM abort its generation
+            for task in pending:
+                task.cancel()
+
+    async def forward(self, request, endpoint, body, est_tokens, key, buffer=False, tried=None, policy=None):
+        """
+        Send the request to a replica and relay the answer, streamed or (`buffer=True`) read in full.
+        `body` is bytes, a `BodyTee` still being received from the client, or None. Replicas already
+        used are appended to `tried` and never picked again for this request.
+        """
+        headers = filter_headers(request.headers)
+        if isinstance(body, BodyTee):
+            headers["Content-Length"] = str(body.length)
+
+        # vLLM's OpenAI endpoints are stateless, so a request that failed on one replica is retried
+        # on a replica it has not tried yet, as long as nothing has been sent to the client.
+        tried = [] if tried is None else tried
+        result = web.json_response({"error": "No healthy vLLM replica available"}, status=503)
+        for attempt in range(self.pool.max_retries + 1):
+            try:
+                backend = self.pool.acquire(est_tokens, key, exclude=tried, policy=policy)
+            except NoBackendAvailable:
+                break
+            tried.append(backend.url)
+            url = f"{backend.url}/v1/{endpoint}"
+
+            start = time.perf_counter()
+            status = None
+            received = 0
+            usage = {}
+            response = None
+            try:
+                async with self.session.request(
+                    request.method,
+                    url,
+                    headers=headers,
+                    params=request.query,
+                    data=body.async_reader() if isinstance(body, BodyTee) else body or None,
+                ) as upstream:
+                    ok = upstream.status not in RETRYABLE_STATUS
+                    self.pool.record_result(backend, ok)
+                    retry = not ok and attempt < self.pool.max_retries
+                    if retry or buffer:
+                        content = await upstream.read()
+                        status, received, usage = upstream.status, len(content), scan_usage(content)
+                        result = web.Response(body=content, status=upstream.status, headers=filter_headers(upstream.headers))
+                        if retry:
+                            continue
+                        return result
+
+                    response = web.StreamResponse(status=upstream.status, headers=filter_headers(upstream.headers))
+                    if upstream.content_length is not None:
+                        response.content_length = upstream.content_length
+                    await response.prepare(request)
+                    async for chunk in upstream.content.iter_any():
+                        received += len(chunk)
+                        # Only the final chunk of a stream carries `usage`
+                        usage.update(scan_usage(chunk))
+                        await response.write(chunk)
+                    await response.write_eof()
+                    status = upstream.status
+                    return response
+
+            except asyncio.CancelledError:
+                # Lost a hedge race
+                status = "cancelled"
+                raise
+            except (ClientError, ConnectionResetError, asyncio.TimeoutError) as e:
+                # aiohttp's ClientConnectionResetError is both a ClientError and a ConnectionResetError,
+                # and is raised for a reset by either side: only the client's own transport tells them apart.
+                if isinstance(e, ConnectionResetError) and (request.transport is None or request.transport.is_closing()):
+                    # Client went away; closing the upstream context aborts the backend request.
+                    status = "client_closed"
+                    if response is None or not response.prepared:
+                        raise
+                    return response
+                self.pool.record_result(backend, False)
+                if response is not None and response.prepared:
+                    # Headers already went out; all we can do is cut the stream.
+                    raise
+                result = web.json_response({"error": f"Failed to connect to backend {url}", "details": str(e)}, status=502)
+            finally:
+                self.pool.release(backend, est_tokens)
+                if self.metrics is not None:
+                    self.metrics.observe(backend.url, status, time.perf_counter() - start, len(body) if body else 0, received, usage)
+
+        return result
+
+    async def health(self, request):
+        return web.Response(text="vLLM load balancer is running.")
+
+    async def prometheus_metrics(self, request):
+        return web.Response(text=self.metrics.render(self.pool, self.cache, self.admission), content_type="text/plain")
+
+    async def stats(self, request):
+        stats = self.pool.stats()
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.hedger is not None:
+            stats["hedging"] = self.hedger.stats()
+        if self.admission is not None:
+            stats["admission"] = self.admission.stats()
+        return web.json_response(stats)
+
+    async def backends(self, request):
+        data = None
+        if request.can_read_body:
+            try:
+                data = await request.json()
+            except ValueError:
+                pass
+        body, status = handle_registry_request(self.pool, request.method, request.match_info.get("action", ""), data)
+        return web.json_response(body, status=status)
+
+    def make_app(self):
+        app = web.Application(client_max_size=0)
+        app.router.add_route("*", "/v1/{endpoint:.*}", self.proxy_vllm)
+        app.router.add_get("/", self.health)
+        app.router.add_get("/stats", self.stats)
+        if self.metrics is not None:
+            app.router.add_get("/metrics", self.prometheus_metrics)
+        app.router.add_route("*", "/backends", self.backends)
+        app.router.add_post("/backends/{action}", self.backends)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def run_async_router(host, port, pool, connections_per_backend=256, cache=None, forward_mode="raw", hedger=None, admission=None,
+                     metrics=None):
+    router = AsyncRouter(pool, connections_per_backend=connections_per_backend, cache=cache, forward_mode=forward_mode,
+                         hedger=hedger, admission=admission, metrics=metrics)
+    web.run_app(router.make_app(), host=host, port=port, access_log=None)
@@ -0,0 +1,136 @@
+"""
+Benchmark keyboard actions on a local fixture page: the old executors (per-key typing, hotkeys with
+a 1 s pause after every key event) against `input_actions.press_keys` / `type_text`.
+
+The fixture has a plain input, a textarea, a contenteditable, a search box that builds suggestions
+on keyup, and a digits-only input that rewrites its value on every input event. Every run checks
+the field ends up with the expected text (and, for the search box, that key events fired), so a
+faster path that breaks a page shows up as a failure instead of a speedup.
+
+    python benchmarks/bench_input.py --lengths 10 100 500 --repeats 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from playwright.async_api import async_playwright
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cua_utils import CUA_KEY_TO_PLAYWRIGHT_KEY
+from input_actions import press_keys, type_text
+
+FIXTURE = """
+<html><body>
+<input id="text" type="text">
+<textarea id="area"></textarea>
+<div id="rich" contenteditable="true" style="min-height: 2em"></div>
+<input id="search" type="search"><ul id="suggestions"></ul>
+<input id="digits" type="text">
+<script>
+  window.keyups = 0;
+  document.getElementById('search').addEventListener('keyup', (e) => {
+    window.keyups += 1;
+    document.getElementById('suggestions').innerHTML = '<li>' + e.target.value + ' recipes</li>';
+  });
+  document.getElementById('digits').addEventListener('input', (e) => {
+    e.target.value = e.target.value.replace(/[^0-9]/g, '');
+  });
+</script>
+</body></html>
+"""
+
+FIELD_VALUE_JS = "(id) => { const el = document.getElementById(id); return el.isContentEditable ? el.innerText : el.value; }"
+
+
+async def legacy_hotkey(page, keys):
+    mapped = [CUA_KEY_TO_PLAYWRIGHT_KEY.get(key, key) for key in keys]
+    for key in mapped:
+        await page.keyboard.down(key)
+        await asyncio.sleep(1)
+    for key in reversed(mapped):
+        await page.keyboard.up(key)
+        await asyncio.sleep(1)
+
+
+async def legacy_type(page, text):
+    await page.keyboard.type(text)
+
+
+async def fast_type(page, text):
+    await type_text(page, text)
+
+
+def sample_text(length, field):
+    if field == "digits":
+        return ("4155550123" * (length // 10 + 1))[:length]
+    return ("vegetarian lasagna with zucchini and spinach " * (length // 45 + 1))[:length]
+
+
+async def time_typing(page, field, text, typer, repeats):
+    """Mean ms per action, and whether the field held exactly `text` (and saw key events) every time."""
+    total = 0.0
+    correct = True
+    for _ in range(repeats):
+        await page.set_content(FIXTURE)
+        await page.focus(f"#{field}")
+        start = time.perf_counter()
+        await typer(page, text)
+        total += time.perf_counter() - start
+        value = await page.evaluate(FIELD_VALUE_JS, field)
+        correct &= value.strip() == text.strip()
+        if field == "search":
+            correct &= await page.evaluate("window.keyups") > 0
+    return total / repeats * 1000, correct
+
+
+async def time_hotkey(page, keys, presser, repeats):
+    total = 0.0
+    correct = True
+    for _ in range(repeats):
+        await page.set_content(FIXTURE)
+        await page.fill("#text", "select me")
+        await page.focus("#text")
+        start = time.perf_counter()
+        await presser(page, keys)
+        total += time.perf_counter() - start
+        selected = await page.evaluate("() => { const el = document.getElementById('text'); return el.selectionEnd - el.selectionStart; }")
+        correct &= selected == len("select me")
+    return total / repeats * 1000, correct
+
+
+async def run(args):
+    rows = []
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(headless=True)
+        page = await browser.new_page()
+        keys = ["ctrl", "a"]
+        legacy = await time_hotkey(page, keys, legacy_hotkey, args.legacy_hotkey_repeats)
+        fast = await time_hotkey(page, keys, press_keys, args.repeats)
+        rows.append(("hotkey ctrl a", "text", legacy, fast))
+        for field in args.fields:
+            for length in args.lengths:
+                text = sample_text(length, field)
+                legacy = await time_typing(page, field, text, legacy_type, args.repeats)
+                fast = await time_typing(page, field, text, fast_type, args.repeats)
+                rows.append((f"type {length} chars", field, legacy, fast))
+        await browser.close()
+
+    print(f"{'action':<18} {'field':<8} {'old ms':>9} {'new ms':>9} {'speedup':>8} {'old ok':>7} {'new ok':>7}")
+    for action, field, (old_ms, old_ok), (new_ms, new_ok) in rows:
+        print(f"{action:<18} {field:<8} {old_ms:>9.1f} {new_ms:>9.1f} {old_ms / new_ms:>7.1f}x {str(old_ok):>7} {str(new_ok):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--fields", type=str, nargs="+", default=["text", "area", "rich", "search", "digits"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--legacy_hotkey_repeats", type=int, default=1, help="The old hotkey path takes 4 s per chord")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Microbenchmark of the conversation bookkeeping in `run_uitars.py`.
+
+Replays synthetic trajectories of `--steps` iterations and compares the old per-step work, two
+`clip_message_and_obs` passes over the whole history (`clip_message_and_obs_text_only` in text
+mode), against appending to a `MessageWindow`. Every few steps is a format error, which adds a
+plain-text user message as in the runner. Both produce the message list sent to the model at each
+step, and the lists are checked to be identical.
+
+    python benchmarks/bench_message_window.py --steps 100 500 --max_attached_imgs 1 3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompts import COMPUTER_USE_DOUBAO, SYSTEM_PROMPT_TEXT_ONLY
+from utils import MessageWindow, clip_message_and_obs, clip_message_and_obs_text_only
+
+FAKE_IMAGE = "data:image/png;base64," + "A" * 200_000
+FAKE_TREE = "\n".join(f"[{i}] link 'Item {i}'" for i in range(200))
+RESPONSE = "Thought: The search box is at the top of the page, I will click it. Action: click(start_box='(512,64)')"
+
+
+def make_trajectory(steps, text_only, error_every):
+    """The user and assistant messages of a trajectory, in the order the runner appends them."""
+    trajectory = []
+    for it in range(1, steps + 1):
+        if error_every and it % error_every == 0:
+            trajectory.append({'role': 'user', 'content': "Format ERROR: 'Action' must be included in your reply."})
+        elif text_only:
+            trajectory.append({'role': 'user', 'content': f"Observation: please analyze the accessibility tree and give the Thought and Action.\n{FAKE_TREE}"})
+        else:
+            trajectory.append({'role': 'user', 'content': [
+                {'type': 'text', 'text': f"Observation: step {it}, please analyze the attached screenshot and give the Thought and Action. "},
+                {'type': 'image_url', 'image_url': {"url": FAKE_IMAGE}},
+            ]})
+        trajectory.append({'role': 'assistant', 'content': RESPONSE})
+    return trajectory
+
+
+def run_clip(system_msg, trajectory, max_attached_imgs, text_only):
+    clip = clip_message_and_obs_text_only if text_only else clip_message_and_obs
+    messages = [system_msg]
+    sent = []
+    for user_msg, assistant_msg in zip(trajectory[::2], trajectory[1::2]):
+        messages = clip(messages + [user_msg], max_attached_imgs)
+        messages = clip(messages, max_attached_imgs)
+        # The runner appends the response in place, keep a snapshot of what was sent
+        sent.append(list(messages))
+        messages.append(assistant_msg)
+    return sent
+
+
+def run_window(system_msg, trajectory, max_attached_imgs, text_only):
+    window = MessageWindow(system_msg, max_attached_imgs, text_only=text_only)
+    sent = []
+    for user_msg, assistant_msg in zip(trajectory[::2], trajectory[1::2]):
+        window.append(user_msg)
+        sent.append(window.messages)
+        window.append(assistant_msg)
+    return sent
+
+
+def timed(fn, *args, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--max_attached_imgs", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--error_every", type=int, default=7, help="Make every n-th step a format error, 0 for none")
+    parser.add_argument("--repeats", type=int, default=3, help="Best of this many runs is reported")
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'steps':>6} {'imgs':>5} {'clip ms':>9} {'window ms':>10} {'clip us/step':>13} {'window us/step':>15} {'speedup':>8}")
+    for text_only in (False, True):
+        system_msg = {'role': 'system', 'content': SYSTEM_PROMPT_TEXT_ONLY if text_only else COMPUTER_USE_DOUBAO}
+        for steps in args.steps:
+            trajectory = make_trajectory(steps, text_only, args.error_every)
+            for max_attached_imgs in args.max_attached_imgs:
+                clip_s, clip_sent = timed(run_clip, system_msg, trajectory, max_attached_imgs, text_only, repeats=args.repeats)
+                window_s, window_sent = timed(run_window, system_msg, trajectory, max_attached_imgs, text_only, repeats=args.repeats)
+                if clip_sent != window_sent:
+                    raise SystemExit(f"MessageWindow diverges from the clip functions ({steps} steps, {max_attached_imgs} images, text_only={text_only})")
+                print(f"{'text' if text_only else 'image':<6} {steps:>6} {max_attached_imgs:>5} {clip_s * 1000:>9.2f} {window_s * 1000:>10.2f} "
+                      f"{clip_s / steps * 1e6:>13.1f} {window_s / steps * 1e6:>15.1f} {clip_s / window_s:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
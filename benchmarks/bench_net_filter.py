@@ -0,0 +1,131 @@
+"""
+Benchmark the network profiles of the runners (`--net_profile off|trackers|lean`) on the start
+pages of a task file.
+
+Every site is loaded in a fresh browser context once per profile (and once more without blocking,
+to measure how much a page changes between two identical loads). For each load it reports the
+time to the `load` event and to network idle, the bytes transferred, and the requests blocked.
+The viewport screenshot of every profile is compared with the unblocked one: the share of pixels
+that differ, next to the same share between the two unblocked loads. A profile keeps screenshots
+visually equivalent on a site when its difference stays near that noise floor.
+
+    python benchmarks/bench_net_filter.py --test_file data/WebVoyager_data.jsonl --num_sites 15
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageChops
+from playwright.async_api import async_playwright
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from net_filter import NetworkFilter, read_block_list
+from tracing import site_name
+
+
+def start_pages(test_file, num_sites):
+    """The first start URL of each website in the task file."""
+    sites = OrderedDict()
+    with open(test_file, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                task = json.loads(line)
+                sites.setdefault(site_name(task), task["web"])
+    return list(sites.items())[:num_sites]
+
+
+def changed_share(png_a, png_b, threshold=16):
+    """Share of pixels whose largest channel difference exceeds `threshold`."""
+    a = Image.open(io.BytesIO(png_a)).convert("RGB")
+    b = Image.open(io.BytesIO(png_b)).convert("RGB")
+    if a.size != b.size:
+        return 1.0
+    diff = ImageChops.difference(a, b).convert("L").point(lambda v: 255 if v > threshold else 0)
+    return diff.histogram()[255] / (a.size[0] * a.size[1])
+
+
+async def load(browser, url, net_filter, args):
+    context = await browser.new_context(viewport={"width": args.window_width, "height": args.window_height},
+                                        service_workers=net_filter.service_workers)
+    sizes = []
+
+    async def measure(request):
+        try:
+            s = await request.sizes()
+            sizes.append(s["responseHeadersSize"] + s["responseBodySize"])
+        except Exception:
+            pass
+
+    pending = set()
+    context.on("requestfinished", lambda request: pending.add(asyncio.ensure_future(measure(request))))
+    await net_filter.attach(context)
+    page = await context.new_page()
+    result = {"load_ms": float("nan"), "idle_ms": float("nan")}
+    start = time.perf_counter()
+    try:
+        await page.goto(url, wait_until="load", timeout=args.timeout * 1000)
+        result["load_ms"] = (time.perf_counter() - start) * 1000
+        await page.wait_for_load_state("networkidle", timeout=args.timeout * 1000)
+        result["idle_ms"] = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        print(f"  {url} ({net_filter.profile}): {e.__class__.__name__}")
+    await asyncio.sleep(args.settle)
+    result["screenshot"] = await page.screenshot()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await net_filter.close()
+    result["mb"] = sum(sizes) / 1024 / 1024
+    result["blocked"] = sum(net_filter.blocked.values())
+    await context.close()
+    return result
+
+
+async def run(args):
+    extra = read_block_list(args.net_block_list) if args.net_block_list else []
+    sites = start_pages(args.test_file, args.num_sites)
+    rows = []
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(headless=True)
+        for site, url in sites:
+            print(f"{site}: {url}")
+            baseline = await load(browser, url, NetworkFilter("off"), args)
+            again = await load(browser, url, NetworkFilter("off"), args)
+            noise = changed_share(baseline["screenshot"], again["screenshot"])
+            rows.append((site, "off", baseline, 0.0, noise))
+            for profile in args.profiles:
+                result = await load(browser, url, NetworkFilter(profile, extra_domains=extra, site_url=url), args)
+                rows.append((site, profile, result, changed_share(baseline["screenshot"], result["screenshot"]), noise))
+        await browser.close()
+
+    print(f"\n{'site':<24} {'profile':<9} {'load ms':>9} {'idle ms':>9} {'MB':>7} {'blocked':>8} {'diff %':>7} {'noise %':>8}")
+    for site, profile, r, diff, noise in rows:
+        print(f"{site[:24]:<24} {profile:<9} {r['load_ms']:>9.0f} {r['idle_ms']:>9.0f} {r['mb']:>7.2f} {r['blocked']:>8} "
+              f"{100 * diff:>7.2f} {100 * noise:>8.2f}")
+    for profile in ["off"] + args.profiles:
+        results = [(r, diff, noise) for _, p, r, diff, noise in rows if p == profile]
+        mb = sum(r["mb"] for r, _, _ in results)
+        over = sum(diff > noise + args.tolerance for _, diff, noise in results)
+        print(f"{profile}: {mb:.1f} MB over {len(results)} sites, {over} screenshots differ beyond the noise floor")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_file", type=str, default="data/WebVoyager_data.jsonl")
+    parser.add_argument("--num_sites", type=int, default=15)
+    parser.add_argument("--profiles", type=str, nargs="+", default=["trackers", "lean"])
+    parser.add_argument("--net_block_list", type=str, default=None, help="File of extra domains to block, one per line")
+    parser.add_argument("--window_width", type=int, default=1024)
+    parser.add_argument("--window_height", type=int, default=768)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for load and for network idle")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait before the screenshot")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Share of changed pixels above the noise floor that counts as a visual change")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
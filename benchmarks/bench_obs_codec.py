@@ -0,0 +1,273 @@
+"""
+Benchmark the observation encodings of `run_uitars.py` (`--obs_format`, `--obs_quality`,
+`--obs_max_pixels`) against sending full-resolution PNG.
+
+For every variant it reports, over a set of screenshots:
+  * request size: encoded and base64 bytes, encode time, and the image tokens Qwen2.5-VL
+    (one per 28x28 patch) and GPT-4o (85 + 170 per 512px tile) would charge;
+  * prefill latency (with --url): time to first token of a one-step request, streamed with one
+    completion token, and the prompt tokens the server reports;
+  * action drift (with --url and --trajectory_dir): every recorded screenshot is sent with the
+    task of its trajectory, once as full-resolution PNG and once per variant, at temperature 0.
+    A step drifts when the variant's action type differs from the PNG one; for clicks and other
+    pointed actions the distance between the two points is measured in page pixels.
+
+Screenshots come from --screenshot_dir, else from the trajectories, else are synthesised.
+
+    python benchmarks/bench_obs_codec.py --variants png jpeg:90 jpeg:75 webp:80 --max_pixels 0 1003520 501760
+    python benchmarks/bench_obs_codec.py --url http://localhost:8000/v1/chat/completions --trajectory_dir results/20250101_00_00_00
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+
+import aiohttp
+
+from load_gen import OBS_PROMPT, percentile, synthetic_screenshot
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from obs_encoder import ObservationEncoder
+from prompts import COMPUTER_USE_DOUBAO
+from uitars_action_parser import parse_action_to_structure_output
+
+TASK_PROMPT = "Now given a task: find the opening hours of the nearest store  Please interact with https://www.example.com and get the answer. \n"
+
+
+def parse_variant(spec, max_pixels):
+    """'jpeg:75' -> encoder; the quality is ignored for png."""
+    fmt, _, quality = spec.partition(":")
+    return ObservationEncoder(fmt=fmt, quality=int(quality or 85), max_pixels=max_pixels)
+
+
+def variant_name(encoder):
+    name = encoder.fmt if encoder.fmt == "png" else f"{encoder.fmt}:{encoder.quality}"
+    return f"{name}@{encoder.max_pixels}" if encoder.max_pixels else name
+
+
+def qwen_image_tokens(width, height):
+    return max(1, round(width / 28)) * max(1, round(height / 28))
+
+
+def gpt_image_tokens(width, height):
+    """High-detail cost: fit in 2048x2048, shortest side scaled to 768, then 170 per 512px tile plus 85."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def make_request(model, text, obs, max_tokens, stream):
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": COMPUTER_USE_DOUBAO},
+            {"role": "user", "content": [
+                {"type": "text", "text": text},
+                {"type": "image_url", "image_url": {"url": f"data:{obs.mime};base64,{obs.b64}"}},
+            ]},
+        ],
+        "max_completion_tokens": max_tokens,
+        "temperature": 0,
+        "stream": stream,
+    }
+    if stream:
+        request["stream_options"] = {"include_usage": True}
+    return json.dumps(request).encode()
+
+
+def load_trajectories(trajectory_dir):
+    """(task text, screenshot paths) for every task directory holding an interact_messages.json."""
+    trajectories = []
+    for messages_path in sorted(glob.glob(os.path.join(trajectory_dir, "**", "interact_messages.json"), recursive=True)):
+        task_dir = os.path.dirname(messages_path)
+        with open(messages_path, encoding="utf-8") as f:
+            messages = json.load(f)
+        first = next((m for m in messages if m["role"] == "user"), None)
+        if first is None:
+            continue
+        text = first["content"] if isinstance(first["content"], str) else first["content"][0]["text"]
+        paths = sorted(glob.glob(os.path.join(task_dir, "screenshot*.png")),
+                       key=lambda p: int(re.search(r"(\d+)\.png$", p).group(1)))
+        if paths:
+            trajectories.append((text, paths))
+    return trajectories
+
+
+def load_screenshots(args, trajectories):
+    if args.screenshot_dir:
+        paths = sorted(glob.glob(os.path.join(args.screenshot_dir, "**", "*.png"), recursive=True))
+    else:
+        paths = [path for _, step_paths in trajectories for path in step_paths]
+    if not paths:
+        rng = random.Random(args.seed)
+        return [synthetic_screenshot(args.window_width, args.window_height, rng) for _ in range(args.num_screenshots)]
+    images = []
+    for path in paths[:args.num_screenshots]:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def measure_size(encoder, screenshots, model):
+    encode_ms, nbytes, request_bytes = [], [], []
+    for png in screenshots:
+        start = time.perf_counter()
+        obs = encoder.encode(png)
+        encode_ms.append((time.perf_counter() - start) * 1000)
+        nbytes.append(obs.nbytes)
+        request_bytes.append(len(make_request(model, TASK_PROMPT + OBS_PROMPT, obs, 1, False)))
+    return {
+        "size": f"{obs.width}x{obs.height}",
+        "kb": sum(nbytes) / len(nbytes) / 1024,
+        "request_kb": sum(request_bytes) / len(request_bytes) / 1024,
+        "encode_ms": percentile(encode_ms, 50),
+        "qwen_tokens": qwen_image_tokens(obs.width, obs.height),
+        "gpt_tokens": gpt_image_tokens(obs.width, obs.height),
+    }
+
+
+async def measure_prefill(session, args, encoder, screenshots):
+    ttfts = []
+    prompt_tokens = []
+    for _ in range(args.repeats):
+        for png in screenshots:
+            body = make_request(args.model, TASK_PROMPT + OBS_PROMPT, encoder.encode(png), 1, True)
+            start = time.perf_counter()
+            first = None
+            async with session.post(args.url, data=body, headers={"Content-Type": "application/json"}) as resp:
+                resp.raise_for_status()
+                async for line in resp.content:
+                    if not line.startswith(b"data: {"):
+                        continue
+                    if first is None:
+                        first = time.perf_counter() - start
+                    chunk = json.loads(line[6:])
+                    if chunk.get("usage"):
+                        prompt_tokens.append(chunk["usage"]["prompt_tokens"])
+            ttfts.append(first if first is not None else time.perf_counter() - start)
+    return {
+        "ttft_p50": percentile(ttfts, 50) * 1000,
+        "ttft_p90": percentile(ttfts, 90) * 1000,
+        "prompt_tokens": sum(prompt_tokens) / len(prompt_tokens) if prompt_tokens else float("nan"),
+    }
+
+
+async def predict(session, args, text, obs):
+    """(action type, point in page pixels or None) of the model's first action, or None if unparsable."""
+    body = make_request(args.model, text, obs, args.max_tokens, False)
+    async with session.post(args.url, data=body, headers={"Content-Type": "application/json"}) as resp:
+        resp.raise_for_status()
+        answer = await resp.json()
+    content = answer["choices"][0]["message"]["content"]
+    try:
+        action = parse_action_to_structure_output(content, factor=1000, origin_resized_height=obs.height,
+                                                  origin_resized_width=obs.width, model_type="doubao",
+                                                  image_size=obs.size)[0]
+    except Exception:
+        return None
+    box = action["action_inputs"].get("start_box")
+    point = None
+    if box:
+        box = json.loads(box)
+        point = (box[0], box[1])
+    return action["action_type"], point
+
+
+async def measure_drift(session, args, encoders, trajectories):
+    reference = ObservationEncoder()
+    drift = {variant_name(e): {"steps": 0, "same_type": 0, "unparsable": 0, "distances": []} for e in encoders}
+    for text, paths in trajectories:
+        for path in paths:
+            with open(path, "rb") as f:
+                png = f.read()
+            base_obs = reference.encode(png)
+            base = await predict(session, args, text, base_obs)
+            if base is None:
+                continue
+            for encoder in encoders:
+                result = drift[variant_name(encoder)]
+                result["steps"] += 1
+                pred = await predict(session, args, text, encoder.encode(png))
+                if pred is None:
+                    result["unparsable"] += 1
+                    continue
+                if pred[0] != base[0]:
+                    continue
+                result["same_type"] += 1
+                if base[1] and pred[1]:
+                    # Both points are fractions of the image; scale them to the captured page
+                    dx = (pred[1][0] - base[1][0]) * base_obs.width
+                    dy = (pred[1][1] - base[1][1]) * base_obs.height
+                    result["distances"].append(math.hypot(dx, dy))
+    return drift
+
+
+async def run_online(args, encoders, screenshots, trajectories):
+    prefill = {}
+    drift = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+        for encoder in encoders:
+            prefill[variant_name(encoder)] = await measure_prefill(session, args, encoder, screenshots)
+        if trajectories:
+            drift = await measure_drift(session, args, encoders, trajectories)
+    return prefill, drift
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variants", type=str, nargs="+", default=["png", "jpeg:90", "jpeg:75", "webp:80"],
+                        help="format[:quality] of each encoding to compare")
+    parser.add_argument("--max_pixels", type=int, nargs="+", default=[0, 1003520, 501760],
+                        help="Pixel budgets to combine with every variant, 0 keeps the capture size")
+    parser.add_argument("--screenshot_dir", type=str, default=None, help="Measure the .png files found under this directory")
+    parser.add_argument("--trajectory_dir", type=str, default=None, help="Results directory of an earlier run, for the drift check")
+    parser.add_argument("--num_screenshots", type=int, default=16)
+    parser.add_argument("--window_width", type=int, default=1024)
+    parser.add_argument("--window_height", type=int, default=768)
+    parser.add_argument("--url", type=str, default=None, help="OpenAI-compatible chat completions endpoint for latency and drift")
+    parser.add_argument("--model", type=str, default="ByteDance-Seed/UI-TARS-1.5-7B")
+    parser.add_argument("--repeats", type=int, default=2, help="Prefill requests per screenshot and variant")
+    parser.add_argument("--max_tokens", type=int, default=1000)
+    parser.add_argument("--tolerance", type=float, default=14, help="Click distance in page pixels still counted as the same target")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    encoders = [parse_variant(spec, max_pixels) for max_pixels in args.max_pixels for spec in args.variants]
+    trajectories = load_trajectories(args.trajectory_dir) if args.trajectory_dir else []
+    screenshots = load_screenshots(args, trajectories)
+    print(f"{len(screenshots)} screenshots, {sum(map(len, screenshots)) / len(screenshots) / 1024:.0f} KB PNG each, "
+          f"{sum(len(paths) for _, paths in trajectories)} recorded steps", flush=True)
+
+    sizes = {variant_name(e): measure_size(e, screenshots, args.model) for e in encoders}
+    prefill, drift = asyncio.run(run_online(args, encoders, screenshots, trajectories)) if args.url else ({}, {})
+
+    print(f"{'variant':<20} {'image':>10} {'KB':>8} {'req KB':>8} {'enc ms':>7} {'qwen tok':>9} {'gpt tok':>8}"
+          + (f" {'ttft p50':>9} {'ttft p90':>9} {'prompt tok':>11}" if prefill else ""))
+    for name, s in sizes.items():
+        line = (f"{name:<20} {s['size']:>10} {s['kb']:>8.1f} {s['request_kb']:>8.1f} {s['encode_ms']:>7.1f} "
+                f"{s['qwen_tokens']:>9} {s['gpt_tokens']:>8}")
+        if name in prefill:
+            p = prefill[name]
+            line += f" {p['ttft_p50']:>9.1f} {p['ttft_p90']:>9.1f} {p['prompt_tokens']:>11.0f}"
+        print(line)
+
+    if drift:
+        print(f"\n{'variant':<20} {'steps':>6} {'same type':>10} {'unparsable':>11} {'px p50':>7} {'px p90':>7} {'within tol':>11}")
+        for name, d in drift.items():
+            steps = max(d["steps"], 1)
+            within = sum(dist <= args.tolerance for dist in d["distances"]) / max(len(d["distances"]), 1)
+            print(f"{name:<20} {d['steps']:>6} {100 * d['same_type'] / steps:>9.1f}% {d['unparsable']:>11} "
+                  f"{percentile(d['distances'], 50):>7.1f} {percentile(d['distances'], 90):>7.1f} {100 * within:>10.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmark the vLLM router against local mock backends.
+
+Starts `mock_vllm.py` on a few ports, then measures requests/sec and latency
+percentiles when clients talk to the mocks directly and through each router
+mode. The difference in p99 is the latency added by the router, and the router
+process's CPU time (user + system, from /proc) per request is reported too.
+
+    python benchmarks/bench_router.py --modes flask async --forward_modes raw json --concurrency 128
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[idx]
+
+
+def make_body(image_kb, stream):
+    fake_png = base64.b64encode(os.urandom(image_kb * 1024)).decode()
+    return json.dumps({
+        "model": "mock",
+        "messages": [
+            {"role": "system", "content": "You are a GUI agent."},
+            {"role": "user", "content": [
+                {"type": "text", "text": "Observation: please analyze the attached screenshot and give the Thought and Action."},
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{fake_png}"}},
+            ]},
+        ],
+        "max_completion_tokens": 1000,
+        "stream": stream,
+    }).encode()
+
+
+async def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def fetch_json(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.json()
+
+
+async def run_load(urls, body, num_requests, concurrency, num_sessions=0):
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        async def one(i):
+            nonlocal errors
+            url = urls[i % len(urls)]
+            headers = {"Content-Type": "application/json"}
+            if num_sessions:
+                headers["X-Session-Id"] = f"session{i % num_sessions}"
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, data=body, headers=headers) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                            return
+                except aiohttp.ClientError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "errors": errors,
+    }
+
+
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_process(cmd):
+    return subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", type=str, nargs="+", default=["flask", "async"], choices=["flask", "async"])
+    parser.add_argument("--num_backends", type=int, default=8)
+    parser.add_argument("--base_port", type=int, default=9001)
+    parser.add_argument("--router_port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock backend latency in seconds")
+    parser.add_argument("--num_requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--image_kb", type=int, default=1024, help="Size of the fake screenshot per request")
+    parser.add_argument("--stream", action='store_true')
+    parser.add_argument("--policy", type=str, default="round_robin", help="Router balancing policy")
+    parser.add_argument("--num_sessions", type=int, default=0, help="Tag requests with this many distinct X-Session-Id values")
+    parser.add_argument("--stall_prob", type=float, default=0.0, help="Probability that a mock request stalls for --stall_seconds")
+    parser.add_argument("--stall_seconds", type=float, default=2.0)
+    parser.add_argument("--router_args", type=str, nargs="*", default=[],
+                        help="Extra router flags, e.g. --router_args=--hedge (async mode only)")
+    parser.add_argument("--mock_args", type=str, nargs="*", default=[],
+                        help="Extra mock_vllm.py flags, e.g. --mock_args=--prefill_ms_per_1k=40 --mock_args=--error_rate=0.01")
+    parser.add_argument("--forward_modes", type=str, nargs="+", default=["raw"], choices=["raw", "json"],
+                        help="Router body handling to compare: raw bytes vs decode + re-encode")
+    args = parser.parse_args()
+
+    ports = [args.base_port + i for i in range(args.num_backends)]
+    body = make_body(args.image_kb, args.stream)
+    results = {}
+
+    mocks = start_process([sys.executable, "benchmarks/mock_vllm.py", "--ports", *map(str, ports),
+                           "--latency", str(args.latency), "--stall_prob", str(args.stall_prob),
+                           "--stall_seconds", str(args.stall_seconds), *[a for a in args.mock_args if a]])
+    try:
+        asyncio.run(wait_until_up(f"http://127.0.0.1:{ports[-1]}/v1/models"))
+        direct_urls = [f"http://127.0.0.1:{p}/v1/chat/completions" for p in ports]
+        results["direct"] = asyncio.run(run_load(direct_urls, body, args.num_requests, args.concurrency))
+
+        for mode in args.modes:
+            for forward_mode in args.forward_modes:
+                name = mode if len(args.forward_modes) == 1 else f"{mode}/{forward_mode}"
+                router = start_process([sys.executable, "flask_router.py", "--mode", mode, "--host", "127.0.0.1",
+                                        "--port", str(args.router_port), "--policy", args.policy,
+                                        "--forward_mode", forward_mode, "--vllm_ports", *map(str, ports),
+                                        *[a for a in args.router_args if a]])
+                try:
+                    asyncio.run(wait_until_up(f"http://127.0.0.1:{args.router_port}/"))
+                    router_url = [f"http://127.0.0.1:{args.router_port}/v1/chat/completions"]
+                    cpu_start = process_cpu_seconds(router.pid)
+                    results[name] = asyncio.run(run_load(router_url, body, args.num_requests, args.concurrency, args.num_sessions))
+                    results[name]["cpu_ms"] = (process_cpu_seconds(router.pid) - cpu_start) * 1000 / args.num_requests
+                    if args.policy == "affinity":
+                        time.sleep(1.5)  # let the router scrape the mocks' prefix-cache counters
+                        stats = asyncio.run(fetch_json(f"http://127.0.0.1:{args.router_port}/stats"))
+                        hits = sum(b["prefix_cache_hits"] for b in stats["backends"])
+                        queries = sum(b["prefix_cache_queries"] for b in stats["backends"]) or 1
+                        results[name]["prefix_hit_rate"] = hits / queries
+                finally:
+                    router.terminate()
+                    router.wait()
+    finally:
+        mocks.terminate()
+        mocks.wait()
+
+    base_p99 = results["direct"]["p99"]
+    print(f"{'target':<12} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'+p99 ms':>9} {'cpu ms/req':>11} {'errors':>7}")
+    for name, r in results.items():
+        cpu = f"{r['cpu_ms']:>11.2f}" if "cpu_ms" in r else f"{'-':>11}"
+        print(f"{name:<12} {r['rps']:>9.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} {r['p99'] - base_p99:>9.1f} {cpu} {r['errors']:>7}"
+              + (f"  prefix hit rate {r['prefix_hit_rate']:.2f}" if "prefix_hit_rate" in r else ""))
+
+
+if __name__ == '__main__':
+    main()
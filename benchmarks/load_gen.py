@@ -0,0 +1,247 @@
+"""
+Load generator for the vLLM router, or any OpenAI-compatible `/v1/chat/completions` endpoint.
+
+Replays rollout-shaped traffic: `--num_sessions` trajectories run concurrently, and each sends
+`--steps` requests one after another, like `run_uitars.py`. Each request has the UI-TARS system
+prompt, the task, the growing Thought/Action history and the last `--max_attached_imgs`
+screenshots as base64 PNG data URIs. Screenshots are read from `--screenshot_dir` (for example
+a results directory from an earlier run) or synthesised at `--window_width` x `--window_height`
+so that they compress like real page captures.
+
+Reports throughput, latency percentiles, status counts, token usage and, when the backends
+are `mock_vllm.py`, how many requests each replica served.
+
+    python benchmarks/mock_vllm.py --ports 9001 9002 --prefill_ms_per_1k 40 --decode_ms_per_token 15 &
+    python flask_router.py --mode async --vllm_ports 9001 9002 &
+    python benchmarks/load_gen.py --url http://localhost:8000/v1/chat/completions --num_sessions 32 --steps 10
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from collections import Counter
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompts import COMPUTER_USE_DOUBAO
+
+OBS_PROMPT = "Observation: please analyze the attached screenshot and give the Thought and Action. "
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[idx]
+
+
+def encode_png(width, height, rows):
+    """8-bit RGB PNG from `height` rows of `width * 3` bytes."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    raw = b"".join(b"\x00" + row for row in rows)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+
+def synthetic_screenshot(width, height, rng):
+    """
+    A page-like PNG: white background, a coloured header bar, lines of glyph-like noise and one
+    photo-like block. It lands in the 150-400 KB range of real 1024x768 captures, unlike solid
+    colour (too small) or pure noise (several MB).
+    """
+    white = b"\xff" * (width * 3)
+    header = bytes(rng.choice([(32, 33, 36), (26, 115, 232), (240, 242, 245)])) * width
+    # Roughly a fifth of the pixels on a text line are dark
+    glyph_table = bytes(0x30 if i < 52 else 0xff for i in range(256))
+    photo_x, photo_y = rng.randrange(width // 2, width - width // 4), rng.randrange(80, height // 2)
+    photo_w, photo_h = width // 4, height // 4
+    rows = []
+    for y in range(height):
+        if y < 56:
+            rows.append(header)
+            continue
+        if (y - 56) % 22 < 12:
+            mask = rng.randbytes(width).translate(glyph_table)
+            row = bytearray(width * 3)
+            row[0::3] = row[1::3] = row[2::3] = mask
+            row[:40 * 3] = white[:40 * 3]
+            line_end = rng.randrange(width // 3, width - 40)
+            row[line_end * 3:] = white[line_end * 3:]
+        else:
+            row = bytearray(white)
+        if photo_y <= y < photo_y + photo_h:
+            row[photo_x * 3:(photo_x + photo_w) * 3] = rng.randbytes(photo_w * 3)
+        rows.append(bytes(row))
+    return encode_png(width, height, rows)
+
+
+def load_screenshots(args, rng):
+    """Base64 strings of the screenshots to attach, cycled through by the sessions."""
+    if args.screenshot_dir:
+        paths = sorted(glob.glob(os.path.join(args.screenshot_dir, "**", "*.png"), recursive=True))[:args.num_screenshots]
+        if not paths:
+            raise SystemExit(f"No .png files under {args.screenshot_dir}")
+        images = []
+        for path in paths:
+            with open(path, "rb") as f:
+                images.append(f.read())
+    else:
+        images = [synthetic_screenshot(args.window_width, args.window_height, rng) for _ in range(args.num_screenshots)]
+    return [base64.b64encode(image).decode() for image in images]
+
+
+def clip_images(messages, max_attached_imgs):
+    """Keep the screenshots of the last `max_attached_imgs` observations, reduce older ones to their text."""
+    clipped = []
+    images = 0
+    for message in reversed(messages):
+        if message["role"] == "user" and isinstance(message["content"], list):
+            if images >= max_attached_imgs:
+                message = {"role": "user", "content": message["content"][0]["text"]}
+            images += 1
+        clipped.append(message)
+    return clipped[::-1]
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.statuses = Counter()
+        self.backends = Counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.request_bytes = 0
+
+    def report(self, elapsed):
+        ok = len(self.latencies)
+        lines = [
+            f"requests      {sum(self.statuses.values())} in {elapsed:.1f}s, {ok / elapsed:.1f} ok req/s",
+            f"statuses      {dict(sorted(self.statuses.items(), key=str))}",
+            f"latency ms    p50 {percentile(self.latencies, 50) * 1000:.1f}  p90 {percentile(self.latencies, 90) * 1000:.1f}"
+            f"  p99 {percentile(self.latencies, 99) * 1000:.1f}  max {max(self.latencies, default=float('nan')) * 1000:.1f}",
+        ]
+        if self.ttfts:
+            lines.append(f"ttft ms       p50 {percentile(self.ttfts, 50) * 1000:.1f}  p99 {percentile(self.ttfts, 99) * 1000:.1f}")
+        lines.append(f"tokens        prompt {self.prompt_tokens} ({self.prompt_tokens / elapsed:.0f}/s), "
+                     f"completion {self.completion_tokens} ({self.completion_tokens / elapsed:.0f}/s)")
+        lines.append(f"request size  {self.request_bytes / max(sum(self.statuses.values()), 1) / 1024:.0f} KB avg")
+        if self.backends:
+            total = sum(self.backends.values())
+            lines.append("per backend   " + "  ".join(f"{backend}: {count} ({100 * count / total:.1f}%)"
+                                                       for backend, count in sorted(self.backends.items())))
+        return "\n".join(lines)
+
+
+async def run_session(session, args, session_idx, screenshots, stats, rng):
+    task = f"Now given a task: find the opening hours of store #{session_idx}  Please interact with https://www.example.com and get the answer. \n"
+    messages = [{"role": "system", "content": COMPUTER_USE_DOUBAO}]
+    headers = {"Content-Type": "application/json", "X-Session-Id": f"loadgen-{session_idx}"}
+    if args.priority:
+        headers["X-Priority"] = args.priority
+    for step in range(args.steps):
+        image = screenshots[(session_idx + step) % len(screenshots)]
+        text = task + OBS_PROMPT + "Please proceed with your Thought and Action." if step == 0 else OBS_PROMPT
+        messages.append({"role": "user", "content": [
+            {"type": "text", "text": text},
+            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}},
+        ]})
+        messages = clip_images(messages, args.max_attached_imgs)
+        request = {"model": args.model, "messages": messages, "max_completion_tokens": args.max_tokens, "stream": args.stream}
+        if args.stream:
+            request["stream_options"] = {"include_usage": True}
+        body = json.dumps(request).encode()
+        stats.request_bytes += len(body)
+
+        start = time.perf_counter()
+        content = ""
+        usage = None
+        try:
+            async with session.post(args.url, data=body, headers=headers) as resp:
+                stats.statuses[resp.status] += 1
+                if "X-Mock-Backend" in resp.headers:
+                    stats.backends[resp.headers["X-Mock-Backend"]] += 1
+                if args.stream and resp.status == 200:
+                    first = None
+                    async for line in resp.content:
+                        if first is None:
+                            first = time.perf_counter() - start
+                        if not line.startswith(b"data: {"):
+                            continue
+                        chunk = json.loads(line[6:])
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        if chunk.get("choices"):
+                            content += chunk["choices"][0]["delta"].get("content") or ""
+                    if first is not None:
+                        stats.ttfts.append(first)
+                else:
+                    data = await resp.read()
+                    if resp.status == 200:
+                        answer = json.loads(data)
+                        usage = answer.get("usage")
+                        content = answer["choices"][0]["message"]["content"]
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stats.statuses[type(e).__name__] += 1
+            continue
+        if resp.status != 200:
+            continue
+        stats.latencies.append(time.perf_counter() - start)
+        if usage:
+            stats.prompt_tokens += usage["prompt_tokens"]
+            stats.completion_tokens += usage["completion_tokens"]
+        messages.append({"role": "assistant", "content": content})
+        if args.think_time:
+            # Time the agent spends acting in the browser before the next observation
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_time)
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    screenshots = load_screenshots(args, rng)
+    print(f"{len(screenshots)} screenshots, {sum(len(s) for s in screenshots) / len(screenshots) / 1024:.0f} KB base64 each", flush=True)
+    stats = LoadStats()
+    connector = aiohttp.TCPConnector(limit=args.num_sessions)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(session, args, i, screenshots, stats, random.Random(rng.random()))
+                               for i in range(args.num_sessions)))
+        elapsed = time.perf_counter() - start
+    print(stats.report(elapsed))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://localhost:8000/v1/chat/completions")
+    parser.add_argument("--model", type=str, default="ByteDance-Seed/UI-TARS-1.5-7B")
+    parser.add_argument("--num_sessions", type=int, default=32, help="Concurrent trajectories")
+    parser.add_argument("--steps", type=int, default=10, help="Requests per trajectory")
+    parser.add_argument("--max_attached_imgs", type=int, default=1)
+    parser.add_argument("--max_tokens", type=int, default=1000)
+    parser.add_argument("--stream", action='store_true')
+    parser.add_argument("--think_time", type=float, default=0.0, help="Mean seconds between a response and the next step")
+    parser.add_argument("--priority", type=str, default=None, help="X-Priority header to send")
+    parser.add_argument("--screenshot_dir", type=str, default=None, help="Replay .png files found under this directory")
+    parser.add_argument("--num_screenshots", type=int, default=8)
+    parser.add_argument("--window_width", type=int, default=1024)
+    parser.add_argument("--window_height", type=int, default=768)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import struct
+import time
+import uuid
+
+from aiohttp import web
+
+# Prompt tokens charged per attached image (a 1024x768 screenshot after Qwen2.5-VL smart_resize)
+IMAGE_TOKENS = 1000
+CHARS_PER_TOKEN = 4
+
+
+def make_completion(model, text, prompt_tokens, completion_tokens):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": make_usage(prompt_tokens, completion_tokens),
+    }
+
+
+def make_usage(prompt_tokens, completion_tokens):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def image_dimensions(data):
+    """(width, height) from a PNG, JPEG or WebP header, or None."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data) and data[i] == 0xff:
+            marker = data[i + 1]
+            # Start-of-frame markers carry the size; C4, C8 and CC share the range but are not frames
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return width, height
+            i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+        return None
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        kind = data[12:16]
+        if kind == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if kind == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if kind == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def image_cost(url, image_tokens):
+    """`image_tokens`, or with 0 one token per 28x28 patch as Qwen2.5-VL charges (IMAGE_TOKENS if the size is unknown)."""
+    if image_tokens:
+        return image_tokens
+    size = None
+    if url.startswith("data:"):
+        try:
+            size = image_dimensions(base64.b64decode(url.split(",", 1)[1]))
+        except ValueError:
+            pass
+    if size is None:
+        return IMAGE_TOKENS
+    return max(1, round(size[0] / 28)) * max(1, round(size[1] / 28))
+
+
+def count_prompt_tokens(messages, image_tokens=IMAGE_TOKENS):
+    """Text at ~4 characters per token plus a cost per image, like a VLM's processor would charge."""
+    chars = 0
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                tokens += image_cost(part["image_url"]["url"], image_tokens)
+            else:
+                chars += len(part.get("text", ""))
+    return chars // CHARS_PER_TOKEN + tokens
+
+
+class MockVLLM:
+    """
+    OpenAI-compatible stand-in for one vLLM replica, for benchmarking the router without GPUs.
+
+    A request takes `latency` + `prefill_ms_per_1k` per thousand prompt tokens before its first
+    token, then `decode_ms_per_token` per generated token (or `latency` spread over the stream if
+    that is 0). At most `max_num_seqs` requests run at once and the rest wait, as in vLLM's
+    scheduler. `error_rate` of requests fail with `error_status`. Token counts are reported in
+    `usage` and as cumulative counters on `/metrics`, and every response carries an
+    `X-Mock-Backend` header so load generators can see which replica served it.
+    """
+
+    def __init__(self, port, latency=0.05, num_tokens=20, stall_prob=0.0, stall_seconds=5.0, prefill_ms_per_1k=0.0,
+                 decode_ms_per_token=0.0, max_num_seqs=0, error_rate=0.0, error_status=500, image_tokens=IMAGE_TOKENS):
+        self.port = port
+        self.latency = latency
+        # Occasional long stalls, like a replica stuck behind a huge prefill
+        self.stall_prob = stall_prob
+        self.stall_seconds = stall_seconds
+        self.num_tokens = num_tokens
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.decode_ms_per_token = decode_ms_per_token
+        self.slots = asyncio.Semaphore(max_num_seqs) if max_num_seqs > 0 else None
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.image_tokens = image_tokens
+        self.headers = {"X-Mock-Backend": str(port)}
+        self.running = 0
+        self.waiting = 0
+        # Crude prefix cache: a request whose leading messages were seen before counts as a hit.
+        self.seen_prefixes = set()
+        self.prefix_cache_queries = 0
+        self.prefix_cache_hits = 0
+        self.prompt_tokens = 0
+        self.generation_tokens = 0
+        self.requests_success = 0
+        self.requests_failed = 0
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        if random.random() < self.error_rate:
+            self.requests_failed += 1
+            return web.json_response({"error": {"message": "Injected failure", "type": "InternalServerError"}},
+                                     status=self.error_status, headers=self.headers)
+        self.waiting += 1
+        if self.slots is not None:
+            await self.slots.acquire()
+        self.waiting -= 1
+        self.running += 1
+        try:
+            return await self._chat_completions(request, body)
+        finally:
+            self.running -= 1
+            if self.slots is not None:
+                self.slots.release()
+
+    async def _chat_completions(self, request, body):
+        model = body.get("model", "mock")
+        messages = body.get("messages", [])
+        prompt_tokens = count_prompt_tokens(messages, self.image_tokens)
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens") or self.num_tokens
+        completion_tokens = min(self.num_tokens, max_tokens)
+        prefix = request.headers.get("X-Session-Id") or hashlib.md5(json.dumps(messages[:2]).encode()).hexdigest()
+        self.prefix_cache_queries += prompt_tokens
+        if prefix in self.seen_prefixes:
+            self.prefix_cache_hits += prompt_tokens
+        self.seen_prefixes.add(prefix)
+        self.prompt_tokens += prompt_tokens
+
+        stall = self.stall_seconds if random.random() < self.stall_prob else 0
+        prefill = self.prefill_ms_per_1k * prompt_tokens / 1e6
+        per_token = self.decode_ms_per_token / 1000 if self.decode_ms_per_token else None
+        text = "Thought: mock. Action: wait()"
+        if body.get("stream"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **self.headers})
+            await response.prepare(request)
+            # Without a decode rate, the fixed latency is spread over the generated tokens
+            if per_token is None:
+                per_token = self.latency / max(completion_tokens, 1)
+                first_token = prefill + stall
+            else:
+                first_token = self.latency + prefill + stall
+            try:
+                await asyncio.sleep(first_token)
+                for i in range(completion_tokens):
+                    await asyncio.sleep(per_token)
+                    self.generation_tokens += 1
+                    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                             "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}]}
+                    await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model, "choices": [],
+                             "usage": make_usage(prompt_tokens, completion_tokens)}
+                    await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await response.write(b"data: [DONE]\n\n")
+                await response.write_eof()
+                self.requests_success += 1
+            except ConnectionResetError:
+                pass
+            return response
+        await asyncio.sleep(self.latency + prefill + stall + (per_token or 0) * completion_tokens)
+        self.generation_tokens += completion_tokens
+        self.requests_success += 1
+        return web.json_response(make_completion(model, text, prompt_tokens, completion_tokens), headers=self.headers)
+
+    async def models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    async def metrics(self, request):
+        text = (
+            f'vllm:num_requests_running{{model_name="mock"}} {float(self.running)}\n'
+            f'vllm:num_requests_waiting{{model_name="mock"}} {float(self.waiting)}\n'
+            f'vllm:prefix_cache_queries_total{{model_name="mock"}} {float(self.prefix_cache_queries)}\n'
+            f'vllm:prefix_cache_hits_total{{model_name="mock"}} {float(self.prefix_cache_hits)}\n'
+            f'vllm:prompt_tokens_total{{model_name="mock"}} {float(self.prompt_tokens)}\n'
+            f'vllm:generation_tokens_total{{model_name="mock"}} {float(self.generation_tokens)}\n'
+            f'vllm:request_success_total{{model_name="mock"}} {float(self.requests_success)}\n'
+            f'mock:request_failed_total{{model_name="mock"}} {float(self.requests_failed)}\n'
+        )
+        return web.Response(text=text)
+
+    async def health(self, request):
+        return web.Response(text="")
+
+    def make_app(self):
+        app = web.Application(client_max_size=0)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_get("/metrics", self.metrics)
+        app.router.add_get("/health", self.health)
+        return app
+
+
+async def serve(ports, host="127.0.0.1", **kwargs):
+    """`kwargs` are passed to every `MockVLLM`."""
+    runners = []
+    for port in ports:
+        runner = web.AppRunner(MockVLLM(port, **kwargs).make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        runners.append(runner)
+    print(f"Mock vLLM backends listening on ports {ports}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ports", type=int, nargs="+", default=list(range(9001, 9009)))
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed seconds per request")
+    parser.add_argument("--num_tokens", type=int, default=20, help="Completion tokens per request (capped by max_tokens)")
+    parser.add_argument("--prefill_ms_per_1k", type=float, default=0.0, help="Milliseconds of prefill per 1000 prompt tokens")
+    parser.add_argument("--decode_ms_per_token", type=float, default=0.0, help="Milliseconds per generated token")
+    parser.add_argument("--image_tokens", type=int, default=IMAGE_TOKENS, help="Prompt tokens charged per image, 0 charges by resolution (one per 28x28 patch)")
+    parser.add_argument("--max_num_seqs", type=int, default=0, help="Requests running at once per replica, the rest wait (0: unlimited)")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests that fail with --error_status")
+    parser.add_argument("--error_status", type=int, default=500)
+    parser.add_argument("--stall_prob", type=float, default=0.0, help="Probability that a request stalls")
+    parser.add_argument("--stall_seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.ports, latency=args.latency, num_tokens=args.num_tokens, stall_prob=args.stall_prob,
+                      stall_seconds=args.stall_seconds, prefill_ms_per_1k=args.prefill_ms_per_1k,
+                      decode_ms_per_token=args.decode_ms_per_token, max_num_seqs=args.max_num_seqs,
+                      error_rate=args.error_rate, error_status=args.error_status, image_tokens=args.image_tokens))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import time
+
+from playwright.async_api import async_playwright
+
+
+def browser_launch_args(args):
+    return [
+        f"--window-size={args.window_width},{args.window_height}",
+        "--disable-extensions",
+        "--disable-file-system",
+    ]
+
+
+async def browser_memory_mb(browser):
+    """Resident memory of the browser and all its renderer/GPU processes, or None where /proc is unavailable."""
+    try:
+        cdp = await browser.new_browser_cdp_session()
+        try:
+            info = await cdp.send("SystemInfo.getProcessInfo")
+        finally:
+            await cdp.detach()
+        total_pages = 0
+        for process in info["processInfo"]:
+            with open(f"/proc/{process['id']}/statm") as f:
+                total_pages += int(f.read().split()[1])
+        return total_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class _PooledBrowser:
+    def __init__(self, browser):
+        self.browser = browser
+        self.active = 0
+        self.served = 0
+        self.retiring = False
+
+
+class BrowserPool:
+    """
+    Long-lived Chromium processes that hand out a fresh `BrowserContext` per task. A context has its
+    own cookies, storage and cache, so tasks stay isolated without paying for a cold browser launch.
+
+    At most `size` browsers are kept. A browser is retired after `max_tasks` contexts or once its
+    processes use more than `max_memory_mb`, and closed when its last context is released.
+    Playwright objects belong to the event loop that created them, so a pool must only be used from
+    that loop.
+    """
+
+    def __init__(self, args, size=1, max_tasks=50, max_memory_mb=4096):
+        self.args = args
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_memory_mb = max_memory_mb
+        self.pw = None
+        self.browsers = []
+        self.owners = {}
+        self.lock = asyncio.Lock()
+        self.launches = 0
+        self.launch_seconds = 0.0
+        self.tasks = 0
+        self.context_seconds = 0.0
+        self.recycled = 0
+        # Tasks on their own persistent-profile Chromium (--cache_dir), outside the pool
+        self.persistent = 0
+        self.persistent_seconds = 0.0
+
+    async def _launch(self):
+        start = time.perf_counter()
+        if self.pw is None:
+            self.pw = await async_playwright().start()
+        browser = await self.pw.chromium.launch(
+            chromium_sandbox=True,
+            headless=self.args.headless,
+            args=browser_launch_args(self.args),
+            env={"DISPLAY": ":0"},
+        )
+        self.launches += 1
+        self.launch_seconds += time.perf_counter() - start
+        pooled = _PooledBrowser(browser)
+        browser.on("disconnected", lambda _: self._retire(pooled))
+        self.browsers.append(pooled)
+        return pooled
+
+    def _retire(self, pooled):
+        if not pooled.retiring:
+            pooled.retiring = True
+            self.recycled += 1
+
+    async def _close_if_idle(self, pooled):
+        if pooled.retiring and pooled.active == 0 and pooled in self.browsers:
+            self.browsers.remove(pooled)
+            try:
+                await pooled.browser.close()
+            except Exception as e:
+                logging.warning(f"Failed to close retired browser: {e}")
+
+    async def new_context(self, user_data_dir=None, service_workers="allow"):
+        """
+        Returns (context, page) in a fresh context; hand the context back with `release`.
+        `service_workers="block"` keeps requests out of service workers, which `context.route`
+        cannot see. With
+        `user_data_dir` the context runs in its own Chromium on that profile instead of a pooled one,
+        which costs a cold launch: Chromium only keeps a disk cache for a persistent profile, and a
+        persistent context cannot open further isolated contexts.
+        """
+        start = time.perf_counter()
+        if user_data_dir is not None:
+            context = await self._launch_persistent(user_data_dir, service_workers)
+            try:
+                page = context.pages[0] if context.pages else await context.new_page()
+            except Exception:
+                await self.release(context)
+                raise
+            self.persistent += 1
+            self.persistent_seconds += time.perf_counter() - start
+            return context, page
+        async with self.lock:
+            # A browser that has handed out `max_tasks` contexts takes no more, even before they are released
+            live = [b for b in self.browsers if not b.retiring and b.browser.is_connected() and b.served < self.max_tasks]
+            if len(live) < self.size:
+                pooled = await self._launch()
+            else:
+                pooled = min(live, key=lambda b: b.active)
+            pooled.active += 1
+            pooled.served += 1
+            if pooled.served >= self.max_tasks:
+                self._retire(pooled)
+        context_start = time.perf_counter()
+        try:
+            context = await pooled.browser.new_context(
+                viewport={"width": self.args.window_width, "height": self.args.window_height},
+                device_scale_factor=1,
+                service_workers=service_workers,
+            )
+        except Exception:
+            pooled.active -= 1
+            self._retire(pooled)
+            await self._close_if_idle(pooled)
+            raise
+        self.owners[context] = pooled
+        try:
+            page = await context.new_page()
+        except Exception:
+            # Closes the context and gives the browser its slot back, so it can still be retired
+            await self.release(context)
+            raise
+        self.tasks += 1
+        self.context_seconds += time.perf_counter() - context_start
+        return context, page
+
+    async def _launch_persistent(self, user_data_dir, service_workers="allow"):
+        async with self.lock:
+            if self.pw is None:
+                self.pw = await async_playwright().start()
+        start = time.perf_counter()
+        context = await self.pw.chromium.launch_persistent_context(
+            user_data_dir,
+            chromium_sandbox=True,
+            headless=self.args.headless,
+            args=browser_launch_args(self.args),
+            env={"DISPLAY": ":0"},
+            viewport={"width": self.args.window_width, "height": self.args.window_height},
+            device_scale_factor=1,
+            service_workers=service_workers,
+        )
+        return context
+
+    async def release(self, context):
+        pooled = self.owners.pop(context, None)
+        if pooled is None:
+            # A persistent context owns its browser, which closes with it
+            try:
+                await context.close()
+            except Exception as e:
+                logging.warning(f"Failed to close browser context: {e}")
+            return
+        try:
+            await context.close()
+        except Exception as e:
+            logging.warning(f"Failed to close browser context: {e}")
+        pooled.active -= 1
+        if self.max_memory_mb and not pooled.retiring and pooled.browser.is_connected():
+            memory = await browser_memory_mb(pooled.browser)
+            if memory is not None and memory > self.max_memory_mb:
+                logging.info(f"Recycling browser using {memory:.0f} MB after {pooled.served} tasks")
+                self._retire(pooled)
+        await self._close_if_idle(pooled)
+
+    async def close(self):
+        for pooled in self.browsers:
+            pooled.retiring = True
+            try:
+                await pooled.browser.close()
+            except Exception as e:
+                logging.warning(f"Failed to close browser: {e}")
+        self.browsers = []
+        if self.pw is not None:
+            await self.pw.stop()
+            self.pw = None
+
+    def stats(self):
+        return {
+            "tasks": self.tasks,
+            "launches": self.launches,
+            "recycled": self.recycled,
+            "launch_seconds": self.launch_seconds,
+            "context_seconds": self.context_seconds,
+            "persistent": self.persistent,
+            "persistent_seconds": self.persistent_seconds,
+        }
+
+
+def summarize_pool_stats(stats_list):
+    """Launch overhead saved by the pools, and paid by the tasks that ran outside them, as a log line."""
+    tasks = sum(s["tasks"] for s in stats_list)
+    launches = sum(s["launches"] for s in stats_list)
+    persistent = sum(s.get("persistent", 0) for s in stats_list)
+    lines = []
+    if tasks and launches:
+        avg_launch = sum(s["launch_seconds"] for s in stats_list) / launches
+        avg_context = sum(s["context_seconds"] for s in stats_list) / tasks
+        # Every pooled task skips a launch but still pays for its own context
+        saved = (tasks - launches) * avg_launch - tasks * avg_context
+        lines.append(f"Browser pool: {tasks} tasks on {launches} browser launches ({sum(s['recycled'] for s in stats_list)} recycled). "
+                     f"Cold launch {avg_launch * 1000:.0f} ms, pooled context {avg_context * 1000:.0f} ms; "
+                     f"saved {saved:.1f}s of launch overhead, {saved / tasks * 1000:.0f} ms per task")
+    if persistent:
+        avg_persistent = sum(s.get("persistent_seconds", 0.0) for s in stats_list) / persistent
+        lines.append(f"Warm-cache profiles: {persistent} tasks launched their own browser, {avg_persistent * 1000:.0f} ms per task")
+    return "\n".join(lines) or "No browser tasks run"
@@ -50,22 +50,20 @@ class BasePlaywrightComputer:
     def get_dimensions(self):
         return (1024, 768)
 
-    def __init__(self):
+    def __init__(self, net_filter=None):
         self._playwright = None
         self._browser: Browser | None = None
         self._page: Page | None = None
+        # Optional `net_filter.NetworkFilter` whose rules block requests of the page
+        self._net_filter = net_filter
 
     def __enter__(self):
         # Start Playwright and call the subclass hook for getting browser/page
         self._playwright = sync_playwright().start()
         self._browser, self._page = self._get_browser_and_page()
 
-        # Set up network interception to flag URLs matching domains in BLOCKED_DOMAINS
-        def handle_route(route, request):
-
-            url = request.url
-
-        self._page.route("**/*", handle_route)
+        if self._net_filter is not None:
+            self._net_filter.attach_sync(self._page)
 
         return self
 
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundWriter:
+    """
+    Persists files off the event loop. `write` only enqueues the bytes; a single worker thread
+    drains the queue in batches, writes every file in the batch, then fsyncs them (and their
+    directories) together, so a slow shared filesystem costs one sync per batch instead of
+    stalling each agent step.
+
+    The queue holds at most `max_pending` files; once it is full, `write` waits for room, which
+    bounds memory if the disk falls behind. Call `close` to flush everything before exiting.
+    """
+
+    def __init__(self, max_pending=256, batch_size=32, fsync=True):
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-writer")
+        self.task = None
+        self.files = 0
+        self.bytes = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.sync_seconds = 0.0
+        self.max_queue_depth = 0
+        self.errors = 0
+
+    async def write(self, path, data):
+        """Queue `data` (bytes) to be written to `path`; returns the seconds spent waiting for queue room."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._drain())
+        start = time.perf_counter()
+        await self.queue.put((path, data))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return time.perf_counter() - start
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await loop.run_in_executor(self.executor, self._write_batch, batch)
+            except Exception as e:
+                # Keep draining: a dead drain task would leave `close` waiting on the queue forever
+                self.errors += len(batch)
+                logging.warning(f"Failed to write a batch of {len(batch)} files: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        written = []
+        for path, data in batch:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+                except BaseException:
+                    os.close(fd)
+                    raise
+                written.append((path, fd))
+                self.bytes += len(data)
+            except Exception as e:
+                # OSError from the disk, or TypeError for a payload that is not bytes-like
+                self.errors += 1
+                logging.warning(f"Failed to write {path}: {e}")
+        synced = time.perf_counter()
+        for path, fd in written:
+            try:
+                if self.fsync:
+                    os.fsync(fd)
+            except OSError as e:
+                self.errors += 1
+                logging.warning(f"Failed to fsync {path}: {e}")
+            finally:
+                os.close(fd)
+        if self.fsync:
+            # New directory entries are only durable once the directory itself is synced
+            for directory in {os.path.dirname(path) or "." for path, _ in written}:
+                try:
+                    fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+        self.files += len(written)
+        self.batches += 1
+        self.write_seconds += synced - start
+        self.sync_seconds += time.perf_counter() - synced
+
+    async def close(self):
+        if self.task is not None:
+            await self.queue.join()
+            self.task.cancel()
+            self.task = None
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "batches": self.batches,
+            "write_seconds": self.write_seconds,
+            "sync_seconds": self.sync_seconds,
+            "max_queue_depth": self.max_queue_depth,
+            "errors": self.errors,
+        }
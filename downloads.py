@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import shutil
+
+
+def task_download_dir(args, task, trial_id):
+    return os.path.join(args.download_dir, f'task{task["id"]}-{trial_id}')
+
+
+class DownloadCollector:
+    """
+    Saves the downloads of one task's browser context into that task's own directory, so
+    concurrent tasks never see or delete each other's files. Downloads are captured from
+    Playwright's `download` event on every page of the context, including popups, and copied
+    out of the browser's temporary storage without blocking the agent. A file larger than
+    `max_file_bytes`, or one that would take the task past `max_total_bytes`, is discarded.
+    """
+
+    def __init__(self, directory, max_file_bytes=100 * 1024 * 1024, max_total_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.files = []
+        self.bytes = 0
+        self.rejected = 0
+        self.failed = 0
+        self.pending = set()
+        # Paths handed out to downloads still being copied, so two files never get the same name
+        self.reserved = set()
+
+    @classmethod
+    def from_args(cls, args, task, trial_id):
+        return cls(task_download_dir(args, task, trial_id), max_file_bytes=args.max_download_mb * 1024 * 1024,
+                   max_total_bytes=args.max_task_download_mb * 1024 * 1024)
+
+    async def prepare(self):
+        """Empties the directory left by an earlier run of the same task/trial."""
+        if os.path.exists(self.directory):
+            await asyncio.to_thread(shutil.rmtree, self.directory, True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def attach(self, context):
+        for page in context.pages:
+            self._watch(page)
+        context.on("page", self._watch)
+
+    def _watch(self, page):
+        page.on("download", self._on_download)
+
+    def _on_download(self, download):
+        task = asyncio.ensure_future(self._save(download))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    def _target_path(self, suggested):
+        name = os.path.basename(suggested) or "download"
+        stem, ext = os.path.splitext(name)
+        path = os.path.join(self.directory, name)
+        n = 1
+        while os.path.exists(path) or path in self.reserved:
+            path = os.path.join(self.directory, f"{stem} ({n}){ext}")
+            n += 1
+        return path
+
+    async def _save(self, download):
+        try:
+            # Resolves once the browser has finished downloading into its temporary storage
+            tmp_path = await download.path()
+            size = os.path.getsize(tmp_path)
+            if size > self.max_file_bytes or self.bytes + size > self.max_total_bytes:
+                self.rejected += 1
+                logging.warning(f"Discarding download {download.suggested_filename} ({size / 1024 / 1024:.1f} MB) over the size limit")
+                await download.delete()
+                return
+            path = self._target_path(download.suggested_filename)
+            self.reserved.add(path)
+            self.bytes += size
+            await download.save_as(path)
+            self.files.append(path)
+            logging.info(f"Downloaded {download.url} to {path} ({size / 1024:.0f} KB)")
+        except Exception as e:
+            self.failed += 1
+            logging.warning(f"Download of {download.url} failed: {e}")
+
+    async def close(self):
+        """Waits for downloads still being saved; call before the context is closed."""
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    def stats(self):
+        return {"files": len(self.files), "bytes": self.bytes, "rejected": self.rejected, "failed": self.failed}
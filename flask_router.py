@@ -1,6 +1,13 @@
 from flask import Flask, request, jsonify
 import requests
-import threading
+import argparse
+import json
+import time
+
+from router_utils import BackendPool, BodyTee, ResponseCache, Hedger, AdmissionController, RouterMetrics, NoBackendAvailable, AdmissionRejected,\
+    BALANCE_POLICIES, FORWARD_MODES, RETRYABLE_STATUS, DEFAULT_PRIORITY_WEIGHTS, estimate_prompt_tokens, scan_prompt_tokens,\
+    needs_payload, affinity_key, filter_headers, is_cacheable, request_cache_key, load_manifest, start_manifest_watcher,\
+    handle_registry_request, parse_priority_weights, priority_class, scan_usage
 
 app = Flask(__name__)
 
@@ -8,41 +15,223 @@ app = Flask(__name__)
 VLLM_PORTS = list(range(8001, 8009))
 VLLM_URLS = [f"http://localhost:{port}" for port in VLLM_PORTS]
 
-# Round-robin counter and lock
-lock = threading.Lock()
-counter = 0
+pool = BackendPool(VLLM_URLS)
+metrics = RouterMetrics()
+# Set by --cache; identical deterministic requests are answered from here
+response_cache = None
+forward_mode = "raw"
+# Set by --max_inflight; bounds the requests sent to replicas and queues the rest by priority
+admission = None
 
-@app.route("/v1/<path:endpoint>", methods=["POST", "GET", "OPTIONS"])
-def proxy_vllm(endpoint):
-    global counter
-    with lock:
-        target = VLLM_URLS[counter % len(VLLM_URLS)]
-        counter += 1
+def error_response(body, status):
+    return json.dumps(body).encode("utf-8"), status, {"Content-Type": "application/json"}
 
-    url = f"{target}/v1/{endpoint}"
 
+def admitted_forward(priority, *args):
+    """`forward_request` once the admission controller grants a slot; a fast 429 if it won't."""
+    if admission is None:
+        return forward_request(*args)
+    try:
+        admission.admit(priority)
+    except AdmissionRejected as e:
+        content, status, headers = error_response({"error": str(e)}, 429)
+        headers["Retry-After"] = str(e.retry_after)
+        return content, status, headers
     try:
-        # Forward the request with original method and headers
-        headers = dict(request.headers)
-        method = request.method
-
-        if method == "POST":
-            response = requests.post(url, headers=headers, json=request.get_json())
-        elif method == "GET":
-            response = requests.get(url, headers=headers, params=request.args)
-        elif method == "OPTIONS":
-            response = requests.options(url, headers=headers)
+        return forward_request(*args)
+    finally:
+        admission.release()
+
+
+def forward_request(endpoint, method, headers, body, est_tokens, key):
+    """`body` is bytes, a `BodyTee` still being received from the client, or None."""
+    # vLLM's OpenAI endpoints are stateless, so a request that failed on one replica
+    # is retried on a replica it has not tried yet.
+    tried = []
+    result = error_response({"error": "No healthy vLLM replica available"}, 503)
+    for attempt in range(pool.max_retries + 1):
+        try:
+            backend = pool.acquire(est_tokens, key, exclude=tried)
+        except NoBackendAvailable:
+            break
+        tried.append(backend.url)
+        url = f"{backend.url}/v1/{endpoint}"
+
+        start = time.perf_counter()
+        response = None
+        try:
+            if method == "POST":
+                data = body.reader() if isinstance(body, BodyTee) else body
+                response = requests.post(url, headers=headers, data=data)
+            elif method == "GET":
+                response = requests.get(url, headers=headers, params=request.args)
+            else:
+                response = requests.options(url, headers=headers)
+
+        except requests.exceptions.RequestException as e:
+            pool.record_result(backend, False)
+            result = error_response({"error": f"Failed to connect to backend {url}", "details": str(e)}, 502)
+            continue
+
+        finally:
+            pool.release(backend, est_tokens)
+            metrics.observe(backend.url, response.status_code if response is not None else None, time.perf_counter() - start,
+                            len(body) if body is not None else 0,
+                            len(response.content) if response is not None else 0,
+                            scan_usage(response.content) if response is not None else None)
+
+        ok = response.status_code not in RETRYABLE_STATUS
+        pool.record_result(backend, ok)
+        # `response.content` is already de-chunked and decompressed, so those headers must not go back out
+        response_headers = {k: v for k, v in filter_headers(response.headers).items() if k.lower() != "content-encoding"}
+        result = (response.content, response.status_code, response_headers)
+        if ok:
+            break
+
+    return result
+
+
+@app.route("/v1/<path:endpoint>", methods=["POST", "GET", "OPTIONS"])
+def proxy_vllm(endpoint):
+    method = request.method
+    if method not in ("POST", "GET", "OPTIONS"):
+        return jsonify({"error": f"Method {method} not supported"}), 405
+
+    # Forward the request with original headers, minus hop-by-hop ones and the stale Content-Length
+    headers = filter_headers(request.headers)
+    payload = None
+    body = None
+    est_tokens = 0
+    if method == "POST":
+        decode = forward_mode == "json" or needs_payload(pool, response_cache, method, request.headers)
+        if decode or pool.policy == "least_tokens" or request.content_length is None:
+            body = request.get_data()
+            if decode:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    pass
+            est_tokens = estimate_prompt_tokens(payload) if payload is not None else scan_prompt_tokens(body)
+            if forward_mode == "json" and payload is not None:
+                body = json.dumps(payload).encode("utf-8")
         else:
-            return jsonify({"error": f"Method {method} not supported"}), 405
+            # Nothing routing needs is in the body: relay it to the replica as it arrives
+            body = BodyTee(request.stream, request.content_length)
+    key = affinity_key(request.headers, payload) if pool.policy == "affinity" else None
+    priority = priority_class(request.headers, admission.weights) if admission is not None else None
+
+    if response_cache is None or not is_cacheable(method, endpoint, payload):
+        return admitted_forward(priority, endpoint, method, headers, body, est_tokens, key)
 
-        return (response.content, response.status_code, response.headers.items())
+    def compute():
+        content, status, response_headers = admitted_forward(priority, endpoint, method, headers, body, est_tokens, key)
+        return status, response_headers, content
 
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Failed to connect to backend {url}", "details": str(e)}), 502
+    status, response_headers, content = response_cache.get_or_compute(request_cache_key(endpoint, payload), compute)
+    return content, status, response_headers
 
 @app.route("/")
 def health():
     return "vLLM load balancer is running."
 
+@app.route("/metrics")
+def prometheus_metrics():
+    return metrics.render(pool, response_cache, admission), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/stats")
+def stats():
+    stats = pool.stats()
+    if response_cache is not None:
+        stats["cache"] = response_cache.stats()
+    if admission is not None:
+        stats["admission"] = admission.stats()
+    return jsonify(stats)
+
+@app.route("/backends", methods=["GET", "POST", "DELETE"])
+@app.route("/backends/<action>", methods=["POST"])
+def backends(action=""):
+    body, status = handle_registry_request(pool, request.method, action, request.get_json(silent=True))
+    return jsonify(body), status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mode", type=str, default="flask", choices=["flask", "async"],
+                        help="flask: threaded Flask server; async: aiohttp proxy with pooled connections and streaming")
+    parser.add_argument("--vllm_ports", type=int, nargs="+", default=VLLM_PORTS)
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="JSON backend manifest written by scripts/launch_vllm_servers.sh; overrides --vllm_ports and is re-read when it changes")
+    parser.add_argument("--connections_per_backend", type=int, default=256, help="Keep-alive pool size per replica (async mode)")
+    parser.add_argument("--policy", type=str, default="round_robin", choices=BALANCE_POLICIES, help="Backend balancing policy")
+    parser.add_argument("--metrics_poll_interval", type=float, default=1.0, help="Seconds between vLLM /metrics polls (queue_depth and affinity policies)")
+    parser.add_argument("--affinity_load_factor", type=float, default=1.25,
+                        help="Affinity policy: spill to the next replica once the preferred one exceeds this multiple of the average load")
+    parser.add_argument("--max_retries", type=int, default=2, help="Retries of a failed request on other replicas")
+    parser.add_argument("--failure_threshold", type=int, default=3, help="Consecutive failures before a replica's circuit opens")
+    parser.add_argument("--circuit_cooldown", type=float, default=10.0, help="Seconds an open circuit waits before a trial request")
+    parser.add_argument("--health_check_interval", type=float, default=5.0, help="Seconds between /health probes, 0 disables")
+    parser.add_argument("--forward_mode", type=str, default="raw", choices=FORWARD_MODES,
+                        help="raw: relay request bytes without decoding unless routing needs the JSON; json: decode and re-encode every body")
+    parser.add_argument("--cache", action='store_true', help="Cache responses to deterministic requests (temperature 0 or fixed seed)")
+    parser.add_argument("--cache_max_entries", type=int, default=10000)
+    parser.add_argument("--cache_max_mb", type=int, default=512)
+    parser.add_argument("--cache_ttl", type=float, default=24 * 3600, help="Seconds a cached response stays valid")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Persist cached responses here across restarts")
+    parser.add_argument("--hedge", action='store_true',
+                        help="Async mode: duplicate slow non-streaming requests to another replica, first answer wins")
+    parser.add_argument("--hedge_quantile", type=float, default=0.95, help="Hedge once a request is slower than this quantile of recent latency")
+    parser.add_argument("--hedge_budget", type=float, default=0.1, help="Max hedges per request per endpoint (<= 1.0)")
+    parser.add_argument("--max_inflight", type=int, default=0,
+                        help="Requests sent to the replicas at once; the rest queue per X-Priority class (0 disables admission control)")
+    parser.add_argument("--priority_weights", type=str, default=DEFAULT_PRIORITY_WEIGHTS,
+                        help="Share of freed slots each X-Priority class gets while several are queued")
+    parser.add_argument("--queue_size", type=int, default=64, help="Max queued requests per priority class before answering 429")
+    parser.add_argument("--queue_timeout", type=float, default=60.0, help="Seconds a queued request waits for a slot before a 429")
+    args = parser.parse_args()
+    if args.hedge and args.mode != "async":
+        parser.error("--hedge requires --mode async")
+
+    if args.manifest:
+        VLLM_URLS[:] = load_manifest(args.manifest)
+    else:
+        VLLM_URLS[:] = [f"http://localhost:{port}" for port in args.vllm_ports]
+    pool.set_backends(VLLM_URLS, source="manifest" if args.manifest else "config")
+    pool.policy = args.policy
+    pool.load_factor = args.affinity_load_factor
+    pool.max_retries = args.max_retries
+    pool.failure_threshold = args.failure_threshold
+    pool.cooldown = args.circuit_cooldown
+    if args.health_check_interval > 0:
+        pool.start_health_checker(args.health_check_interval)
+    if args.manifest:
+        # After the health checker, so replicas added to the manifest wait for it to admit them
+        start_manifest_watcher(pool, args.manifest)
+
+    global response_cache, forward_mode, admission
+    forward_mode = args.forward_mode
+    if args.max_inflight > 0:
+        try:
+            weights = parse_priority_weights(args.priority_weights)
+        except ValueError as e:
+            parser.error(f"--priority_weights: {e}")
+        admission = AdmissionController(args.max_inflight, weights, queue_size=args.queue_size, max_wait=args.queue_timeout)
+    if args.cache:
+        response_cache = ResponseCache(max_entries=args.cache_max_entries, max_bytes=args.cache_max_mb * 1024 * 1024,
+                                       ttl=args.cache_ttl, cache_dir=args.cache_dir)
+    if args.policy in ("queue_depth", "affinity"):
+        pool.start_metrics_poller(args.metrics_poll_interval)
+
+    if args.mode == "async":
+        from async_router import run_async_router
+        hedger = Hedger(quantile=args.hedge_quantile, budget=args.hedge_budget) if args.hedge else None
+        run_async_router(args.host, args.port, pool, connections_per_backend=args.connections_per_backend, cache=response_cache,
+                         forward_mode=forward_mode, hedger=hedger, admission=admission,
+                         metrics=metrics)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True)
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, threaded=True)
+    main()
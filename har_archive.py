@@ -0,0 +1,91 @@
+import glob
+import logging
+import os
+
+# off: fetch everything live (the original behaviour).
+# record: fetch live and save the traffic of each task/trial to `<har_dir>/task<id>-<trial>.har.zip`.
+# replay: answer every request from the task's recorded archives, with no network access.
+HAR_MODES = ["off", "record", "replay"]
+HAR_SUFFIX = ".har.zip"
+
+
+def har_path(har_dir, task, trial_id):
+    return os.path.join(har_dir, f'task{task["id"]}-{trial_id}{HAR_SUFFIX}')
+
+
+class HarArchive:
+    """
+    Records the network traffic of a task's browser context to a HAR archive, or replays it.
+    Archives are zip files holding the HAR index and the response bodies as separate entries;
+    Playwright writes them when the context is closed.
+
+    Replay serves the archives of every recorded trial of the task, preferring the trial being
+    run, so a new model that wanders off the recorded path still finds pages the earlier trials
+    visited. Anything not in them is aborted as if the machine were offline, and counted as a miss.
+    """
+
+    def __init__(self, har_dir, mode="off", task=None, trial_id=None):
+        self.har_dir = har_dir
+        self.mode = mode
+        self.task = task
+        self.trial_id = trial_id
+        self.archives = []
+        self.requests = 0
+        self.missed = []
+
+    @classmethod
+    def from_args(cls, args, task, trial_id):
+        return cls(args.har_dir, mode=args.har_mode, task=task, trial_id=trial_id)
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def service_workers(self):
+        """For the context: a service worker's fetches bypass the HAR routes, so they are blocked."""
+        return "block" if self.enabled else "allow"
+
+    def replay_archives(self):
+        """The task's archives, lowest priority first: Playwright tries the route added last first."""
+        own = har_path(self.har_dir, self.task, self.trial_id)
+        prefix = os.path.join(self.har_dir, f'task{self.task["id"]}-')
+        others = sorted(path for path in glob.glob(glob.escape(prefix) + f'*{HAR_SUFFIX}')
+                        if path[len(prefix):-len(HAR_SUFFIX)].isdigit())
+        return [path for path in others if path != own] + ([own] if os.path.exists(own) else [])
+
+    async def attach(self, context):
+        """
+        Call before the first navigation; in record mode the archive is written when `context` closes.
+        Create `context` with `service_workers=self.service_workers`.
+        """
+        if self.mode == "record":
+            os.makedirs(self.har_dir, exist_ok=True)
+            path = har_path(self.har_dir, self.task, self.trial_id)
+            await context.route_from_har(path, update=True, update_content="attach", update_mode="minimal")
+            self.archives = [path]
+        elif self.mode == "replay":
+            self.archives = self.replay_archives()
+            if not self.archives:
+                logging.warning(f'No HAR archive of task {self.task["id"]} in {self.har_dir}; every request will fail')
+            context.on("request", self._on_request)
+            await context.route("**/*", self._miss)
+            await context.route_web_socket("**/*", self._close_socket)
+            for path in self.archives:
+                await context.route_from_har(path, not_found="fallback")
+
+    def _on_request(self, request):
+        self.requests += 1
+
+    async def _miss(self, route, request):
+        self.missed.append(request.url)
+        await route.abort("internetdisconnected")
+
+    async def _close_socket(self, ws):
+        await ws.close()
+
+    def stats(self):
+        stats = {"mode": self.mode, "archives": len(self.archives)}
+        if self.mode == "replay":
+            stats.update(requests=self.requests, missed=len(self.missed), first_missed=self.missed[:5])
+        return stats
@@ -0,0 +1,61 @@
+from cua_utils import CUA_KEY_TO_PLAYWRIGHT_KEY
+
+# Strings at least this long are inserted in one go instead of typed key by key
+BULK_TEXT_MIN_LENGTH = 8
+
+# The focused text field and its current text, or null when focus is not on one we can check
+FOCUSED_TEXT_JS = """
+() => {
+    const el = document.activeElement;
+    if (!el) return null;
+    if (el.isContentEditable) return el.innerText;
+    if (el.tagName === 'TEXTAREA' || (el.tagName === 'INPUT' && /^(text|search|email|url|tel|password|number|)$/.test(el.type)))
+        return el.value;
+    return null;
+}
+"""
+
+RESTORE_TEXT_JS = """
+(text) => {
+    const el = document.activeElement;
+    if (!el) return;
+    if (el.isContentEditable) el.innerText = text; else el.value = text;
+}
+"""
+
+
+async def press_keys(page, keys):
+    """Presses `keys` (model key names such as ['ctrl', 'a']) as one chord, without pauses between the key events."""
+    mapped = [CUA_KEY_TO_PLAYWRIGHT_KEY.get(key.lower(), key) for key in keys]
+    for key in mapped:
+        await page.keyboard.down(key)
+    for key in reversed(mapped):
+        await page.keyboard.up(key)
+
+
+async def type_text(page, text):
+    """
+    Types `text` into the focused element. Long strings without control characters are inserted
+    with one `insert_text` call, followed by the last character as a real key press so that
+    widgets listening for key events (autocomplete, search-as-you-type) still react. If the field
+    does not end up containing the text, it is restored and the text is typed key by key.
+    Returns True when the fast path was used.
+    """
+    if len(text) < BULK_TEXT_MIN_LENGTH or any(ch in text for ch in "\n\r\t\b"):
+        await page.keyboard.type(text)
+        return False
+    before = await page.evaluate(FOCUSED_TEXT_JS)
+    if before is None:
+        await page.keyboard.type(text)
+        return False
+    await page.keyboard.insert_text(text[:-1])
+    await page.keyboard.type(text[-1])
+    after = await page.evaluate(FOCUSED_TEXT_JS)
+    if after is None or text in after:
+        # Focus leaving the field means the page already reacted; typing again would land elsewhere
+        return True
+    # The page rejected or rewrote the inserted text (e.g. an input mask); fall back to real key presses
+    if after != before:
+        await page.evaluate(RESTORE_TEXT_JS, before)
+    await page.keyboard.type(text)
+    return False
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import re
+from collections import Counter
+from urllib.parse import urlparse
+
+# off: load everything (the original behaviour).
+# trackers: block requests to ad, analytics and tracking domains.
+# lean: trackers, plus audio/video files and streaming segments.
+NET_PROFILES = ["off", "trackers", "lean"]
+
+# Hosts that only serve ads, analytics or tracking; a subdomain of any of them is blocked too.
+# Vendors whose own website shares the domain (segment.com, newrelic.com, hotjar.com, ...) are
+# listed by their tracking endpoints only, so tasks on those websites still load.
+TRACKER_DOMAINS = [
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "googletagservices.com",
+    "googletagmanager.com", "google-analytics.com", "adservice.google.com", "amazon-adsystem.com",
+    "adnxs.com", "adsrvr.org", "static.criteo.net", "bidder.criteo.com", "cdn.taboola.com", "trc.taboola.com",
+    "widgets.outbrain.com", "log.outbrain.com", "ads.pubmatic.com", "fastlane.rubiconproject.com",
+    "pixel.rubiconproject.com", "openx.net", "casalemedia.com", "moatads.com", "scorecardresearch.com",
+    "quantserve.com", "static.chartbeat.com", "ping.chartbeat.net", "static.hotjar.com", "script.hotjar.com",
+    "cdn.mouseflow.com", "edge.fullstory.com", "rs.fullstory.com", "js-agent.newrelic.com", "nr-data.net",
+    "cdn.segment.com", "api.segment.io", "cdn.mxpnl.com", "api-js.mixpanel.com", "cdn.amplitude.com",
+    "api2.amplitude.com", "cdn.optimizely.com", "logx.optimizely.com", "krxd.net", "tags.bluekai.com",
+    "demdex.net", "omtrdc.net", "everesttech.net", "2mdn.net", "connect.facebook.net", "ads-twitter.com",
+    "analytics.twitter.com", "bat.bing.com", "clarity.ms", "adform.net", "smartadserver.com", "a.teads.tv",
+    "t.teads.tv", "ads.yieldmo.com", "btlr.sharethrough.com", "js-sec.indexww.com", "ssc.33across.com",
+    "lijit.com", "contextual.media.net", "imrworldwide.com", "tags.tiqcdn.com", "cdn.cookielaw.org",
+    "cdn.branch.io", "api2.branch.io", "browser.sentry-cdn.com",
+]
+
+# Audio and video files, and HLS/DASH manifests and segments
+MEDIA_EXTENSIONS = ["mp4", "m4v", "m4s", "webm", "mov", "ogv", "ogg", "mp3", "m4a", "aac", "wav", "flac", "m3u8", "mpd", "ts"]
+
+
+def read_block_list(path):
+    """Domains from a file with one per line; `#` comments and hosts-file lines (`0.0.0.0 example.com`) are accepted."""
+    domains = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].split()
+            if line:
+                domains.append(line[-1].lower().lstrip("*."))
+    return domains
+
+
+def own_site_domains(domains, url):
+    """The entries of `domains` that are, contain or belong to the host of `url`, which must never be blocked."""
+    site = urlparse(url).hostname or ""
+    site = site[4:] if site.startswith("www.") else site
+    if not site:
+        return set()
+    return {d for d in domains if d == site or d.endswith("." + site) or site.endswith("." + d)}
+
+
+def domain_pattern(domains):
+    # Written so Python and the browser's JavaScript regex engine read it the same way
+    hosts = "|".join(re.escape(domain) for domain in sorted(set(domains)))
+    return re.compile(rf"^[a-z]+://([^/?#@]*@)?([^/?#:]*\.)?({hosts})(:[0-9]+)?([/?#]|$)", re.IGNORECASE)
+
+
+def media_pattern(extensions=MEDIA_EXTENSIONS):
+    return re.compile(rf"^[^?#]*\.({'|'.join(extensions)})([?#]|$)", re.IGNORECASE)
+
+
+class NetworkFilter:
+    """
+    Blocks requests of a browser context by rule list: ad/analytics/tracker domains, and with the
+    `lean` profile also audio/video. The rules are regular expressions handed to Playwright, which
+    matches them inside the browser, so requests that pass are not routed through Python at all.
+
+    A blocked request is never fetched, so its size is unknown. With `audit=True` nothing is
+    blocked; instead the requests the rules match are counted with their transferred bytes, which
+    tells how much a profile would save on a site.
+    """
+
+    def __init__(self, profile="off", extra_domains=(), audit=False, site_url=None):
+        self.profile = profile
+        self.audit = audit
+        self.rules = []
+        if profile != "off":
+            domains = TRACKER_DOMAINS + list(extra_domains)
+            if site_url:
+                domains = sorted(set(domains) - own_site_domains(domains, site_url))
+            self.rules.append(("tracker", domain_pattern(domains)))
+        if profile == "lean":
+            self.rules.append(("media", media_pattern()))
+        self.blocked = Counter()
+        self.blocked_bytes = Counter()
+        self.pending = set()
+
+    @classmethod
+    def from_args(cls, args, task):
+        extra = read_block_list(args.net_block_list) if args.net_block_list else []
+        return cls(args.net_profile, extra_domains=extra, audit=args.net_audit, site_url=task['web'])
+
+    @property
+    def enabled(self):
+        return bool(self.rules)
+
+    @property
+    def service_workers(self):
+        """For the context: a service worker's requests bypass the routes, so they are blocked."""
+        return "block" if self.enabled else "allow"
+
+    def match(self, url):
+        for name, pattern in self.rules:
+            if pattern.search(url):
+                return name
+        return None
+
+    async def attach(self, context):
+        """
+        Installs the rules on every page of `context`, including ones opened later. Create
+        `context` with `service_workers=self.service_workers`.
+        """
+        if self.audit:
+            if self.enabled:
+                context.on("requestfinished", self._on_finished)
+            return
+        for name, pattern in self.rules:
+            await context.route(pattern, self._blocker(name))
+
+    def attach_sync(self, page):
+        """The same rules for a page of Playwright's sync API, whose context should block service workers too."""
+        for name, pattern in self.rules:
+            page.route(pattern, self._blocker(name))
+
+    def _blocker(self, name):
+        def block(route, request):
+            self.blocked[name] += 1
+            # Under the async API the returned coroutine is awaited by Playwright
+            return route.abort("blockedbyclient")
+        return block
+
+    def _on_finished(self, request):
+        name = self.match(request.url)
+        if name:
+            task = asyncio.ensure_future(self._count(name, request))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def _count(self, name, request):
+        try:
+            sizes = await request.sizes()
+            self.blocked[name] += 1
+            self.blocked_bytes[name] += sizes["responseHeadersSize"] + sizes["responseBodySize"]
+        except Exception as e:
+            logging.debug(f"No size for {request.url}: {e}")
+
+    async def close(self):
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    def stats(self):
+        stats = {"profile": self.profile, "requests": dict(self.blocked)}
+        if self.audit:
+            stats["audit"] = True
+            stats["bytes"] = dict(self.blocked_bytes)
+        return stats
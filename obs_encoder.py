@@ -0,0 +1,75 @@
+import base64
+import io
+import struct
+
+from PIL import Image
+
+from uitars_action_parser import IMAGE_FACTOR, MIN_PIXELS, smart_resize
+
+# png: send the capture as is (the original behaviour). jpeg/webp: re-encode at --obs_quality.
+OBS_FORMATS = ["png", "jpeg", "webp"]
+OBS_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+class Observation:
+    def __init__(self, b64, mime, width, height, nbytes):
+        self.b64 = b64
+        self.mime = mime
+        # Size of the image the model sees; its absolute coordinates refer to this
+        self.width = width
+        self.height = height
+        self.nbytes = nbytes
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+class ObservationEncoder:
+    """
+    Turns a PNG screenshot into the image sent to the model. With `max_pixels` set, the capture is
+    resized up front to the size Qwen2.5-VL's `smart_resize` would pick (sides divisible by
+    `factor`, at most `max_pixels` pixels), so the server does no resize of its own and the
+    coordinates the model answers in map back to the page exactly. The result is re-encoded as
+    JPEG or WebP at `quality`, or kept as PNG.
+    """
+
+    def __init__(self, fmt="png", quality=85, max_pixels=0, factor=IMAGE_FACTOR):
+        self.fmt = fmt
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.factor = factor
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(fmt=args.obs_format, quality=args.obs_quality, max_pixels=args.obs_max_pixels)
+
+    @property
+    def passthrough(self):
+        return self.fmt == "png" and not self.max_pixels
+
+    def target_size(self, width, height):
+        if not self.max_pixels:
+            return width, height
+        h_bar, w_bar = smart_resize(height, width, factor=self.factor,
+                                    min_pixels=min(MIN_PIXELS, self.max_pixels), max_pixels=self.max_pixels)
+        return w_bar, h_bar
+
+    def encode(self, png_bytes):
+        if self.passthrough:
+            # The IHDR chunk right after the signature holds width and height
+            width, height = struct.unpack(">II", png_bytes[16:24])
+            return Observation(base64.b64encode(png_bytes).decode('utf-8'), OBS_MIME_TYPES["png"], width, height, len(png_bytes))
+
+        image = Image.open(io.BytesIO(png_bytes))
+        size = self.target_size(*image.size)
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+        buf = io.BytesIO()
+        if self.fmt == "png":
+            image.save(buf, format="PNG")
+        else:
+            # JPEG has no alpha channel, and WebP is smaller without one
+            image.convert("RGB").save(buf, format=self.fmt.upper(), quality=self.quality)
+        data = buf.getvalue()
+        return Observation(base64.b64encode(data).decode('utf-8'), OBS_MIME_TYPES[self.fmt], size[0], size[1], len(data))
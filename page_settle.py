@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+# auto: wait until the page is idle (network, DOM and pixels), between a floor and a ceiling.
+# fixed: sleep a fixed delay after every action (the original behaviour).
+SETTLE_MODES = ["auto", "fixed"]
+
+# Installs a MutationObserver on first use and returns ms since the DOM last changed (-1 while loading).
+DOM_QUIET_JS = """
+() => {
+    if (document.readyState === 'loading') return -1;
+    if (!window.__settleObserver) {
+        window.__lastMutation = performance.now();
+        window.__settleObserver = new MutationObserver(() => { window.__lastMutation = performance.now(); });
+        window.__settleObserver.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    }
+    return performance.now() - window.__lastMutation;
+}
+"""
+
+
+class _NetworkTracker:
+    def __init__(self, page):
+        self.inflight = {}
+        self.last_activity = time.monotonic()
+        page.on("request", self._started)
+        page.on("requestfinished", self._finished)
+        page.on("requestfailed", self._finished)
+
+    def _started(self, request):
+        self.inflight[request] = self.last_activity = time.monotonic()
+
+    def _finished(self, request):
+        self.inflight.pop(request, None)
+        self.last_activity = time.monotonic()
+
+    def idle_for(self, now, long_request):
+        """Seconds without network activity; requests pending longer than `long_request` (long polls, streams) are ignored."""
+        if any(now - started < long_request for started in self.inflight.values()):
+            return 0.0
+        return now - self.last_activity
+
+
+class PageSettler:
+    """
+    Waits for a page to settle after an action. In auto mode the page counts as settled once there
+    has been no network activity for `network_quiet` seconds, no DOM mutation for `dom_quiet`
+    seconds, and two consecutive screenshots are identical. The wait is at least `floor` and at
+    most `ceiling` seconds. In fixed mode it sleeps `delay` seconds.
+    """
+
+    def __init__(self, mode="auto", delay=6.0, floor=0.2, ceiling=5.0, network_quiet=0.5, dom_quiet=0.3, poll_interval=0.1):
+        self.mode = mode
+        self.delay = delay
+        self.floor = floor
+        self.ceiling = ceiling
+        self.network_quiet = network_quiet
+        self.dom_quiet = dom_quiet
+        self.poll_interval = poll_interval
+        self.trackers = {}
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(mode=args.settle, delay=args.settle_delay, floor=args.settle_floor, ceiling=args.settle_ceiling)
+
+    def attach(self, page):
+        """Start tracking the page's requests; call right after creating it so the first settle sees earlier traffic."""
+        if page not in self.trackers:
+            self.trackers[page] = _NetworkTracker(page)
+            page.on("close", lambda _: self.trackers.pop(page, None))
+
+    async def settle(self, page, delay=None):
+        """Returns the seconds spent waiting. `delay` overrides the fixed-mode sleep for this call."""
+        start = time.monotonic()
+        if self.mode == "fixed":
+            await asyncio.sleep(self.delay if delay is None else delay)
+            return time.monotonic() - start
+
+        self.attach(page)
+        tracker = self.trackers[page]
+        deadline = start + self.ceiling
+        await asyncio.sleep(self.floor)
+        last_frame = None
+        while time.monotonic() < deadline:
+            if tracker.idle_for(time.monotonic(), self.ceiling) >= self.network_quiet and await self._dom_quiet_for(page) >= self.dom_quiet:
+                frame = await self._frame_hash(page)
+                if frame is not None and frame == last_frame:
+                    return time.monotonic() - start
+                last_frame = frame
+            else:
+                last_frame = None
+            await asyncio.sleep(self.poll_interval)
+        logging.info(f"Page did not settle within {self.ceiling}s, continuing")
+        return time.monotonic() - start
+
+    async def _dom_quiet_for(self, page):
+        try:
+            return await page.evaluate(DOM_QUIET_JS) / 1000
+        except Exception:
+            # The execution context went away mid-navigation
+            return -1
+
+    async def _frame_hash(self, page):
+        try:
+            frame = await page.screenshot(type="jpeg", quality=30, timeout=self.ceiling * 1000)
+        except Exception:
+            return None
+        return hashlib.md5(frame).digest()
@@ -0,0 +1,1120 @@
+import asyncio
+import base64
+import bisect
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict, defaultdict, deque
+
+import requests
+
+# Rough prompt cost of one 1024x768 screenshot after Qwen2.5-VL smart_resize (37 x 27 patches).
+IMAGE_TOKEN_ESTIMATE = 1000
+CHARS_PER_TOKEN = 4
+DATA_URI_MARKER = b";base64,"
+
+# raw: forward the client's bytes untouched, decoding JSON only when routing needs it.
+# json: decode and re-encode every body (the original behaviour).
+FORWARD_MODES = ["raw", "json"]
+
+BALANCE_POLICIES = ["round_robin", "least_requests", "least_tokens", "queue_depth", "affinity"]
+
+VLLM_QUEUE_METRICS = ("vllm:num_requests_waiting", "vllm:num_requests_running")
+VLLM_PREFIX_CACHE_METRICS = ("vllm:prefix_cache_queries", "vllm:prefix_cache_hits")
+
+# Clients tag every step of one trajectory with the same value so the router can keep it on one replica.
+SESSION_HEADERS = ("X-Session-Id", "X-Trajectory-Id")
+VIRTUAL_NODES = 100
+MAX_TRACKED_SESSIONS = 100000
+
+# Backend answers that mean "this replica is in trouble" rather than "this request is bad".
+# They count against the replica's circuit breaker and are retried on another replica.
+RETRYABLE_STATUS = {500, 502, 503, 504}
+
+# Clients pick their scheduling class with this header; missing or unknown values get DEFAULT_PRIORITY.
+PRIORITY_HEADER = "X-Priority"
+DEFAULT_PRIORITY = "normal"
+DEFAULT_PRIORITY_WEIGHTS = "high=8,normal=2,low=1"
+
+CACHEABLE_ENDPOINTS = ("chat/completions", "completions")
+STREAM_FLAG_PATTERN = re.compile(rb'"stream"\s*:\s*true')
+# `usage` of a completion, or of the final chunk of a stream sent with `stream_options.include_usage`
+USAGE_PATTERN = re.compile(rb'"(prompt_tokens|completion_tokens)"\s*:\s*(\d+)')
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 512 * 1024, 1024 * 1024, 2 * 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+# Headers that only make sense for a single hop and must not be forwarded.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+    "content-length",
+}
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def estimate_prompt_tokens(payload):
+    """Cheap prompt size estimate for a chat-completions body: text length plus a flat cost per image."""
+    if not isinstance(payload, dict):
+        return 0
+    chars = 0
+    images = 0
+    for msg in payload.get("messages") or []:
+        content = msg.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for item in content:
+                if item.get("type") == "text":
+                    chars += len(item.get("text", ""))
+                elif item.get("type") in ("image_url", "input_image", "image"):
+                    images += 1
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKEN_ESTIMATE
+
+
+def filter_headers(headers):
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+
+def affinity_key(headers, payload):
+    """
+    Key that identifies the trajectory a request belongs to: the session header if the client
+    sent one, otherwise a hash of the leading system + first user text, which is identical
+    across all steps of one task.
+    """
+    for name in SESSION_HEADERS:
+        if headers.get(name):
+            return headers.get(name)
+    if not isinstance(payload, dict):
+        return None
+    leading = []
+    for msg in (payload.get("messages") or [])[:2]:
+        content = msg.get("content")
+        if isinstance(content, list):
+            content = " ".join(item.get("text", "") for item in content if item.get("type") == "text")
+        leading.append(f"{msg.get('role')}:{content}")
+    if not leading:
+        return None
+    return hashlib.md5("\n".join(leading).encode("utf-8")).hexdigest()
+
+
+def scan_prompt_tokens(body):
+    """
+    `estimate_prompt_tokens` for a raw JSON body without decoding it: every base64 data URI
+    counts as one image and the remaining bytes as text.
+    """
+    images = 0
+    b64_bytes = 0
+    pos = body.find(DATA_URI_MARKER)
+    while pos != -1:
+        end = body.find(b'"', pos)
+        if end == -1:
+            end = len(body)
+        images += 1
+        b64_bytes += end - pos
+        pos = body.find(DATA_URI_MARKER, end)
+    return (len(body) - b64_bytes) // CHARS_PER_TOKEN + images * IMAGE_TOKEN_ESTIMATE
+
+
+def scan_is_stream(body):
+    """`"stream": true` can only appear unescaped as a JSON key, never inside a message string."""
+    return STREAM_FLAG_PATTERN.search(body) is not None
+
+
+def needs_payload(pool, cache, method, headers):
+    """Whether routing this request requires the decoded JSON body (cache lookup, affinity without a session header)."""
+    if method != "POST":
+        return False
+    if cache is not None:
+        return True
+    return pool.policy == "affinity" and not any(headers.get(h) for h in SESSION_HEADERS)
+
+
+class BodyTee:
+    """
+    Forwards a request body while it is still arriving from the client and keeps a copy, so a failed
+    attempt can be replayed to another replica. Every `reader()` / `async_reader()` starts from the
+    first byte; bytes already received come from the copy, the rest from the client stream.
+    """
+
+    def __init__(self, stream, length, chunk_size=64 * 1024):
+        self.stream = stream
+        self.length = length
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.done = False
+
+    def __len__(self):
+        return self.length
+
+    def reader(self):
+        return _BodyTeeReader(self)
+
+    async def async_reader(self):
+        pos = 0
+        while True:
+            if pos < len(self.buffer):
+                chunk = bytes(self.buffer[pos:pos + self.chunk_size])
+            elif self.done:
+                return
+            else:
+                chunk = await self.stream.read(self.chunk_size)
+                if not chunk:
+                    self.done = True
+                    return
+                self.buffer += chunk
+            pos += len(chunk)
+            yield chunk
+
+
+class _BodyTeeReader:
+    """File-like view of a `BodyTee` for `requests`; `__len__` lets it send a Content-Length instead of chunking."""
+
+    def __init__(self, tee):
+        self.tee = tee
+        self.pos = 0
+
+    def __len__(self):
+        return self.tee.length
+
+    def read(self, size=-1):
+        tee = self.tee
+        if size is None or size < 0:
+            size = max(tee.length - self.pos, 0)
+        if self.pos < len(tee.buffer):
+            chunk = bytes(tee.buffer[self.pos:self.pos + size])
+        elif tee.done:
+            chunk = b""
+        else:
+            chunk = tee.stream.read(size)
+            if chunk:
+                tee.buffer += chunk
+            else:
+                tee.done = True
+        self.pos += len(chunk)
+        return chunk
+
+
+def parse_prometheus_metrics(metrics_text, names):
+    """Sum the samples of each metric in `names` (or its `_total` counter) across label sets."""
+    values = {name: 0.0 for name in names}
+    for line in metrics_text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        metric = line.split("{", 1)[0].split(" ", 1)[0]
+        if metric.endswith("_total"):
+            metric = metric[:-len("_total")]
+        if metric in values:
+            try:
+                values[metric] += float(line.rsplit(" ", 1)[-1])
+            except ValueError:
+                pass
+    return values
+
+
+def _ring_hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class Backend:
+    def __init__(self, url, source="config"):
+        self.url = url
+        # Where the replica was registered from: "config" (router flags), "manifest" or "api" (POST /backends)
+        self.source = source
+        self.inflight = 0
+        self.inflight_tokens = 0
+        self.queue_depth = 0.0
+        self.total_requests = 0
+        # Affinity routing: requests that landed on the same replica as the previous step of their
+        # trajectory (prefix cache is warm), moved here, or spilled over from a hot preferred replica.
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        self.affinity_spills = 0
+        # Cumulative counters scraped from vLLM `/metrics` (prefix cache queries/hits in tokens).
+        self.prefix_cache_queries = 0.0
+        self.prefix_cache_hits = 0.0
+        # Health: `healthy` follows the background `/health` probes, `circuit` follows real traffic.
+        self.healthy = True
+        self.probe_failures = 0
+        self.probe_successes = 0
+        self.circuit = "closed"
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.total_errors = 0
+        # Registry: a draining replica finishes its in-flight requests but takes no new ones,
+        # and is dropped from the pool once idle if `remove_when_drained` is set.
+        self.draining = False
+        self.remove_when_drained = False
+        # Set when the replica was drained because it left the manifest, not by an operator
+        self.manifest_drained = False
+
+    def available(self, cooldown):
+        """Whether the replica may take a request now; moves an expired open circuit to half-open."""
+        if self.draining or not self.healthy:
+            return False
+        if self.circuit == "open":
+            if time.time() - self.opened_at < cooldown:
+                return False
+            self.circuit = "half_open"
+        if self.circuit == "half_open":
+            # Let a single trial request through; its result closes or re-opens the circuit.
+            return self.inflight == 0
+        return True
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "inflight": self.inflight,
+            "inflight_tokens": self.inflight_tokens,
+            "queue_depth": self.queue_depth,
+            "total_requests": self.total_requests,
+            "affinity_hits": self.affinity_hits,
+            "affinity_misses": self.affinity_misses,
+            "affinity_spills": self.affinity_spills,
+            "prefix_cache_queries": self.prefix_cache_queries,
+            "prefix_cache_hits": self.prefix_cache_hits,
+            "prefix_cache_hit_rate": self.prefix_cache_hits / self.prefix_cache_queries if self.prefix_cache_queries else None,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "consecutive_failures": self.consecutive_failures,
+            "total_errors": self.total_errors,
+            "draining": self.draining,
+            "source": self.source,
+        }
+
+
+class BackendPool:
+    """
+    Thread-safe set of vLLM replicas plus the balancing policy that picks one per request.
+
+      - round_robin:    rotate blindly (the original behaviour).
+      - least_requests: fewest requests currently in flight through this router.
+      - least_tokens:   smallest sum of estimated prompt tokens in flight.
+      - queue_depth:    running + waiting requests polled from vLLM `/metrics`, never less than
+                        what this router has in flight (the poll lags behind new requests).
+      - affinity:       consistent hash of the trajectory key onto a ring of replicas, so every step
+                        of a trajectory hits the replica that already holds its prefix in cache.
+                        Bounded load: a replica is skipped while its in-flight count exceeds
+                        `load_factor` times the fleet average, and the request spills to the next
+                        replica on the ring. Requests without a key fall back to least_requests.
+
+    Ties are broken by rotating the starting index so idle replicas share load evenly.
+
+    Replicas are only considered while they are available: background `/health` probes eject a
+    replica after `unhealthy_threshold` failed probes and re-admit it after `healthy_threshold`
+    good ones, and a per-replica circuit breaker opens after `failure_threshold` consecutive
+    failed requests, then lets one trial request through after `cooldown` seconds.
+    """
+
+    def __init__(self, urls, policy="round_robin", load_factor=1.25, max_retries=2, failure_threshold=3,
+                 cooldown=10.0, unhealthy_threshold=2, healthy_threshold=2):
+        if policy not in BALANCE_POLICIES:
+            raise ValueError(f"Unknown balancing policy {policy}, choose from {BALANCE_POLICIES}")
+        self.policy = policy
+        self.load_factor = load_factor
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.sessions = OrderedDict()
+        # New replicas start unhealthy only while a prober is running to admit them
+        self.health_checking = False
+        self.set_backends(urls)
+
+    def set_backends(self, urls, source="config"):
+        with self.lock:
+            self.backends = [Backend(url, source) for url in urls]
+            self._build_ring()
+
+    def get_backend(self, url):
+        for backend in self.backends:
+            if backend.url == url:
+                return backend
+        return None
+
+    def add_backend(self, url, healthy=True, source="api"):
+        """
+        Register a replica. A replica that is still loading weights can be added with
+        `healthy=False` and is admitted once the health prober sees it answer.
+        Re-adding a draining replica re-activates it, with `healthy` and a fresh probe count, so a
+        replica re-registered unhealthy after a hot-swap waits for its probes again.
+        """
+        url = url.rstrip("/")
+        with self.lock:
+            backend = self.get_backend(url)
+            if backend is not None:
+                backend.draining = False
+                backend.remove_when_drained = False
+                backend.manifest_drained = False
+                backend.healthy = healthy
+                backend.probe_successes = 0
+                backend.probe_failures = 0
+                return backend
+            backend = Backend(url, source)
+            backend.healthy = healthy
+            self.backends.append(backend)
+            self._build_ring()
+            logging.warning(f"Registered backend {url}")
+            return backend
+
+    def drain_backend(self, url, remove=False, by_manifest=False):
+        """Stop sending new requests to a replica; in-flight ones finish normally."""
+        url = url.rstrip("/")
+        with self.lock:
+            backend = self.get_backend(url)
+            if backend is None:
+                return None
+            backend.draining = True
+            backend.remove_when_drained = remove
+            backend.manifest_drained = by_manifest
+            logging.warning(f"Draining backend {url} ({backend.inflight} in flight, remove={remove})")
+            self._reap(backend)
+            return backend
+
+    def _reap(self, backend):
+        if backend.remove_when_drained and backend.inflight == 0 and backend in self.backends:
+            self.backends.remove(backend)
+            self._build_ring()
+            logging.warning(f"Removed backend {backend.url}")
+
+    def sync_backends(self, urls):
+        """
+        Make the manifest's replicas match `urls`: register new replicas, drain and remove the ones
+        that left it. The launcher writes the manifest as soon as it spawns vLLM, so new replicas
+        are registered unhealthy, like the launcher's POST, and take traffic once the health prober
+        admits them. Replicas registered through `/backends` and drains done by an operator are
+        left alone.
+        """
+        urls = [url.rstrip("/") for url in urls]
+        for url in urls:
+            with self.lock:
+                backend = self.get_backend(url)
+            if backend is None:
+                self.add_backend(url, healthy=not self.health_checking, source="manifest")
+            elif backend.manifest_drained:
+                # Back in the manifest before it finished draining; it kept its health state
+                self.add_backend(url, healthy=backend.healthy)
+        for backend in list(self.backends):
+            if backend.source == "manifest" and backend.url not in urls and not backend.remove_when_drained:
+                self.drain_backend(backend.url, remove=True, by_manifest=True)
+
+    def _build_ring(self):
+        ring = []
+        for backend in self.backends:
+            for i in range(VIRTUAL_NODES):
+                ring.append((_ring_hash(f"{backend.url}#{i}"), backend))
+        ring.sort(key=lambda item: item[0])
+        self.ring_keys = [h for h, _ in ring]
+        self.ring_backends = [b for _, b in ring]
+
+    def _pick_affinity(self, key, candidates):
+        total_inflight = sum(b.inflight for b in candidates)
+        capacity = math.ceil(self.load_factor * (total_inflight + 1) / len(candidates))
+        idx = bisect.bisect(self.ring_keys, _ring_hash(key)) % len(self.ring_keys)
+        preferred = self.ring_backends[idx]
+        seen = set()
+        backend = None
+        for step in range(len(self.ring_keys)):
+            node = self.ring_backends[(idx + step) % len(self.ring_keys)]
+            if node.url in seen or node not in candidates:
+                continue
+            seen.add(node.url)
+            if backend is None:
+                backend = node  # fall back to the first usable ring node if every one is over capacity
+            if node.inflight < capacity:
+                backend = node
+                break
+        if backend is not preferred:
+            backend.affinity_spills += 1
+
+        previous = self.sessions.pop(key, None)
+        if previous == backend.url:
+            backend.affinity_hits += 1
+        else:
+            backend.affinity_misses += 1
+        self.sessions[key] = backend.url
+        if len(self.sessions) > MAX_TRACKED_SESSIONS:
+            self.sessions.popitem(last=False)
+        return backend
+
+    @staticmethod
+    def _score(backend, policy):
+        if policy in ("least_requests", "affinity"):
+            return backend.inflight
+        if policy == "least_tokens":
+            return backend.inflight_tokens
+        if policy == "queue_depth":
+            return max(backend.inflight, backend.queue_depth)
+        return 0
+
+    def acquire(self, est_tokens=0, key=None, exclude=(), policy=None):
+        """Pick a replica with the pool's policy, or `policy` for this call only (e.g. hedges go to the least loaded)."""
+        policy = policy or self.policy
+        with self.lock:
+            candidates = [b for b in self.backends if b.url not in exclude and b.available(self.cooldown)]
+            if not candidates:
+                raise NoBackendAvailable("No healthy vLLM replica available")
+            n = len(candidates)
+            start = self.counter % n
+            self.counter += 1
+            if policy == "round_robin":
+                backend = candidates[start]
+            elif policy == "affinity" and key is not None:
+                backend = self._pick_affinity(key, candidates)
+            else:
+                rotated = candidates[start:] + candidates[:start]
+                backend = min(rotated, key=lambda b: self._score(b, policy))
+            backend.inflight += 1
+            backend.inflight_tokens += est_tokens
+            backend.total_requests += 1
+            return backend
+
+    def release(self, backend, est_tokens=0):
+        with self.lock:
+            backend.inflight -= 1
+            backend.inflight_tokens -= est_tokens
+            if backend.draining:
+                self._reap(backend)
+
+    def record_result(self, backend, ok):
+        with self.lock:
+            if ok:
+                if backend.circuit != "closed":
+                    logging.warning(f"Circuit closed for {backend.url}, re-admitting")
+                backend.circuit = "closed"
+                backend.consecutive_failures = 0
+                return
+            backend.total_errors += 1
+            backend.consecutive_failures += 1
+            if backend.circuit == "half_open" or (backend.circuit == "closed" and backend.consecutive_failures >= self.failure_threshold):
+                logging.warning(f"Circuit opened for {backend.url} after {backend.consecutive_failures} failures")
+                backend.circuit = "open"
+                backend.opened_at = time.time()
+
+    def stats(self):
+        with self.lock:
+            return {"policy": self.policy, "backends": [b.stats() for b in self.backends]}
+
+    def probe_health(self, timeout=2):
+        for backend in list(self.backends):
+            try:
+                ok = requests.get(f"{backend.url}/health", timeout=timeout).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            with self.lock:
+                if ok:
+                    backend.probe_failures = 0
+                    backend.probe_successes += 1
+                    if not backend.healthy and backend.probe_successes >= self.healthy_threshold:
+                        logging.warning(f"{backend.url} passed health checks, re-admitting")
+                        backend.healthy = True
+                        backend.circuit = "closed"
+                        backend.consecutive_failures = 0
+                else:
+                    backend.probe_successes = 0
+                    backend.probe_failures += 1
+                    if backend.healthy and backend.probe_failures >= self.unhealthy_threshold:
+                        logging.warning(f"{backend.url} failed health checks, ejecting")
+                        backend.healthy = False
+
+    def start_health_checker(self, interval=5.0):
+        self.health_checking = True
+
+        def loop():
+            while True:
+                self.probe_health()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def poll_metrics(self, timeout=2):
+        for backend in list(self.backends):
+            try:
+                response = requests.get(f"{backend.url}/metrics", timeout=timeout)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Failed to poll {backend.url}/metrics: {e}")
+                continue
+            values = parse_prometheus_metrics(response.text, VLLM_QUEUE_METRICS + VLLM_PREFIX_CACHE_METRICS)
+            backend.queue_depth = sum(values[name] for name in VLLM_QUEUE_METRICS)
+            backend.prefix_cache_queries = values["vllm:prefix_cache_queries"]
+            backend.prefix_cache_hits = values["vllm:prefix_cache_hits"]
+
+    def start_metrics_poller(self, interval=1.0):
+        def loop():
+            while True:
+                self.poll_metrics()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+
+def load_manifest(path):
+    """Read the replica list written by `scripts/launch_vllm_servers.sh`: {"backends": ["http://host:port", ...]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("backends", [])
+
+
+def start_manifest_watcher(pool, path, interval=2.0):
+    """Re-sync the pool whenever the manifest file changes on disk."""
+    def loop():
+        last_mtime = None
+        while True:
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime != last_mtime:
+                    pool.sync_backends(load_manifest(path))
+                    last_mtime = mtime
+            except (OSError, ValueError) as e:
+                logging.warning(f"Failed to load backend manifest {path}: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+def handle_registry_request(pool, method, action, data):
+    """
+    Shared implementation of the router's `/backends` endpoints. Returns (json_body, status).
+
+      GET    /backends                         list replicas and their state
+      POST   /backends          {"url": ...}   register (or re-activate) a replica
+      POST   /backends/drain    {"url": ...}   stop new traffic, keep serving in-flight requests
+      DELETE /backends          {"url": ...}   drain, then remove once idle
+    """
+    if method == "GET":
+        return pool.stats(), 200
+    url = (data or {}).get("url")
+    if not url:
+        return {"error": "Missing 'url'"}, 400
+    if method == "POST" and action == "":
+        # Without a health prober nothing would ever admit an unhealthy replica
+        healthy = (data or {}).get("healthy", True) or not pool.health_checking
+        backend = pool.add_backend(url, healthy=healthy)
+        return backend.stats(), 200
+    if method == "POST" and action == "drain":
+        backend = pool.drain_backend(url)
+    elif method == "DELETE" and action == "":
+        backend = pool.drain_backend(url, remove=True)
+    else:
+        return {"error": f"Unsupported registry request {method} /backends/{action}"}, 405
+    if backend is None:
+        return {"error": f"Unknown backend {url}"}, 404
+    return backend.stats(), 200
+
+
+def is_cacheable(method, endpoint, payload):
+    """
+    Only deterministic completions are cached: greedy decoding (temperature 0) or a fixed seed.
+    Streaming requests and sampling without a seed always go to a replica.
+    """
+    if method != "POST" or endpoint not in CACHEABLE_ENDPOINTS or not isinstance(payload, dict):
+        return False
+    if payload.get("stream"):
+        return False
+    return payload.get("temperature") == 0 or payload.get("seed") is not None
+
+
+def request_cache_key(endpoint, payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{endpoint}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size/TTL-bounded LRU of backend responses keyed by `request_cache_key`, optionally persisted
+    as one JSON file per entry under `cache_dir` so it survives router restarts.
+
+    Concurrent identical requests are coalesced: the first caller computes the response, later
+    callers wait for it instead of sending their own copy to a replica. Usable from threads
+    (`get_or_compute`) and from an event loop (`get_or_compute_async`).
+
+    With `cache_dir`, the entries already on disk are indexed at start-up, `max_bytes` bounds the
+    size of the files, and an evicted or expired entry's file is deleted. Only the bodies that were
+    read or written since start-up are also held in memory.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=512 * 1024 * 1024, ttl=24 * 3600, cache_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        # key -> (created, value or None while only on disk, bytes counted against max_bytes)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _index(self):
+        files = []
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(".json") and item.is_file():
+                stat = item.stat()
+                files.append((stat.st_mtime, item.name[:-len(".json")], stat.st_size))
+        with self.lock:
+            for created, key, size in sorted(files):
+                self._add(key, created, None, size)
+            for key in [key for key, entry in self.entries.items() if time.time() - entry[0] >= self.ttl]:
+                self._evict(key)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            created, value, size = entry
+            if time.time() - created >= self.ttl:
+                self._evict(key)
+                return None
+            self.entries.move_to_end(key)
+            if value is not None:
+                return value
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            value = (stored["status"], stored["headers"], base64.b64decode(stored["body"]))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Dropping unreadable cache entry {key}: {e}")
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    self._evict(key)
+            return None
+        with self.lock:
+            if self.entries.get(key) is entry:
+                self.entries[key] = (created, value, size)
+        return value
+
+    def put(self, key, value):
+        """`value` is (status, headers, body bytes); only 200 responses are stored."""
+        if value[0] != 200:
+            return
+        created = time.time()
+        size = len(value[2])
+        if self.cache_dir:
+            data = json.dumps({"created": created, "status": value[0], "headers": value[1],
+                               "body": base64.b64encode(value[2]).decode("ascii")})
+            size = len(data)
+            try:
+                # Written before it is indexed, so an eviction of the entry also deletes the file
+                with open(self._path(key), "w", encoding="utf-8") as f:
+                    f.write(data)
+            except OSError as e:
+                logging.warning(f"Failed to persist cache entry {key}: {e}")
+                return
+        with self.lock:
+            if key in self.entries:
+                # Same key, same file: it was just rewritten, so keep it
+                self._evict(key, unlink=False)
+            self._add(key, created, value, size)
+
+    def _add(self, key, created, value, size):
+        self.entries[key] = (created, value, size)
+        self.total_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._evict(next(iter(self.entries)))
+
+    def _evict(self, key, unlink=True):
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+        if self.cache_dir and unlink:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Failed to delete cache entry {key}: {e}")
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        with self.lock:
+            waiter = self.pending.get(key)
+            leader = waiter is None
+            if leader:
+                waiter = self.pending[key] = [threading.Event(), None]
+        if not leader:
+            self.coalesced += 1
+            waiter[0].wait()
+            # The leader failed without a response: fall back to our own backend call
+            return waiter[1] if waiter[1] is not None else compute()
+        self.misses += 1
+        try:
+            value = compute()
+            self.put(key, value)
+            waiter[1] = value
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            waiter[0].set()
+
+    async def get_or_compute_async(self, key, compute):
+        # Reads and writes of cache_dir stay off the event loop
+        value = await asyncio.to_thread(self.get, key) if self.cache_dir else self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self.pending.get(key)
+        if task is None:
+            self.misses += 1
+            # Run the backend call as its own task so a disconnecting first caller doesn't cancel it for the others
+            task = self.pending[key] = asyncio.ensure_future(self._compute_and_store(key, compute))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key, compute):
+        try:
+            value = await compute()
+            if self.cache_dir:
+                await asyncio.to_thread(self.put, key, value)
+            else:
+                self.put(key, value)
+            return value
+        finally:
+            self.pending.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+class Hedger:
+    """
+    Request hedging for tail latency: once a request has been outstanding for longer than the
+    `quantile` of recent latencies on its endpoint, a duplicate goes to another replica and the
+    first answer wins.
+
+    Each endpoint has a token bucket: every request adds `budget` tokens (at most 1.0) and every
+    hedge spends one, so hedges never exceed `budget` times the requests and load never more than
+    doubles. Hedging starts after `min_samples` latencies have been observed on the endpoint.
+    """
+
+    def __init__(self, quantile=0.95, budget=0.1, window=1000, min_samples=20, min_delay=0.05, max_burst=10):
+        self.quantile = quantile
+        self.budget = min(budget, 1.0)
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_burst = max_burst
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.tokens = defaultdict(float)
+        self.counts = defaultdict(lambda: {"requests": 0, "hedged": 0, "hedge_wins": 0})
+
+    def delay(self, endpoint):
+        """Register a new request; returns seconds to wait before hedging it, or None to never hedge."""
+        self.counts[endpoint]["requests"] += 1
+        self.tokens[endpoint] = min(self.tokens[endpoint] + self.budget, self.max_burst)
+        samples = self.latencies[endpoint]
+        if len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return max(ordered[int(self.quantile * (len(ordered) - 1))], self.min_delay)
+
+    def try_hedge(self, endpoint):
+        if self.tokens[endpoint] < 1:
+            return False
+        self.tokens[endpoint] -= 1
+        self.counts[endpoint]["hedged"] += 1
+        return True
+
+    def record(self, endpoint, latency, hedge_won=False):
+        self.latencies[endpoint].append(latency)
+        if hedge_won:
+            self.counts[endpoint]["hedge_wins"] += 1
+
+    def stats(self):
+        return {endpoint: dict(counts) for endpoint, counts in self.counts.items()}
+
+
+def parse_priority_weights(spec):
+    """"high=8,normal=2,low=1" -> {"high": 8.0, "normal": 2.0, "low": 1.0}"""
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    if DEFAULT_PRIORITY not in weights:
+        raise ValueError(f"Priority weights must include the default class '{DEFAULT_PRIORITY}'")
+    return weights
+
+
+def priority_class(headers, weights):
+    cls = headers.get(PRIORITY_HEADER, DEFAULT_PRIORITY).strip().lower()
+    return cls if cls in weights else DEFAULT_PRIORITY
+
+
+class _Waiter:
+    __slots__ = ("cls", "enqueued", "wake", "admitted")
+
+    def __init__(self, cls, wake):
+        self.cls = cls
+        self.enqueued = time.monotonic()
+        self.wake = wake
+        self.admitted = False
+
+
+class AdmissionController:
+    """
+    Caps the requests in flight to the replicas at `max_inflight`. Requests over the cap wait in a
+    bounded FIFO per priority class; when a slot frees up, the next class is picked by stride
+    scheduling, so each backlogged class gets slots in proportion to its weight and no class starves.
+    A request whose class queue is full, or that waits longer than `max_wait` seconds, is rejected
+    with `AdmissionRejected` so the client can back off instead of tying up a server thread.
+
+    Usable from threads (`admit`) and from an event loop (`admit_async`); every admitted request
+    must call `release` exactly once.
+    """
+
+    def __init__(self, max_inflight, weights, queue_size=64, max_wait=60.0):
+        self.max_inflight = max_inflight
+        self.weights = weights
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.queues = {cls: deque() for cls in weights}
+        # Stride scheduling: the backlogged class with the smallest pass goes next and advances by 1 / weight
+        self.passes = {cls: 0.0 for cls in weights}
+        self.vtime = 0.0
+        self.counts = {cls: {"admitted": 0, "queued": 0, "waited": 0, "rejected": 0, "timed_out": 0,
+                             "total_wait": 0.0, "max_wait": 0.0} for cls in weights}
+        # Recent wait per class, used for Retry-After
+        self.recent_wait = {cls: 0.0 for cls in weights}
+
+    def _enqueue(self, cls, wake):
+        """Returns None if a slot was free, else the `_Waiter` now queued."""
+        with self.lock:
+            if self.inflight < self.max_inflight and not any(self.queues.values()):
+                self.inflight += 1
+                self.counts[cls]["admitted"] += 1
+                return None
+            queue = self.queues[cls]
+            if len(queue) >= self.queue_size:
+                self.counts[cls]["rejected"] += 1
+                raise AdmissionRejected(f"Queue for priority '{cls}' is full", self._retry_after(cls))
+            if not queue:
+                # A class returning from idle doesn't get credit for the time it had nothing queued
+                self.passes[cls] = max(self.passes[cls], self.vtime)
+            waiter = _Waiter(cls, wake)
+            queue.append(waiter)
+            self.counts[cls]["queued"] += 1
+            return waiter
+
+    def _retry_after(self, cls):
+        return max(1, math.ceil(self.recent_wait[cls]))
+
+    def release(self):
+        with self.lock:
+            backlogged = [cls for cls, queue in self.queues.items() if queue]
+            if not backlogged:
+                self.inflight -= 1
+                return
+            cls = min(backlogged, key=lambda c: self.passes[c])
+            self.vtime = self.passes[cls]
+            self.passes[cls] += 1.0 / self.weights[cls]
+            waiter = self.queues[cls].popleft()
+            # The freed slot goes straight to the waiter, so `inflight` is unchanged
+            waiter.admitted = True
+            wait = time.monotonic() - waiter.enqueued
+            counts = self.counts[cls]
+            counts["admitted"] += 1
+            counts["waited"] += 1
+            counts["total_wait"] += wait
+            counts["max_wait"] = max(counts["max_wait"], wait)
+            self.recent_wait[cls] = 0.8 * self.recent_wait[cls] + 0.2 * wait
+            waiter.wake()
+
+    def _abandon(self, waiter):
+        """Takes a waiter that stopped waiting out of its queue; returns True if it had already been admitted."""
+        with self.lock:
+            if waiter.admitted:
+                return True
+            self.queues[waiter.cls].remove(waiter)
+            return False
+
+    def _timed_out(self, waiter):
+        with self.lock:
+            self.counts[waiter.cls]["timed_out"] += 1
+            self.recent_wait[waiter.cls] = 0.8 * self.recent_wait[waiter.cls] + 0.2 * self.max_wait
+        return AdmissionRejected(f"Waited more than {self.max_wait}s for a slot", self._retry_after(waiter.cls))
+
+    def admit(self, cls):
+        event = threading.Event()
+        waiter = self._enqueue(cls, event.set)
+        if waiter is not None and not event.wait(self.max_wait) and not self._abandon(waiter):
+            raise self._timed_out(waiter)
+
+    async def admit_async(self, cls):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(cls, lambda: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None)))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                raise self._timed_out(waiter)
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on the slot if it had already been handed to us
+            if self._abandon(waiter):
+                self.release()
+            raise
+
+    def stats(self):
+        with self.lock:
+            classes = {}
+            for cls, counts in self.counts.items():
+                classes[cls] = {
+                    "weight": self.weights[cls],
+                    "queue_depth": len(self.queues[cls]),
+                    "admitted": counts["admitted"],
+                    "rejected": counts["rejected"],
+                    "timed_out": counts["timed_out"],
+                    "queued": counts["queued"],
+                    "avg_wait_ms": 1000 * counts["total_wait"] / max(counts["waited"], 1),
+                    "max_wait_ms": 1000 * counts["max_wait"],
+                }
+            return {"inflight": self.inflight, "max_inflight": self.max_inflight, "classes": classes}
+
+
+def scan_usage(body):
+    """{"prompt_tokens": n, "completion_tokens": m} from a response body or SSE chunk, without decoding it."""
+    return {name.decode("ascii"): int(value) for name, value in USAGE_PATTERN.findall(body)}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class RouterMetrics:
+    """
+    Per-replica traffic counters and histograms, rendered in the Prometheus text format by `render`.
+    One `observe` call per attempt sent to a replica, so retries and hedges are counted where they ran.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.latency = {}
+        self.request_bytes = {}
+        self.response_bytes = {}
+
+    def observe(self, backend_url, status, latency, request_bytes, response_bytes, usage=None):
+        """`status` is None when the replica could not be reached or the exchange was cut off."""
+        with self.lock:
+            self.requests[(backend_url, str(status) if status is not None else "error")] += 1
+            if backend_url not in self.latency:
+                self.latency[backend_url] = _Histogram(LATENCY_BUCKETS)
+                self.request_bytes[backend_url] = _Histogram(SIZE_BUCKETS)
+                self.response_bytes[backend_url] = _Histogram(SIZE_BUCKETS)
+            self.latency[backend_url].observe(latency)
+            self.request_bytes[backend_url].observe(request_bytes)
+            self.response_bytes[backend_url].observe(response_bytes)
+            for kind, count in (usage or {}).items():
+                self.tokens[(backend_url, kind)] += count
+
+    def render(self, pool, cache=None, admission=None):
+        lines = []
+
+        def family(name, kind, doc):
+            lines.append(f"# HELP {name} {doc}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        backends = pool.stats()["backends"]
+        family("router_backend_inflight", "gauge", "Requests in flight to the replica")
+        lines += [f'router_backend_inflight{{backend="{b["url"]}"}} {b["inflight"]}' for b in backends]
+        family("router_backend_up", "gauge", "1 if the replica passes health probes and its circuit is not open")
+        lines += [f'router_backend_up{{backend="{b["url"]}"}} {int(b["healthy"] and b["circuit"] != "open")}' for b in backends]
+        family("router_backend_errors_total", "counter", "Failed requests (connection errors and 5xx) per replica")
+        lines += [f'router_backend_errors_total{{backend="{b["url"]}"}} {b["total_errors"]}' for b in backends]
+
+        with self.lock:
+            family("router_requests_total", "counter", "Requests sent to each replica by response status")
+            lines += [f'router_requests_total{{backend="{url}",status="{status}"}} {count}'
+                      for (url, status), count in sorted(self.requests.items())]
+            family("router_tokens_total", "counter", "Prompt and completion tokens reported in response usage")
+            lines += [f'router_tokens_total{{backend="{url}",kind="{kind}"}} {count}' for (url, kind), count in sorted(self.tokens.items())]
+            for name, histograms, doc in (
+                ("router_request_duration_seconds", self.latency, "Time from sending a request to the last response byte"),
+                ("router_request_size_bytes", self.request_bytes, "Request body size"),
+                ("router_response_size_bytes", self.response_bytes, "Response body size"),
+            ):
+                family(name, "histogram", doc)
+                for url, histogram in sorted(histograms.items()):
+                    lines += histogram.render(name, f'backend="{url}"')
+
+        if cache is not None:
+            cache_stats = cache.stats()
+            family("router_cache_requests_total", "counter", "Response cache lookups by outcome")
+            lines += [f'router_cache_requests_total{{outcome="{outcome}"}} {cache_stats[outcome]}' for outcome in ("hits", "misses", "coalesced")]
+        if admission is not None:
+            classes = admission.stats()["classes"]
+            family("router_queue_depth", "gauge", "Requests waiting for an admission slot per priority class")
+            lines += [f'router_queue_depth{{priority="{cls}"}} {c["queue_depth"]}' for cls, c in classes.items()]
+            family("router_admission_rejected_total", "counter", "Requests answered 429 per priority class")
+            lines += [f'router_admission_rejected_total{{priority="{cls}"}} {c["rejected"] + c["timed_out"]}' for cls, c in classes.items()]
+        return "\n".join(lines) + "\n"
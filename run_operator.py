@@ -9,13 +9,20 @@ import logging
 import base64
 import asyncio
 from typing import List, Dict
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from playwright.async_api import async_playwright, Browser, Page
 from prompts import *
 from openai import OpenAI
 from utils_webarena import get_webarena_accessibility_tree
-from cua_utils import CUA_KEY_TO_PLAYWRIGHT_KEY
+from input_actions import press_keys, type_text
+from page_settle import PageSettler, SETTLE_MODES
+from step_journal import StepJournal, task_finished
+from tracing import TaskTracer, site_name
+from downloads import DownloadCollector
+from net_filter import NetworkFilter, NET_PROFILES
+from har_archive import HarArchive, HAR_MODES
+from warm_cache import WarmCache
+from scheduler import DomainScheduler, ChallengeWatcher
 
 
 def setup_logger(folder_path):
@@ -32,38 +39,106 @@ def setup_logger(folder_path):
 
 
 class PlaywrightComputer:
-    def __init__(self, args, task):
+    def __init__(self, args, task, tracer, downloads, har, watcher):
         self.args = args
         self.task = task
+        self.tracer = tracer
+        self.downloads = downloads
+        self.net_filter = NetworkFilter.from_args(args, task)
+        self.har = har
+        self.watcher = watcher
+        self.cache = WarmCache.from_args(args, task)
         self._playwright = None
         self._browser = None
+        self._context = None
         self._page = None
+        self._settler = PageSettler.from_args(args)
+        # Seconds spent waiting for the page after the last action, and in total
+        self.last_settle = 0.0
+        self.total_settle = 0.0
 
     async def __aenter__(self):
+        launch_start = time.perf_counter()
         self._playwright = await async_playwright().start()
         launch_args = [
             f"--window-size={self.args.window_width},{self.args.window_height}",
             "--disable-extensions",
             "--disable-file-system",
         ]
-        self._browser = await self._playwright.chromium.launch(
-            headless=self.args.headless,
-            args=launch_args,
-            env={"DISPLAY": ":0"},
-        )
-        context = await self._browser.new_context(
-            viewport={"width": self.args.window_width, "height": self.args.window_height},
-            device_scale_factor=1 if self.args.force_device_scale else 1
-        )
-        self._page = await context.new_page()
-        await self._page.goto(self.task['web'], timeout=180000)
+        profile_dir = await self.cache.clone()
+        # Requests of a service worker would bypass the routes of the network filter and the HAR archive
+        self.service_workers = "block" if "block" in (self.net_filter.service_workers, self.har.service_workers) else "allow"
+        if profile_dir is not None:
+            # A profile seeded with the site's warm cache; the context owns its browser
+            start = time.perf_counter()
+            self._context = context = await self._playwright.chromium.launch_persistent_context(
+                profile_dir,
+                headless=self.args.headless,
+                args=launch_args,
+                env={"DISPLAY": ":0"},
+                viewport={"width": self.args.window_width, "height": self.args.window_height},
+                device_scale_factor=1 if self.args.force_device_scale else 1,
+                service_workers=self.service_workers,
+            )
+            self.cache.launch_seconds = time.perf_counter() - start
+        else:
+            self._browser = await self._playwright.chromium.launch(
+                headless=self.args.headless,
+                args=launch_args,
+                env={"DISPLAY": ":0"},
+            )
+            self._context = context = await self._browser.new_context(
+                viewport={"width": self.args.window_width, "height": self.args.window_height},
+                device_scale_factor=1 if self.args.force_device_scale else 1,
+                service_workers=self.service_workers,
+            )
+        self.watcher.attach(context)
+        await self.downloads.prepare()
+        self.downloads.attach(context)
+        await self.net_filter.attach(context)
+        await self.har.attach(context)
+        if self.cache.enabled:
+            await self.cache.attach(context)
+        self._page = context.pages[0] if context.pages else await context.new_page()
+        self.tracer.add("launch", launch_start, time.perf_counter())
+        self._settler.attach(self._page)
+        with self.tracer.span("goto", url=self.task['web']):
+            await self._page.goto(self.task['web'], timeout=180000)
+        await self._settle(delay=0)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.watcher.finish()
+        if self.watcher.challenges:
+            logging.info(f"Site refused or challenged the task: {self.watcher.challenges}")
+        await self.downloads.close()
+        if self.downloads.files or self.downloads.rejected or self.downloads.failed:
+            logging.info(f"Downloads in {self.downloads.directory}: {self.downloads.stats()}")
+        if self.net_filter.enabled:
+            await self.net_filter.close()
+            logging.info(f"Network filter: {self.net_filter.stats()}")
+        if self.har.enabled:
+            logging.info(f"HAR archive: {self.har.stats()}")
+        if self.cache.enabled:
+            self.tracer.meta["cache"] = self.cache.stats()
+            logging.info(f"HTTP cache: {self.tracer.meta['cache']}")
+        if self._context:
+            # Closing the context, not just the browser, is what writes a recorded HAR archive
+            try:
+                await self._context.close()
+            except Exception as e:
+                logging.warning(f"Failed to close browser context: {e}")
         if self._browser:
             await self._browser.close()
         if self._playwright:
             await self._playwright.stop()
+        await self.cache.close()
+
+    async def _settle(self, delay=None):
+        with self.tracer.span("settle"):
+            self.last_settle = await self._settler.settle(self._page, delay=delay)
+        self.total_settle += self.last_settle
 
     async def click(self, x: int, y: int, button: str = "left") -> None:
         # Set target=_self if the element has a target attribute
@@ -84,20 +159,20 @@ class PlaywrightComputer:
             await self._page.mouse.wheel(x, y)
         else:
             await self._page.mouse.click(x, y, button={"left": "left", "right": "right"}.get(button.lower(), "left"))
-        await asyncio.sleep(3)
+        await self._settle()
 
     async def double_click(self, x: int, y: int) -> None:
         await self._page.mouse.dblclick(x, y)
-        await asyncio.sleep(3)
+        await self._settle()
 
     async def scroll(self, x: int, y: int, scroll_x: int, scroll_y: int) -> None:
         await self._page.mouse.move(x, y)
         await self._page.evaluate(f"window.scrollBy({scroll_x}, {scroll_y})")
-        await asyncio.sleep(3)
+        await self._settle()
 
     async def type(self, text: str) -> None:
-        await self._page.keyboard.type(text)
-        await asyncio.sleep(3)
+        await type_text(self._page, text)
+        await self._settle()
 
     async def wait(self, ms: int = 1000) -> None:
         await asyncio.sleep(ms / 1000)
@@ -106,11 +181,7 @@ class PlaywrightComputer:
         await self._page.mouse.move(x, y)
 
     async def keypress(self, keys: List[str]) -> None:
-        mapped = [CUA_KEY_TO_PLAYWRIGHT_KEY.get(k.lower(), k) for k in keys]
-        for k in mapped:
-            await self._page.keyboard.down(k)
-        for k in reversed(mapped):
-            await self._page.keyboard.up(k)
+        await press_keys(self._page, keys)
 
     async def drag(self, path: List[Dict[str, int]]) -> None:
         if not path: return
@@ -119,26 +190,39 @@ class PlaywrightComputer:
         for pt in path[1:]:
             await self._page.mouse.move(pt["x"], pt["y"])
         await self._page.mouse.up()
-        await asyncio.sleep(3)
+        await self._settle()
 
     async def goto(self, url: str) -> None:
         try:
             await self._page.goto(url)
         except Exception as e:
             print(f"Error navigating to {url}: {e}")
-        await asyncio.sleep(3)
+        await self._settle()
+
+    async def resume_at(self, url: str) -> bool:
+        """Reload the page an interrupted run stopped on; False if it cannot be loaded."""
+        try:
+            with self.tracer.span("goto", url=url):
+                await self._page.goto(url, timeout=180000)
+        except Exception as e:
+            logging.warning(f"Cannot resume at {url}: {e}")
+            return False
+        await self._settle(delay=0)
+        return True
 
     async def back(self) -> None:
         await self._page.go_back()
-        await asyncio.sleep(3)
+        await self._settle()
 
     async def forward(self) -> None:
         await self._page.go_forward()
-        await asyncio.sleep(3)
+        await self._settle()
 
     async def screenshot(self, path=None) -> str:
-        png_bytes = await self._page.screenshot(path=path, timeout=60000) if path else await self._page.screenshot(timeout=60000)
-        return base64.b64encode(png_bytes).decode("utf-8")
+        with self.tracer.span("screenshot"):
+            png_bytes = await self._page.screenshot(path=path, timeout=60000) if path else await self._page.screenshot(timeout=60000)
+        with self.tracer.span("encode", bytes=len(png_bytes)):
+            return base64.b64encode(png_bytes).decode("utf-8")
 
     def get_environment(self) -> str:
         return "browser"
@@ -161,28 +245,40 @@ async def handle_item(item, computer: PlaywrightComputer, img_path):
         action_args = {k: v for k, v in action.items() if k != "type"}
         print(f"\u2192 {action_type}({action_args})")
         if action_type != "screenshot":
+            computer.last_settle = 0.0
+            action_start = time.perf_counter()
             await getattr(computer, action_type)(**action_args)
+            # Actions end with a settle, which is traced as its own span
+            computer.tracer.add(f"action:{action_type}", action_start, time.perf_counter() - computer.last_settle)
+            logging.info(f"Settle time: {computer.last_settle:.2f}s after {action_type}")
         screenshot_base64 = await computer.screenshot(path=img_path)
-        call_output = {
-            "type": "computer_call_output",
-            "call_id": item["call_id"],
-            "acknowledged_safety_checks": item.get("pending_safety_checks", []),
-            "output": {
-                "type": "input_image",
-                "image_url": f"data:image/png;base64,{screenshot_base64}",
-            },
-        }
-        return [call_output]
-
-
-def run_task_sync(task, args, result_dir, trial_id):
+        return [screenshot_output(item, screenshot_base64)]
+
+
+def screenshot_output(item, screenshot_base64):
+    return {
+        "type": "computer_call_output",
+        "call_id": item["call_id"],
+        "acknowledged_safety_checks": item.get("pending_safety_checks", []),
+        "output": {
+            "type": "input_image",
+            "image_url": f"data:image/png;base64,{screenshot_base64}",
+        },
+    }
+
+
+def run_task_sync(task, args, result_dir, trial_id, scheduler):
     openai_api_key = os.getenv("OPENAI_API_KEY")
     client = OpenAI(api_key=openai_api_key)
 
-    asyncio.run(run_task(task, args, client, args.api_model, result_dir, trial_id))
+    tracer = TaskTracer(task, trial_id)
+    try:
+        asyncio.run(run_task(task, args, client, args.api_model, result_dir, trial_id, tracer, scheduler))
+    finally:
+        tracer.save(os.path.join(result_dir, f'task{task["id"]}-{trial_id}'))
 
 
-async def run_task(task, args, client, api_model, result_dir, trial_id):
+async def run_task(task, args, client, api_model, result_dir, trial_id, tracer, scheduler):
     task_dir = os.path.join(result_dir, f'task{task["id"]}-{trial_id}')
     os.makedirs(task_dir, exist_ok=True)
     setup_logger(task_dir)
@@ -190,10 +286,8 @@ async def run_task(task, args, client, api_model, result_dir, trial_id):
 
     logging.info(f"Using model: {api_model} for task {task['id']} trial {trial_id}")
 
-    async with PlaywrightComputer(args, task) as computer:
-        for f in os.listdir(args.download_dir):
-            os.remove(os.path.join(args.download_dir, f))
-
+    async with PlaywrightComputer(args, task, tracer, DownloadCollector.from_args(args, task, trial_id),
+                                  HarArchive.from_args(args, task, trial_id), ChallengeWatcher(scheduler, site_name(task))) as computer:
         tools = [
             {
                 "type": "computer_use_preview", 
@@ -206,11 +300,35 @@ async def run_task(task, args, client, api_model, result_dir, trial_id):
         it = 0
         raw_logs = [items[0]]
         processed_logs = [items[0]]
-        
+
+        # Continue an interrupted trajectory from the page and response its journal ends on
+        journal = StepJournal(task_dir)
+        resume = journal.resume_point()
+        resumed_at = None
+        if resume and resume["pending_call"] and await computer.resume_at(resume["url"]):
+            for step in journal.steps:
+                items += step["output"]
+                raw_logs.extend(step["output"])
+                processed_logs.extend(step["processed"])
+            it = resume["it"] + 1
+            response = {"id": resume["response_id"]}
+            screenshot_base64 = await computer.screenshot(path=os.path.join(task_dir, f'screenshot{it}.png'))
+            input = [screenshot_output(resume["pending_call"], screenshot_base64)]
+            resumed_at = it
+            logging.info(f"Resuming after iter {resume['it']} at {resume['url']}")
+        else:
+            journal.restart()
+        journal.record("resume" if resumed_at else "start", task_id=task["id"], trial_id=trial_id, web=task["web"],
+                       url=computer.get_current_url())
+        reached_final_answer = False
+
         while it < args.max_iter:
             retry_count = 0
             max_retries = 20
+            model_start = time.perf_counter()
+            processed_step = []
             while retry_count < max_retries:
+                call_start = time.perf_counter()
                 try:
                     if it == 0:
                         img_path = os.path.join(task_dir, f'screenshot{it}.png')
@@ -228,6 +346,7 @@ async def run_task(task, args, client, api_model, result_dir, trial_id):
                                 }
                             ]
                         }]
+                    call_start = time.perf_counter()
                     response = client.responses.create(
                         model=api_model,
                         previous_response_id=response['id'] if it > 0 else None,
@@ -237,7 +356,11 @@ async def run_task(task, args, client, api_model, result_dir, trial_id):
                         truncation='auto',
                         temperature=1
                     ).to_dict()
+                    usage = response.get('usage') or {}
+                    tracer.add('model_call', call_start, time.perf_counter(), model=api_model,
+                               prompt_tokens=usage.get('input_tokens'), completion_tokens=usage.get('output_tokens'))
 
+                    parse_start = time.perf_counter()
                     for output in response.get('output', []):
                         if output.get('type') == 'computer_call':
                             message_type = 'action'
@@ -263,30 +386,54 @@ async def run_task(task, args, client, api_model, result_dir, trial_id):
                             }
                         }
                         processed_logs.append(processed_output)
+                        processed_step.append(processed_output)
                         
                     raw_logs.extend(response['output'])
+                    tracer.add('parse', parse_start, time.perf_counter())
                     break
                 except Exception as e:
                     retry_count += 1
                     err_name = type(e).__name__
+                    tracer.add('model_error', call_start, time.perf_counter(), error=err_name)
                     print(e)
                     print(f"Retry {retry_count}/{max_retries} for task {task['id']}-{trial_id} after error: {err_name}: {e} with model {api_model}")
                     logging.warning(f"Retry {retry_count}/{max_retries} for task {task['id']}-{trial_id} after error: {err_name}: {e}")
+                    if it == resumed_at and retry_count >= 3:
+                        # The stored response may have expired; start over rather than retry forever
+                        logging.warning("Cannot continue the interrupted conversation, restarting from scratch")
+                        journal.restart()
+                        await computer.resume_at(task['web'])
+                        journal.record("start", task_id=task["id"], trial_id=trial_id, web=task["web"], url=computer.get_current_url())
+                        items, raw_logs, processed_logs = items[:1], [items[0]], [items[0]]
+                        it, resumed_at, retry_count = 0, None, 0
+                        response = {}
+                        processed_step = []
+                        continue
                     await asyncio.sleep(10)
 
             if "output" not in response:
                 raise ValueError("No output from model")
             items += response["output"]
+            model_time = time.perf_counter() - model_start
 
             reached_final_answer = False
+            pending_call = None
+            settle = computer.total_settle
+            img_path = os.path.join(task_dir, f'screenshot{it+1}.png')
             for item in response["output"]:
-                img_path = os.path.join(task_dir, f'screenshot{it+1}.png')
                 call_output = await handle_item(item, computer, img_path)
                 if call_output:
                     input = call_output
+                    pending_call = item
                 if item['type'] == 'message':
                     reached_final_answer = True
                     break
+
+            journal.record("step", it=it, response_id=response["id"], output=response["output"], processed=processed_step,
+                           pending_call=pending_call, screenshot=img_path, url=computer.get_current_url(),
+                           timing={"model": model_time, "settle": computer.total_settle - settle,
+                                   "step": time.perf_counter() - model_start})
+            tracer.add('step', model_start, time.perf_counter(), it=it)
             
             if reached_final_answer:
                 break
@@ -294,10 +441,13 @@ async def run_task(task, args, client, api_model, result_dir, trial_id):
             it += 1
 
         logging.info(f"Task {task['id']} completed in {it + 1} iterations.")
+        logging.info(f"Total settle time: {computer.total_settle:.1f}s ({args.settle} mode)")
         with open(os.path.join(task_dir, 'output.json'), 'w', encoding='utf-8') as f:
             json.dump(raw_logs, f, ensure_ascii=False, indent=4)
         with open(os.path.join(task_dir, 'interact_messages.json'), 'w', encoding='utf-8') as f:
             json.dump(processed_logs, f, ensure_ascii=False, indent=4)
+        journal.record("done", status="finished" if reached_final_answer else "max_iter", iterations=it + 1)
+        journal.close()
         logging.info("Task complete")
 
 
@@ -311,7 +461,19 @@ def main():
     parser.add_argument("--seed", type=int, default=None)
     parser.add_argument("--max_attached_imgs", type=int, default=1)
     parser.add_argument("--temperature", type=float, default=1.0)
-    parser.add_argument("--download_dir", type=str, default="downloads")
+    parser.add_argument("--download_dir", type=str, default="downloads", help="Each task/trial saves its downloads in its own subdirectory")
+    parser.add_argument("--max_download_mb", type=int, default=100, help="Discard downloaded files larger than this")
+    parser.add_argument("--max_task_download_mb", type=int, default=500, help="Discard downloads once a task/trial has saved this much")
+    parser.add_argument("--net_profile", type=str, default="off", choices=NET_PROFILES,
+                        help="Requests to block: trackers (ad/analytics domains) or lean (trackers plus audio/video)")
+    parser.add_argument("--net_block_list", type=str, default=None, help="File of extra domains to block, one per line")
+    parser.add_argument("--net_audit", action='store_true', help="Do not block; log the requests and bytes the profile would block")
+    parser.add_argument("--har_mode", type=str, default="off", choices=HAR_MODES,
+                        help="record: save each task/trial's network traffic; replay: serve it from the recordings without network access")
+    parser.add_argument("--har_dir", type=str, default="har", help="Directory of the per-task/trial HAR archives")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Per-site HTTP cache templates built by warm_cache.py; each task/trial starts from a copy of its site's. "
+                             "The browser is launched on a persistent profile; its launch time is reported next to the cache hit rate")
     parser.add_argument("--text_only", action='store_true')
     parser.add_argument("--headless", action='store_true')
     parser.add_argument("--save_accessibility_tree", action='store_true')
@@ -322,32 +484,46 @@ def main():
     parser.add_argument("--model", type=str, default='gpt', choices=['gpt', 'uitars'])
     parser.add_argument("--model_name", type=str, default="ByteDance-Seed/UI-TARS-1.5-7B")
     parser.add_argument("--num_trials", type=int, default=1)
+    parser.add_argument("--settle", type=str, default="auto", choices=SETTLE_MODES,
+                        help="auto: wait for network idle, DOM quiescence and a stable screenshot after each action; fixed: sleep --settle_delay")
+    parser.add_argument("--settle_delay", type=float, default=3.0, help="Seconds slept after each action in fixed mode")
+    parser.add_argument("--settle_floor", type=float, default=0.2, help="Minimum seconds to wait after an action in auto mode")
+    parser.add_argument("--settle_ceiling", type=float, default=5.0, help="Maximum seconds to wait after an action in auto mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="Trajectories run at once, each on its own thread")
+    parser.add_argument("--max_per_site", type=int, default=4, help="Trajectories of one website run at once")
+    parser.add_argument("--backoff_base", type=float, default=30.0,
+                        help="Seconds no new task of a website starts after it refuses or challenges one, doubling per further failure")
+    parser.add_argument("--backoff_max", type=float, default=600.0, help="Longest backoff of a website, in seconds")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="Results directory of an interrupted run: skip finished task/trials and continue the rest from their journal")
     
     args = parser.parse_args()
 
     current_time = time.strftime("%Y%m%d_%H_%M_%S", time.localtime())
-    result_dir = os.path.join(args.output_dir, current_time)
+    result_dir = args.resume or os.path.join(args.output_dir, current_time)
     os.makedirs(result_dir, exist_ok=True)
 
     with open(args.test_file, 'r', encoding='utf-8') as f:
         tasks = [json.loads(line) for line in f]
 
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        futures = []
-        for task in tasks:
-            for i in range(args.num_trials):
-                trial_id = i + 1
-                futures.append(
-                    executor.submit(
-                        run_task_sync, task, args, result_dir, trial_id
-                    )
-                )
-
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                logging.error(f"Error in task execution: {e}")
+    pending = []
+    for task in tasks:
+        for i in range(args.num_trials):
+            trial_id = i + 1
+            if args.resume and task_finished(os.path.join(result_dir, f'task{task["id"]}-{trial_id}'), 'output.json'):
+                continue
+            pending.append((site_name(task), (task, trial_id)))
+    scheduler = DomainScheduler(pending, max_per_site=args.max_per_site, backoff_base=args.backoff_base, backoff_max=args.backoff_max)
+
+    def run_one(job):
+        task, trial_id = job
+        try:
+            run_task_sync(task, args, result_dir, trial_id, scheduler)
+        except Exception as e:
+            logging.error(f"Error in task execution: {e}")
+
+    scheduler.run_threads(run_one, args.concurrency)
+    print(scheduler.summary())
 
 if __name__ == '__main__':
     main()
@@ -7,12 +7,10 @@ import os
 import shutil
 import logging
 
-from playwright.async_api import async_playwright
-
 from prompts import SYSTEM_PROMPT, SYSTEM_PROMPT_TEXT_ONLY, COMPUTER_USE_DOUBAO
-from openai import OpenAI
-from utils import get_web_element_rect, encode_image, extract_information, print_message,\
-    get_webarena_accessibility_tree, get_pdf_retrieval_ans_from_assistant, clip_message_and_obs, clip_message_and_obs_text_only
+from openai import AsyncOpenAI
+from utils import get_web_element_rect, extract_information, print_message,\
+    get_webarena_accessibility_tree, get_pdf_retrieval_ans_from_assistant, MessageWindow
 
 import os
 import base64
@@ -22,8 +20,18 @@ from qwen_vl_utils import process_vision_info
 from uitars_action_parser import parse_action_to_structure_output, parsing_response_to_selenium_code
 import ast
 import asyncio
-import concurrent.futures
-from cua_utils import CUA_KEY_TO_PLAYWRIGHT_KEY
+from input_actions import press_keys, type_text
+from browser_pool import BrowserPool, summarize_pool_stats
+from page_settle import PageSettler, SETTLE_MODES
+from disk_writer import BackgroundWriter
+from obs_encoder import ObservationEncoder, OBS_FORMATS
+from step_journal import StepJournal, task_finished
+from tracing import TaskTracer, TRACE_FILE, site_name
+from downloads import DownloadCollector
+from net_filter import NetworkFilter, NET_PROFILES
+from har_archive import HarArchive, HAR_MODES
+from warm_cache import WarmCache
+from scheduler import DomainScheduler, ChallengeWatcher
 
 def setup_main_logger(log_file_path):
     os.makedirs(os.path.dirname(log_file_path), exist_ok=True)  # Ensure directory exists
@@ -61,29 +69,7 @@ def setup_logger(folder_path):
     logger.setLevel(logging.INFO)
 
 
-# ── Playwright Browser Launch ─────────────────────────────────────────────────
-async def launch_browser(args):
-    pw = await async_playwright().start()
-    launch_args = [
-        f"--window-size={args.window_width},{args.window_height}",
-        "--disable-extensions",
-        "--disable-file-system",
-    ]
-    browser = await pw.chromium.launch(
-        chromium_sandbox=True,
-        headless=args.headless, 
-        args=launch_args,
-        env={"DISPLAY": ":0"},
-    )
-    context = await browser.new_context(
-        viewport={"width": args.window_width, "height": args.window_height},
-        device_scale_factor=1 if args.force_device_scale else 1
-    )
-    page = await context.new_page()
-    return pw, browser, page
-
-
-def format_msg(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text):
+def format_msg(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text, mime='image/png'):
     if it == 1:
         init_msg += f"Please proceed with your Thought and Action."
         init_msg_format = {
@@ -93,7 +79,7 @@ def format_msg(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text):
             ]
         }
         init_msg_format['content'].append({"type": "image_url",
-                                           "image_url": {"url": f"data:image/png;base64,{web_img_b64}"}})
+                                           "image_url": {"url": f"data:{mime};base64,{web_img_b64}"}})
         return init_msg_format
     else:
         if not pdf_obs:
@@ -103,7 +89,7 @@ def format_msg(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text):
                     {'type': 'text', 'text': f"Observation:{warn_obs} please analyze the attached screenshot and give the Thought and Action. "},
                     {
                         'type': 'image_url',
-                        'image_url': {"url": f"data:image/png;base64,{web_img_b64}"}
+                        'image_url': {"url": f"data:{mime};base64,{web_img_b64}"}
                     }
                 ]
             }
@@ -114,7 +100,7 @@ def format_msg(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text):
                     {'type': 'text', 'text': f"Observation: {pdf_obs} Please analyze the response given by Assistant, then consider whether to continue iterating or not. The screenshot of the current page is also attached, give the Thought and Action. "},
                     {
                         'type': 'image_url',
-                        'image_url': {"url": f"data:image/png;base64,{web_img_b64}"}
+                        'image_url': {"url": f"data:{mime};base64,{web_img_b64}"}
                     }
                 ]
             }
@@ -141,6 +127,22 @@ def format_msg_text_only(it, init_msg, pdf_obs, warn_obs, ac_tree):
             }
         return curr_msg
 
+def restore_messages(window, steps, encoder, max_attached_imgs):
+    """Rebuild the conversation of an interrupted trajectory from its journal, re-attaching only the newest screenshots."""
+    attached = [step for step in steps if step['attached']][-max_attached_imgs:]
+    for step in steps:
+        if not step['attached']:
+            window.append({'role': 'user', 'content': step['user']})
+        else:
+            content = [{'type': 'text', 'text': step['user']}]
+            if step in attached and os.path.exists(step['screenshot']):
+                with open(step['screenshot'], 'rb') as f:
+                    obs = encoder.encode(f.read())
+                content.append({'type': 'image_url', 'image_url': {"url": f"data:{obs.mime};base64,{obs.b64}"}})
+            window.append({'role': 'user', 'content': content})
+        window.append({'role': 'assistant', 'content': step['response']})
+
+
 # use vllm openai client
 def call_uitars(args, messages, model, processor):
     # Preparation for inference
@@ -169,19 +171,25 @@ def call_uitars(args, messages, model, processor):
     return inputs['input_ids'].shape[1], len(generated_ids_trimmed[0]), False, output_text[0]
 
 
-def call_gpt4v_api(args, client, messages, model_name):
+async def call_gpt4v_api(args, client, messages, model_name, session_id=None):
     retry_times = 0
+    # Lets the router keep every step of a trajectory on the replica holding its prefix cache,
+    # and schedule rollouts ahead of bulk evaluation traffic
+    extra_headers = {"X-Priority": args.priority}
+    if session_id:
+        extra_headers["X-Session-Id"] = session_id
     
     while True:
         try:
-            openai_response = client.chat.completions.create(
+            openai_response = (await client.chat.completions.create(
                 model=model_name,
                 messages=messages,
                 max_completion_tokens=1000,
                 stop=None,
                 stream=False,
-                seed=args.seed
-            ).to_dict()
+                seed=args.seed,
+                extra_headers=extra_headers
+            )).to_dict()
             
             prompt_tokens = openai_response['usage']['prompt_tokens']
             completion_tokens = openai_response['usage']['completion_tokens']
@@ -195,10 +203,10 @@ def call_gpt4v_api(args, client, messages, model_name):
             logging.info(f'Error occurred, retrying. Error type: {type(e).__name__}')
 
             if type(e).__name__ == 'RateLimitError':
-                time.sleep(10)
+                await asyncio.sleep(10)
 
             elif type(e).__name__ == 'APIError':
-                time.sleep(15)
+                await asyncio.sleep(15)
 
             elif type(e).__name__ == 'InvalidRequestError':
                 gpt_call_error = True
@@ -229,47 +237,33 @@ async def exec_action_click(info, page):
     """, [x, y])
 
     await page.mouse.click(x, y)
-    await asyncio.sleep(3)
 
 
 async def exec_action_type(info, page):
-    await page.keyboard.type(info['content'])
+    await type_text(page, info['content'])
     await page.keyboard.press('Enter')
-    await asyncio.sleep(3)
 
 
 async def perform_hotkey(page, key_str: str):
     """
-    Perform a hotkey (e.g., 'ctrl a', 'pagedown') on the page.
-    Ensures the page has a focused element before sending the keys.
+    Perform a hotkey (e.g., 'ctrl a', 'pagedown') on the page as a single chord.
 
     Args:
         page: Playwright Page object
         key_str: string like 'ctrl a', 'pagedown'
-        fallback_focus_selector: selector to focus if no input is focused (defaults to 'body')
     """
-
-    keys = key_str.strip().lower().split()
-
-    mapped_keys = [CUA_KEY_TO_PLAYWRIGHT_KEY.get(key, key) for key in keys]
-    for key in mapped_keys:
-        await page.keyboard.down(key)
-        await asyncio.sleep(1)
-    for key in reversed(mapped_keys):
-        await page.keyboard.up(key)
-        await asyncio.sleep(1)
+    await press_keys(page, key_str.strip().lower().split())
 
 
 async def exec_action_scroll(info, page, args, box):
-    x = box[0]*1000
-    y = box[1]*1000
+    x = box[0]*args.window_width
+    y = box[1]*args.window_height
     await page.mouse.move(x, y)
     dist = args.window_height * 1 // 3
     scroll_y = dist if info.get("direction") == "down" else -dist
     await page.evaluate(f"window.scrollBy(0, {scroll_y})")
     # delta = dist if info.get('direction') == 'down' else -dist
     # await page.mouse.wheel(0, delta)
-    await asyncio.sleep(3)
 
 
 async def exec_action_drag(info, page):
@@ -279,24 +273,90 @@ async def exec_action_drag(info, page):
     await page.mouse.down()
     await page.mouse.move(x2, y2)
     await page.mouse.up()
-    await asyncio.sleep(3)
 
 
-async def run_task(task_id, task, trial_id, args, result_dir, client):
+async def run_task(task_id, task, trial_id, args, result_dir, client, browser_pool, writer, scheduler):
     task_dir = os.path.join(result_dir, f'task{task["id"]}-{trial_id}')
     os.makedirs(task_dir, exist_ok=True)
     # setup_logger(task_dir)
     task_logger = get_task_logger(task_dir, task["id"], trial_id)
     task_logger.info(f'########## TASK{task["id"]} Trial {trial_id} ##########')
 
-    pw, browser, page = await launch_browser(args)
-    await page.goto(task['web'], timeout=180000)
-    await asyncio.sleep(5)
-
-    for filename in os.listdir(args.download_dir):
-        file_path = os.path.join(args.download_dir, filename)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
+    cache = WarmCache.from_args(args, task)
+    net_filter = NetworkFilter.from_args(args, task)
+    har = HarArchive.from_args(args, task, trial_id)
+    # Requests of a service worker would bypass the routes of the network filter and the HAR archive
+    service_workers = "block" if "block" in (net_filter.service_workers, har.service_workers) else "allow"
+    start = time.perf_counter()
+    try:
+        profile_dir = await cache.clone()
+        context, page = await browser_pool.new_context(user_data_dir=profile_dir, service_workers=service_workers)
+    except Exception:
+        await cache.close()
+        raise
+    if profile_dir is not None:
+        cache.launch_seconds = time.perf_counter() - start
+    task_logger.info(f'Browser context ready in {(time.perf_counter() - start) * 1000:.0f} ms')
+    settler = PageSettler.from_args(args)
+    settler.attach(page)
+    # Opening the journal reads and may truncate it; off the loop like every other journal call
+    journal = await asyncio.to_thread(StepJournal, task_dir, fsync=not args.no_fsync)
+    tracer = TaskTracer(task, trial_id)
+    tracer.add('context', start, time.perf_counter())
+    downloads = DownloadCollector.from_args(args, task, trial_id)
+    watcher = ChallengeWatcher(scheduler, site_name(task))
+    try:
+        watcher.attach(context)
+        await downloads.prepare()
+        downloads.attach(context)
+        await net_filter.attach(context)
+        await har.attach(context)
+        if cache.enabled:
+            await cache.attach(context)
+        await _run_task(task, trial_id, args, task_dir, task_logger, client, page, settler, writer, journal, tracer)
+        await watcher.finish()
+    finally:
+        if watcher.challenges:
+            task_logger.info(f'Site refused or challenged the task: {watcher.challenges}')
+        await downloads.close()
+        if downloads.files or downloads.rejected or downloads.failed:
+            task_logger.info(f'Downloads in {downloads.directory}: {downloads.stats()}')
+        if net_filter.enabled:
+            await net_filter.close()
+            task_logger.info(f'Network filter: {net_filter.stats()}')
+        if har.enabled:
+            task_logger.info(f'HAR archive: {har.stats()}')
+        if cache.enabled:
+            tracer.meta['cache'] = cache.stats()
+            task_logger.info(f'HTTP cache: {tracer.meta["cache"]}')
+        await asyncio.to_thread(journal.close)
+        await writer.write(os.path.join(task_dir, TRACE_FILE), tracer.dump())
+        await browser_pool.release(context)
+        await cache.close()
+
+
+async def _run_task(task, trial_id, args, task_dir, task_logger, client, page, settler, writer, journal, tracer):
+    resume = await asyncio.to_thread(journal.resume_point)
+    if resume:
+        try:
+            with tracer.span('goto', url=resume['url']):
+                await page.goto(resume['url'], timeout=180000)
+            task_logger.info(f'Resuming after iter {resume["it"]} at {resume["url"]}')
+        except Exception as e:
+            task_logger.warning(f'Cannot reload {resume["url"]}, restarting from scratch: {e}')
+            resume = None
+    if not resume:
+        await asyncio.to_thread(journal.restart)
+        with tracer.span('goto', url=task['web']):
+            await page.goto(task['web'], timeout=180000)
+    with tracer.span('settle', after='goto'):
+        total_settle = await settler.settle(page, delay=5)
+    task_logger.info(f'Settle time: {total_settle:.2f}s (initial load)')
+    encoder = ObservationEncoder.from_args(args)
+    loop = asyncio.get_running_loop()
+    # Off the loop like every journal write, so a slow disk's fsync does not stall the other trajectories
+    await asyncio.to_thread(journal.record, 'resume' if resume else 'start', task_id=task['id'], trial_id=trial_id,
+                            web=task['web'], url=page.url)
 
     download_files = []
     fail_obs = ""
@@ -313,40 +373,71 @@ async def run_task(task_id, task, trial_id, args, result_dir, client):
     init_msg = f"""Now given a task: {task['ques']}  Please interact with https://www.example.com and get the answer. \n"""
     init_msg = init_msg.replace('https://www.example.com', task['web'])
     init_msg = init_msg + obs_prompt
+    window = MessageWindow(messages[0], args.max_attached_imgs, text_only=args.text_only)
 
     it = 0
     accumulate_prompt_token = 0
     accumulate_completion_token = 0
+    if resume:
+        steps = journal.steps
+        restore_messages(window, steps, encoder, args.max_attached_imgs)
+        it = resume['it']
+        fail_obs = resume['error']
+        accumulate_prompt_token = sum(step['prompt_tokens'] for step in steps)
+        accumulate_completion_token = sum(step['completion_tokens'] for step in steps)
+    finished = False
+
+    async def record_step(actions=None):
+        tracer.add('step', step_start, time.perf_counter(), it=it)
+        # Appending and fsyncing the journal may block on a slow filesystem, keep it off the loop
+        await asyncio.to_thread(
+            journal.record, 'step', it=it, user=user_text, attached=attached, screenshot=img_path,
+            response=model_res, actions=actions, error=fail_obs, url=page.url,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            timing={'screenshot': encoded - capture_start, 'model': model_time, 'step': time.perf_counter() - step_start})
 
     while it < args.max_iter:
         print(f'Iter: {it}')
         task_logger.info(f'Iter: {it}')
         it += 1
+        step_start = time.perf_counter()
 
+        # Encode the screenshot from memory; the full-resolution file is written in the background
         img_path = os.path.join(task_dir, f'screenshot{it}.png')
-        await page.screenshot(path=img_path, timeout=60000)
-        b64_img = encode_image(img_path)
+        capture_start = time.perf_counter()
+        png_bytes = await page.screenshot(timeout=60000)
+        captured = time.perf_counter()
+        if encoder.passthrough:
+            obs = encoder.encode(png_bytes)
+        else:
+            # Resizing and re-encoding is CPU-bound, keep it off the event loop
+            obs = await loop.run_in_executor(None, encoder.encode, png_bytes)
+        encoded = time.perf_counter()
+        tracer.add('screenshot', capture_start, captured)
+        tracer.add('encode', captured, encoded, format=obs.mime, bytes=obs.nbytes)
+        write_wait = await writer.write(img_path, png_bytes)
+        task_logger.info(f'Screenshot: capture {(captured - capture_start) * 1000:.0f} ms, encode {(encoded - captured) * 1000:.0f} ms '
+                         f'({obs.width}x{obs.height} {obs.mime}, {len(png_bytes) / 1024:.0f} KB -> {obs.nbytes / 1024:.0f} KB), '
+                         f'write queued in {write_wait * 1000:.0f} ms')
 
         if not fail_obs:
             # message formatting unchanged
             if not args.text_only:
-                msg = format_msg(it, init_msg, pdf_obs, warn_obs, b64_img, None)
-                messages = clip_message_and_obs(messages + [msg], max_img_num=args.max_attached_imgs)
+                msg = format_msg(it, init_msg, pdf_obs, warn_obs, obs.b64, None, obs.mime)
+                window.append(msg)
+                user_text, attached = msg['content'][0]['text'], True
             else:
                 ac_tree, _ = get_webarena_accessibility_tree(page, task_dir)
                 msg = format_msg_text_only(it, init_msg, pdf_obs, warn_obs, ac_tree)
-                messages = clip_message_and_obs_text_only(messages + [msg], max_img_num=args.max_attached_imgs)
+                window.append(msg)
+                user_text, attached = msg['content'], False
         else:
             curr_msg = {
                 'role': 'user',
                 'content': fail_obs
             }
-            messages.append(curr_msg)
-
-        if not args.text_only:
-            messages = clip_message_and_obs(messages, args.max_attached_imgs)
-        else:
-            messages = clip_message_and_obs_text_only(messages, args.max_attached_imgs)
+            window.append(curr_msg)
+            user_text, attached = fail_obs, False
 
         if args.model == 'gpt': 
             task_logger.info('Calling gpt4o API...')
@@ -355,7 +446,11 @@ async def run_task(task_id, task, trial_id, args, result_dir, client):
             task_logger.info('Calling uitars API...')
             model_name = args.model_name
 
-        prompt_tokens, completion_tokens, gpt_call_error, openai_response = call_gpt4v_api(args, client, messages, model_name)
+        model_start = time.perf_counter()
+        prompt_tokens, completion_tokens, gpt_call_error, openai_response = await call_gpt4v_api(args, client, window.messages, model_name, session_id=f'task{task["id"]}-{trial_id}')
+        model_time = time.perf_counter() - model_start
+        tracer.add('model_call', model_start, model_start + model_time, model=model_name,
+                   prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
         if openai_response is None:
             print("API ERROR: The API call failed, please try again.")
         model_res = openai_response['choices'][0]['message']['content']
@@ -365,13 +460,14 @@ async def run_task(task_id, task, trial_id, args, result_dir, client):
         task_logger.info(f'Accumulate Prompt Tokens: {accumulate_prompt_token}; Accumulate Completion Tokens: {accumulate_completion_token}')
         task_logger.info('API call complete...')
 
-        messages.append({'role': 'assistant', 'content': model_res})
+        window.append({'role': 'assistant', 'content': model_res})
 
         try:
             assert 'Action:' in model_res
         except AssertionError as e:
             logging.error(e)
             fail_obs = "Format ERROR: 'Action' must be included in your reply."
+            await record_step()
             continue
 
         # chosen_action = re.split(pattern, model_res)[2].strip()
@@ -379,21 +475,27 @@ async def run_task(task_id, task, trial_id, args, result_dir, client):
         # print(f'Chosen action: {chosen_action}')
 
         if "Action: finished" in model_res:
+            finished = True
+            fail_obs = ""
+            await record_step()
             break
 
         factor = 1000
         try: 
-            parsed_dict = parse_action_to_structure_output(
-                model_res,
-                factor=factor,
-                origin_resized_height=args.window_height,
-                origin_resized_width=args.window_width,
-                model_type="doubao"
-            )
+            with tracer.span('parse'):
+                parsed_dict = parse_action_to_structure_output(
+                    model_res,
+                    factor=factor,
+                    origin_resized_height=args.window_height,
+                    origin_resized_width=args.window_width,
+                    model_type="doubao",
+                    image_size=obs.size
+                )
         except Exception as e:
             logging.error('Error when parsing action to structure output:')
             logging.error(e)
             fail_obs = "Format ERROR: The Action format is not correct, please follow the format: Action: <action_type>(<action_inputs>)"
+            await record_step()
             continue
         
         print(parsed_dict)
@@ -405,14 +507,15 @@ async def run_task(task_id, task, trial_id, args, result_dir, client):
             fail_obs = ""
             pdf_obs = ""
             warn_obs = ""
+            action_start = time.perf_counter()
             try:
                 if action_key in ['click','left_double','right_single']:
                     box = ast.literal_eval(action_inputs['start_box'])
-                    x, y = box[0]*1000, box[1]*1000
+                    x, y = box[0]*args.window_width, box[1]*args.window_height
                     await exec_action_click({'x':x,'y':y}, page)
                 elif action_key=='type':
                     box = ast.literal_eval(action_inputs.get('start_box','(0,0)'))
-                    await exec_action_type({'x':box[0]*1000,'y':box[1]*1000,'content':action_inputs['content']}, page)
+                    await exec_action_type({'x':box[0]*args.window_width,'y':box[1]*args.window_height,'content':action_inputs['content']}, page)
                 elif action_key=='hotkey': 
                     await perform_hotkey(page, action_inputs['key'])
                 elif action_key=='scroll': 
@@ -420,21 +523,72 @@ async def run_task(task_id, task, trial_id, args, result_dir, client):
                     await exec_action_scroll(action_inputs, page, args, box)
                 elif action_key=='drag':
                     box = ast.literal_eval(action_inputs['start_box'])
-                    await exec_action_drag({'x1':box[0]*1000,'y1':box[1]*1000,'x2':box[2]*1000,'y2':box[3]*1000}, page)
+                    await exec_action_drag({'x1':box[0]*args.window_width,'y1':box[1]*args.window_height,'x2':box[2]*args.window_width,'y2':box[3]*args.window_height}, page)
                 elif action_key=='finished': 
                     break
-                await asyncio.sleep(3)
+                tracer.add(f'action:{action_key}', action_start, time.perf_counter())
+                with tracer.span('settle', after=action_key):
+                    settle = await settler.settle(page)
+                total_settle += settle
+                task_logger.info(f'Settle time: {settle:.2f}s after {action_key}')
             except Exception as e:
+                tracer.add(f'action:{action_key}', action_start, time.perf_counter(), error=str(e))
                 logging.error(f"Exec error: {e}")
                 fail_obs = "The action cannot be executed. Please revise."
-                await asyncio.sleep(3)
+                with tracer.span('settle', after='error'):
+                    total_settle += await settler.settle(page, delay=3)
                 continue
+        await record_step([{'action_type': parsed['action_type'], 'action_inputs': parsed['action_inputs']} for parsed in parsed_dict])
 
-    print_message(messages, task_dir)
-    await browser.close()
-    await pw.stop()
+    print_message(window.messages, task_dir)
+    task_logger.info(f'Total settle time: {total_settle:.1f}s ({args.settle} mode)')
     task_logger.info(f'Total cost: {accumulate_prompt_token / 1000 * 0.01 + accumulate_completion_token / 1000 * 0.03}')
+    await asyncio.to_thread(journal.record, 'done', status='finished' if finished else 'max_iter', iterations=it,
+                            prompt_tokens=accumulate_prompt_token, completion_tokens=accumulate_completion_token)
+
+
+
+async def run_all(tasks, args, result_dir, client):
+    """
+    Runs every task/trial as a coroutine on this loop. At most `--concurrency` trajectories are in
+    flight; they share `--num_browsers` pooled browsers and the async model client, so waiting on a
+    page or a model call never blocks the others. A `DomainScheduler` interleaves the websites and
+    limits and backs off the trajectories per website.
+    """
+    browser_pool = BrowserPool(args, size=args.num_browsers, max_tasks=args.max_tasks_per_browser,
+                               max_memory_mb=args.browser_max_memory_mb)
+    writer = BackgroundWriter(max_pending=args.write_queue_size, fsync=not args.no_fsync)
+
+    pending = []
+    for task_id in range(len(tasks)):
+        for trial_id in range(1, args.num_trials + 1):
+            task_dir = os.path.join(result_dir, f'task{tasks[task_id]["id"]}-{trial_id}')
+            if args.resume and task_finished(task_dir, 'interact_messages.json'):
+                continue
+            pending.append((site_name(tasks[task_id]), (task_id, trial_id)))
+    if args.resume:
+        print(f'Resuming {result_dir}: {len(tasks) * args.num_trials - len(pending)} task/trials already done, {len(pending)} to run')
+
+    scheduler = DomainScheduler(pending, max_per_site=args.max_per_site, backoff_base=args.backoff_base, backoff_max=args.backoff_max)
+
+    async def run_one(job):
+        task_id, trial_id = job
+        try:
+            await run_task(task_id, tasks[task_id], trial_id, args, result_dir, client, browser_pool, writer, scheduler)
+        except Exception as e:
+            logging.exception(f'Task {tasks[task_id]["id"]} trial {trial_id} failed: {e}')
 
+    try:
+        await scheduler.run(run_one, args.concurrency)
+    finally:
+        await browser_pool.close()
+        await writer.close()
+    print(summarize_pool_stats([browser_pool.stats()]))
+    print(scheduler.summary())
+    stats = writer.stats()
+    print(f"Background writer: {stats['files']} files, {stats['bytes'] / 1024 / 1024:.0f} MB in {stats['batches']} batches; "
+          f"write {stats['write_seconds']:.1f}s, fsync {stats['sync_seconds']:.1f}s, max queue depth {stats['max_queue_depth']}, "
+          f"{stats['errors']} errors")
 
 
 def main():
@@ -447,7 +601,20 @@ def main():
     parser.add_argument("--seed", type=int, default=None)
     parser.add_argument("--max_attached_imgs", type=int, default=1)
     parser.add_argument("--temperature", type=float, default=1.0)
-    parser.add_argument("--download_dir", type=str, default="downloads")
+    parser.add_argument("--download_dir", type=str, default="downloads", help="Each task/trial saves its downloads in its own subdirectory")
+    parser.add_argument("--max_download_mb", type=int, default=100, help="Discard downloaded files larger than this")
+    parser.add_argument("--max_task_download_mb", type=int, default=500, help="Discard downloads once a task/trial has saved this much")
+    parser.add_argument("--net_profile", type=str, default="off", choices=NET_PROFILES,
+                        help="Requests to block: trackers (ad/analytics domains) or lean (trackers plus audio/video)")
+    parser.add_argument("--net_block_list", type=str, default=None, help="File of extra domains to block, one per line")
+    parser.add_argument("--net_audit", action='store_true', help="Do not block; log the requests and bytes the profile would block")
+    parser.add_argument("--har_mode", type=str, default="off", choices=HAR_MODES,
+                        help="record: save each task/trial's network traffic; replay: serve it from the recordings without network access")
+    parser.add_argument("--har_dir", type=str, default="har", help="Directory of the per-task/trial HAR archives")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Per-site HTTP cache templates built by warm_cache.py; each task/trial starts from a copy of its site's. "
+                             "Chromium only caches to disk in a persistent profile, so these tasks cold-launch their own "
+                             "browser instead of using the pool; the launch time is reported next to the cache hit rate")
     parser.add_argument("--text_only", action='store_true')
     parser.add_argument("--num_trials", type=int, default=1, help="Number of times to run each task.")
     # for web browser
@@ -457,21 +624,44 @@ def main():
     parser.add_argument("--window_width", type=int, default=1024)
     parser.add_argument("--window_height", type=int, default=768)  # for headless mode, there is no address bar
     parser.add_argument("--fix_box_color", action='store_true')
+    parser.add_argument("--settle", type=str, default="auto", choices=SETTLE_MODES,
+                        help="auto: wait for network idle, DOM quiescence and a stable screenshot after each action; fixed: sleep --settle_delay")
+    parser.add_argument("--settle_delay", type=float, default=6.0, help="Seconds slept after each action in fixed mode")
+    parser.add_argument("--settle_floor", type=float, default=0.2, help="Minimum seconds to wait after an action in auto mode")
+    parser.add_argument("--settle_ceiling", type=float, default=5.0, help="Maximum seconds to wait after an action in auto mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="Trajectories run at once")
+    parser.add_argument("--max_per_site", type=int, default=4, help="Trajectories of one website run at once")
+    parser.add_argument("--backoff_base", type=float, default=30.0,
+                        help="Seconds no new task of a website starts after it refuses or challenges one, doubling per further failure")
+    parser.add_argument("--backoff_max", type=float, default=600.0, help="Longest backoff of a website, in seconds")
+    parser.add_argument("--num_browsers", type=int, default=4, help="Chromium processes the concurrent trajectories share")
+    parser.add_argument("--write_queue_size", type=int, default=256, help="Screenshots waiting for the background writer before steps block")
+    parser.add_argument("--no_fsync", action='store_true', help="Skip fsync of background-written screenshots")
+    parser.add_argument("--obs_format", type=str, default="png", choices=OBS_FORMATS, help="Image format of the screenshots sent to the model")
+    parser.add_argument("--obs_quality", type=int, default=85, help="JPEG/WebP quality of the screenshots sent to the model")
+    parser.add_argument("--obs_max_pixels", type=int, default=0,
+                        help="Resize screenshots to the model's pixel budget before sending, e.g. 1003520 (1280*28*28); 0 sends full resolution")
+    parser.add_argument("--max_tasks_per_browser", type=int, default=50,
+                        help="Tasks a pooled Chromium serves (each in a fresh context) before it is relaunched")
+    parser.add_argument("--browser_max_memory_mb", type=int, default=4096, help="Relaunch a pooled Chromium above this RSS, 0 disables")
     parser.add_argument("--model", type=str, default='gpt', choices=['gpt', 'uitars'])
     parser.add_argument("--model_name", type=str, default="ByteDance-Seed/UI-TARS-1.5-7B")
+    parser.add_argument("--priority", type=str, default="high", help="X-Priority class the router schedules these requests under")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="Results directory of an interrupted run: skip finished task/trials and continue the rest from their journal")
 
     args = parser.parse_args()
 
     current_time = time.strftime("%Y%m%d_%H_%M_%S", time.localtime())
     log_file_path = os.path.join(os.path.join(args.output_dir, current_time), 'main.log')
 
-    client = OpenAI(
+    client = AsyncOpenAI(
         base_url="http://localhost:8000/v1",
         api_key="not-needed",  # Dummy key to satisfy the client
     )
 
     # Save Result file
-    result_dir = os.path.join(args.output_dir, current_time)
+    result_dir = args.resume or os.path.join(args.output_dir, current_time)
     print(result_dir)
     os.makedirs(result_dir, exist_ok=True)
 
@@ -481,17 +671,7 @@ def main():
         for line in f:
             tasks.append(json.loads(line))
     
-    # Use ThreadPoolExecutor for parallelism
-    def run_task_sync(task_id, trial_id):
-        asyncio.run(run_task(task_id, tasks[task_id], trial_id, args, result_dir, client))
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        for task_id in range(len(tasks)):
-            for trial_id in range(1, args.num_trials + 1):
-                futures.append(executor.submit(run_task_sync, task_id, trial_id))
-        for future in concurrent.futures.as_completed(futures):
-            future.result()
+    asyncio.run(run_all(tasks, args, result_dir, client))
         
         
 
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+# Status codes of a page navigation that mean the site is refusing or throttling us
+CHALLENGE_STATUSES = {403, 429, 503}
+
+# Titles and markup of bot checks and rate-limit pages (Cloudflare, Akamai, PerimeterX, DataDome, Amazon)
+CHALLENGE_TITLE = re.compile(r"just a moment|attention required|access denied|robot check|are you a robot|verify you are human|"
+                             r"security check|pardon our interruption|too many requests|request blocked|captcha", re.IGNORECASE)
+CHALLENGE_MARKUP = re.compile(r"px-captcha|captcha-delivery\.com|/errors/validatecaptcha", re.IGNORECASE)
+TITLE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+# Failed navigations that are ours, not the site's: aborted by a newer navigation, blocked by
+# --net_profile, or missing from the archive in --har_mode replay
+IGNORED_ERRORS = ("net::ERR_ABORTED", "net::ERR_BLOCKED_BY_CLIENT", "net::ERR_INTERNET_DISCONNECTED")
+
+
+class DomainScheduler:
+    """
+    Hands out task/trials so that no website is hammered. Jobs are taken round-robin across
+    websites, so a run of same-site tasks in the task file is spread out; at most `max_per_site`
+    of a website run at once, within the `concurrency` of the whole run.
+
+    When a website refuses or challenges a task (see `ChallengeWatcher`), no new task of it starts
+    for `backoff_base` seconds, doubling with every further failure up to `backoff_max`, and the
+    website's concurrency limit is halved. Every task that finishes cleanly raises the limit by one
+    again, up to `max_per_site`.
+
+    `run` drives a pool of coroutines on one event loop and `run_threads` a pool of threads.
+    `report` may be called from any thread.
+    """
+
+    def __init__(self, jobs, max_per_site=4, backoff_base=30.0, backoff_max=600.0):
+        self.queues = OrderedDict()
+        for site, job in jobs:
+            self.queues.setdefault(site, deque()).append(job)
+        self.max_per_site = max_per_site
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limit = {site: max_per_site for site in self.queues}
+        self.active = Counter()
+        self.failures = Counter()
+        self.blocked_until = {}
+        self.lock = threading.Lock()
+        self._notify = lambda: None
+        self.started = Counter()
+        self.challenges = Counter()
+        self.backoff_seconds = Counter()
+
+    def _next(self, now):
+        """(site, job, None) of the first website in turn that may start one, else (None, None, seconds until one may)."""
+        wait = math.inf
+        for site, queue in self.queues.items():
+            if not queue or self.active[site] >= self.limit[site]:
+                continue
+            until = self.blocked_until.get(site, 0)
+            if until > now:
+                wait = min(wait, until - now)
+                continue
+            self.queues.move_to_end(site)
+            self.active[site] += 1
+            self.started[site] += 1
+            return site, queue.popleft(), None
+        return None, None, wait
+
+    def _remaining(self):
+        return any(self.queues.values())
+
+    def _finish(self, site):
+        with self.lock:
+            self.active[site] -= 1
+            self._notify()
+
+    def report(self, site, ok, reason=None):
+        """A task of `site` finished cleanly (`ok`), or the site refused or challenged it."""
+        with self.lock:
+            if ok:
+                self.failures[site] = 0
+                self.limit[site] = min(self.max_per_site, self.limit[site] + 1)
+            else:
+                self.failures[site] += 1
+                self.challenges[site] += 1
+                self.limit[site] = max(1, self.limit[site] // 2)
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures[site] - 1)) * random.uniform(0.8, 1.2)
+                self.blocked_until[site] = max(self.blocked_until.get(site, 0), time.monotonic() + delay)
+                self.backoff_seconds[site] += delay
+                logging.warning(f"{site}: {reason}; no new tasks for {delay:.0f}s, at most {self.limit[site]} at once")
+            self._notify()
+
+    async def run(self, worker, concurrency):
+        """Runs `await worker(job)` for every job with `concurrency` coroutines."""
+        wake = asyncio.Event()
+        self._notify = wake.set
+
+        async def loop():
+            while True:
+                with self.lock:
+                    if not self._remaining():
+                        return
+                    site, job, wait = self._next(time.monotonic())
+                if site is None:
+                    wake.clear()
+                    try:
+                        await asyncio.wait_for(wake.wait(), None if wait == math.inf else wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                try:
+                    await worker(job)
+                except Exception as e:
+                    logging.exception(f"Task on {site} failed: {e}")
+                finally:
+                    self._finish(site)
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+
+    def run_threads(self, worker, concurrency):
+        """Runs `worker(job)` for every job on `concurrency` threads."""
+        cond = threading.Condition(self.lock)
+        self._notify = cond.notify_all
+
+        def loop():
+            while True:
+                with cond:
+                    if not self._remaining():
+                        return
+                    site, job, wait = self._next(time.monotonic())
+                    if site is None:
+                        cond.wait(None if wait == math.inf else wait)
+                        continue
+                try:
+                    worker(job)
+                except Exception as e:
+                    logging.exception(f"Task on {site} failed: {e}")
+                finally:
+                    self._finish(site)
+
+        threads = [threading.Thread(target=loop, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def summary(self):
+        lines = [f"{'site':<28} {'tasks':>6} {'challenged':>11} {'backoff s':>10}"]
+        for site in sorted(self.started, key=lambda s: -self.challenges[s]):
+            lines.append(f"{site[:28]:<28} {self.started[site]:>6} {self.challenges[site]:>11} {self.backoff_seconds[site]:>10.0f}")
+        return "\n".join(lines)
+
+
+class ChallengeWatcher:
+    """
+    Watches the main-frame navigations of a task's pages for signs that its website is refusing
+    or throttling it: a 403/429/503 response, a bot-check or rate-limit page, or a navigation
+    failing at the network level. The first such sign is reported to the scheduler right away;
+    `finish` reports a clean task.
+    """
+
+    def __init__(self, scheduler, site):
+        self.scheduler = scheduler
+        self.site = site
+        self.challenges = []
+        self.pending = set()
+
+    def attach(self, context):
+        for page in context.pages:
+            self._watch(page)
+        context.on("page", self._watch)
+
+    def _watch(self, page):
+        page.on("response", lambda response: self._on_response(page, response))
+        page.on("requestfailed", lambda request: self._on_failed(page, request))
+
+    def _challenged(self, reason):
+        self.challenges.append(reason)
+        if len(self.challenges) == 1:
+            self.scheduler.report(self.site, ok=False, reason=reason)
+
+    def _on_response(self, page, response):
+        if not response.request.is_navigation_request() or response.frame != page.main_frame:
+            return
+        if response.status in CHALLENGE_STATUSES:
+            self._challenged(f"HTTP {response.status} from {response.url}")
+        elif response.ok and "text/html" in response.headers.get("content-type", ""):
+            task = asyncio.ensure_future(self._check_page(response))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def _check_page(self, response):
+        try:
+            html = await response.text()
+        except Exception:
+            return
+        title = TITLE.search(html)
+        if title and CHALLENGE_TITLE.search(title.group(1)) or CHALLENGE_MARKUP.search(html):
+            self._challenged(f"challenge page at {response.url}")
+
+    def _on_failed(self, page, request):
+        if request.is_navigation_request() and request.frame == page.main_frame:
+            failure = request.failure or ""
+            if not failure.startswith(IGNORED_ERRORS):
+                self._challenged(f"{failure} loading {request.url}")
+
+    async def finish(self):
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+        if not self.challenges:
+            self.scheduler.report(self.site, ok=True)
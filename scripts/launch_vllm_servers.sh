@@ -3,8 +3,16 @@
 MODEL=${1:-"ByteDance-Seed/UI-TARS-1.5-7B"}
 BASE_PORT=8001
 
-# Use first argument as number of ports/instances; default to 8 if not given
-NUM_PORTS=8
+# Use second argument as number of ports/instances (one per GPU); default to the number of visible GPUs, or 8
+NUM_PORTS=${2:-$(nvidia-smi -L 2>/dev/null | wc -l)}
+if [ -z "$NUM_PORTS" ] || [ "$NUM_PORTS" -eq 0 ]; then
+  NUM_PORTS=8
+fi
+
+# Backend manifest for `python flask_router.py --manifest $MANIFEST`; the router picks up changes while running
+MANIFEST=${MANIFEST:-"vllm_backends.json"}
+# If set (e.g. http://localhost:8000), also register every replica with a running router
+ROUTER_URL=${ROUTER_URL:-""}
 
 TIMESTAMP=$(date +"%Y%m%d_%H%M%S")
 LOG_DIR="logs/$TIMESTAMP"
@@ -12,6 +20,7 @@ mkdir -p "$LOG_DIR"
 
 echo "Launching $NUM_PORTS vLLM servers for model '$MODEL', starting at port $BASE_PORT..."
 
+URLS=()
 for ((i=0; i<NUM_PORTS; i++)); do
   PORT=$((BASE_PORT + i))
   echo "Starting vLLM on GPU $i at port $PORT"
@@ -24,8 +33,18 @@ for ((i=0; i<NUM_PORTS; i++)); do
     --disable-uvicorn-access-log \
     --download_dir ~/.cache/vllm1 \
     > "$LOG_DIR/vllm_gpu${i}.log" 2>&1 &
+
+  URLS+=("\"http://localhost:$PORT\"")
+  if [ -n "$ROUTER_URL" ]; then
+    # Registered as unhealthy: the router admits it once /health answers (weights loaded)
+    curl -s -X POST "$ROUTER_URL/backends" -H "Content-Type: application/json" \
+      -d "{\"url\": \"http://localhost:$PORT\", \"healthy\": false}" > /dev/null
+  fi
 done
 
+echo "{\"backends\": [$(IFS=,; echo "${URLS[*]}")]}" > "$MANIFEST"
+
 echo "All vLLM servers launched on ports $BASE_PORT to $((BASE_PORT + NUM_PORTS - 1))."
+echo "Backend manifest written to $MANIFEST"
 
-    # --limit-mm-per-prompt image=5 \
\ No newline at end of file
+    # --limit-mm-per-prompt image=5 \
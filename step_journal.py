@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+def read_journal(task_dir):
+    """Records of a task's journal, oldest first. A last line cut off by a crash is dropped."""
+    records = []
+    try:
+        with open(os.path.join(task_dir, JOURNAL_FILE), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def task_finished(task_dir, final_file):
+    """Whether a task/trial of an earlier run completed, judged by its journal or, without one, by `final_file`."""
+    records = read_journal(task_dir)
+    if records:
+        return records[-1]["event"] == "done"
+    # Trajectories from before the journal existed only leave their final output behind
+    return os.path.exists(os.path.join(task_dir, final_file))
+
+
+class StepJournal:
+    """
+    Append-only log of one task/trial, one JSON object per line in `journal.jsonl` of the task
+    directory: a `start` record, a `step` record after every model call (response, parsed actions,
+    screenshot path, the URL once the actions ran, timings) and a `done` record once the final
+    outputs are written. Each record is flushed, and fsynced unless `fsync` is False, before the
+    call returns, so a killed run loses at most the step in flight.
+
+    Opening the journal of an interrupted trajectory loads its records; `resume_point` says where
+    to pick up, and `restart` discards them to run the task from scratch.
+    """
+
+    def __init__(self, task_dir, fsync=True):
+        self.path = os.path.join(task_dir, JOURNAL_FILE)
+        self.fsync = fsync
+        self.records = read_journal(task_dir)
+        if os.path.exists(self.path):
+            # Drop a partial last line, or the next record would be appended to it
+            with open(self.path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end != len(data):
+                    f.truncate(end)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    @property
+    def steps(self):
+        return [r for r in self.records if r["event"] == "step"]
+
+    @property
+    def finished(self):
+        return bool(self.records) and self.records[-1]["event"] == "done"
+
+    def resume_point(self):
+        """The last step record if it has a page URL to reload, else None (start from scratch)."""
+        steps = self.steps
+        if steps and steps[-1].get("url", "").startswith(("http://", "https://", "file://")):
+            return steps[-1]
+        return None
+
+    def restart(self):
+        if self.records:
+            self.file.seek(0)
+            self.file.truncate()
+            self.records = []
+
+    def record(self, event, **fields):
+        record = {"event": event, "time": time.time(), **fields}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.records.append(record)
+        return record
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,83 @@
+import asyncio
+import http.server
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from browser_pool import BrowserPool
+from har_archive import HarArchive
+
+# A page that installs a service worker which fetches everything itself, then asks for /data
+PAGE = b"""<html><body><script>
+if (navigator.serviceWorker) {
+  navigator.serviceWorker.register('/sw.js').then(() => navigator.serviceWorker.ready).then(() => fetch('/data'));
+}
+</script></body></html>"""
+SERVICE_WORKER = b"""
+self.addEventListener('install', event => self.skipWaiting());
+self.addEventListener('activate', event => event.waitUntil(clients.claim()));
+self.addEventListener('fetch', event => event.respondWith(fetch(event.request)));
+"""
+
+
+def serve(hits):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            body, kind = (SERVICE_WORKER, "text/javascript") if self.path == "/sw.js" else (PAGE, "text/html")
+            self.send_response(200)
+            self.send_header("Content-Type", kind)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def visit(pool, har, url):
+    context, page = await pool.new_context(service_workers=har.service_workers)
+    try:
+        await har.attach(context)
+        await page.goto(url)
+        await page.reload()
+        await page.wait_for_timeout(1000)
+    finally:
+        await pool.release(context)
+
+
+def test_replay_with_service_worker_stays_offline(tmp_path):
+    hits = []
+    server = serve(hits)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    task = {"id": 1}
+    pool = BrowserPool(SimpleNamespace(headless=True, window_width=800, window_height=600))
+
+    async def run():
+        try:
+            await visit(pool, HarArchive(str(tmp_path), "record", task, 0), url)
+            recorded = list(hits)
+            hits.clear()
+            await visit(pool, HarArchive(str(tmp_path), "replay", task, 0), url)
+            return recorded
+        finally:
+            await pool.close()
+
+    try:
+        recorded = asyncio.run(run())
+    except Exception as e:
+        if "Executable doesn't exist" in str(e):
+            pytest.skip("Chromium is not installed")
+        raise
+    finally:
+        server.shutdown()
+    assert recorded
+    assert hits == []
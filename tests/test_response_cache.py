@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from router_utils import ResponseCache
+
+
+def response(size):
+    return 200, {"Content-Type": "application/json"}, b"x" * size
+
+
+def test_evicted_entries_leave_the_disk(tmp_path):
+    cache = ResponseCache(max_entries=2, cache_dir=str(tmp_path))
+    for key in ["a", "b", "c"]:
+        cache.put(key, response(10))
+    assert sorted(os.listdir(tmp_path)) == ["b.json", "c.json"]
+    assert cache.get("a") is None
+
+
+def test_expired_entry_is_deleted(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.put("a", response(10))
+    cache.ttl = 0
+    assert cache.get("a") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_restart_counts_disk_bytes_against_the_cap(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    for key in ["a", "b", "c"]:
+        cache.put(key, response(1000))
+    size = os.path.getsize(tmp_path / "b.json") + os.path.getsize(tmp_path / "c.json")
+    restarted = ResponseCache(max_bytes=size, cache_dir=str(tmp_path))
+    assert restarted.stats()["bytes"] == size
+    assert len(os.listdir(tmp_path)) == 2
+    assert restarted.get("c") == response(1000)
+
+
+def test_async_reads_and_writes_disk(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return response(10)
+
+    async def run():
+        first = await cache.get_or_compute_async("k", compute)
+        second = await ResponseCache(cache_dir=str(tmp_path)).get_or_compute_async("k", compute)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == response(10)
+    assert len(calls) == 1
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import router_utils
+from router_utils import BackendPool, NoBackendAvailable, handle_registry_request
+
+
+class FakeResponse:
+    status_code = 200
+
+
+def test_reregistered_unhealthy_replica_waits_for_probes(monkeypatch):
+    pool = BackendPool(["http://a:8000"], healthy_threshold=2)
+    pool.health_checking = True
+    handle_registry_request(pool, "POST", "drain", {"url": "http://a:8000"})
+    body, status = handle_registry_request(pool, "POST", "", {"url": "http://a:8000", "healthy": False})
+    assert status == 200 and body["healthy"] is False and body["draining"] is False
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire()
+
+    monkeypatch.setattr(router_utils.requests, "get", lambda url, timeout: FakeResponse())
+    pool.probe_health()
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire()
+    pool.probe_health()
+    assert pool.acquire().url == "http://a:8000"
+
+
+def test_unhealthy_registration_admitted_without_prober():
+    pool = BackendPool([])
+    body, _ = handle_registry_request(pool, "POST", "", {"url": "http://b:8000", "healthy": False})
+    assert body["healthy"] is True
+    assert pool.acquire().url == "http://b:8000"
@@ -0,0 +1,130 @@
+"""
+Summarise the per-task traces (`trace.json`) that run_uitars.py and run_operator.py write to each
+task directory: latency percentiles per phase (goto, screenshot, encode, model_call, parse, each
+action type, settle, step), and per website the p50/p90/p99 of the main phases (and, for runs with
+`--cache_dir`, the share of responses served from the warm HTTP cache and the mean cold launch
+of the browser those tasks need). `--merge` writes one
+Chrome/Perfetto trace with a track per task, to see how the trajectories of a run overlapped.
+
+    python trace_summary.py results/20250101_00_00_00
+    python trace_summary.py results/run1 results/run2 --group_actions --merge run_trace.json
+"""
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+from tracing import TRACE_FILE
+
+SITE_PHASES = ["goto", "screenshot", "model_call", "action", "settle", "step"]
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[idx]
+
+
+def load_traces(result_dirs):
+    traces = []
+    for result_dir in result_dirs:
+        for path in sorted(glob.glob(os.path.join(result_dir, "**", TRACE_FILE), recursive=True)):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    traces.append(json.load(f))
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Skipping {path}: {e}")
+    return traces
+
+
+def spans(trace):
+    return [event for event in trace["traceEvents"] if event["ph"] == "X"]
+
+
+def phase_table(traces, group_actions):
+    durations = defaultdict(list)
+    prompt_tokens = defaultdict(list)
+    for trace in traces:
+        for span in spans(trace):
+            name = span["cat"] if group_actions else span["name"]
+            durations[name].append(span["dur"] / 1000)
+            if span["args"].get("prompt_tokens") is not None:
+                prompt_tokens[name].append(span["args"]["prompt_tokens"])
+    # Steps contain the other phases, so they are left out of the share
+    total = sum(sum(d) for name, d in durations.items() if name != "step") or 1
+    lines = [f"{'phase':<22} {'count':>7} {'total s':>9} {'share':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'prompt tok':>11}"]
+    for name, d in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        share = f"{100 * sum(d) / total:>5.1f}%" if name != "step" else f"{'-':>6}"
+        tokens = f"{sum(prompt_tokens[name]) / len(prompt_tokens[name]):>11.0f}" if prompt_tokens[name] else f"{'':>11}"
+        lines.append(f"{name:<22} {len(d):>7} {sum(d) / 1000:>9.1f} {share} {percentile(d, 50):>9.1f} "
+                     f"{percentile(d, 90):>9.1f} {percentile(d, 99):>9.1f} {tokens}")
+    return "\n".join(lines)
+
+
+def site_table(traces):
+    durations = defaultdict(lambda: defaultdict(list))
+    tasks = defaultdict(int)
+    # Responses and disk-cache hits of the tasks that ran with a warm cache (--cache_dir)
+    cache = defaultdict(lambda: [0, 0])
+    launch = defaultdict(list)
+    for trace in traces:
+        site = trace.get("otherData", {}).get("site", "unknown")
+        tasks[site] += 1
+        if trace.get("otherData", {}).get("cache"):
+            cache[site][0] += trace["otherData"]["cache"]["requests"]
+            cache[site][1] += trace["otherData"]["cache"]["hits"]
+            if trace["otherData"]["cache"].get("launch_ms") is not None:
+                launch[site].append(trace["otherData"]["cache"]["launch_ms"])
+        for span in spans(trace):
+            durations[site][span["cat"]].append(span["dur"] / 1000)
+    lines = [f"{'site':<28} {'tasks':>6} {'steps':>6}" + (f" {'cache hit':>10} {'launch ms':>10}" if cache else "")
+             + f" {'phase':<12} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}"]
+    for site in sorted(tasks, key=lambda s: -sum(sum(d) for d in durations[s].values())):
+        head = f"{site[:28]:<28} {tasks[site]:>6} {len(durations[site]['step']):>6}"
+        if cache:
+            requests, hits = cache[site]
+            head += f" {100 * hits / requests:>9.1f}%" if requests else f" {'-':>10}"
+            head += f" {sum(launch[site]) / len(launch[site]):>10.0f}" if launch[site] else f" {'-':>10}"
+        for phase in SITE_PHASES:
+            d = durations[site][phase]
+            if not d:
+                continue
+            lines.append(f"{head} {phase:<12} {len(d):>7} {percentile(d, 50):>9.1f} {percentile(d, 90):>9.1f} {percentile(d, 99):>9.1f}")
+            # The site's own columns only on its first row
+            head = " " * len(head)
+    return "\n".join(lines)
+
+
+def merge(traces, path):
+    events = []
+    for tid, trace in enumerate(traces):
+        for event in trace["traceEvents"]:
+            events.append({**event, "tid": tid})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("result_dirs", type=str, nargs="+", help="Results directories to search for trace.json files")
+    parser.add_argument("--group_actions", action='store_true', help="Report all action types as one 'action' phase")
+    parser.add_argument("--merge", type=str, default=None, help="Write all traces into this Chrome trace file, one track per task")
+    args = parser.parse_args()
+
+    traces = load_traces(args.result_dirs)
+    if not traces:
+        raise SystemExit(f"No {TRACE_FILE} found under {' '.join(args.result_dirs)}")
+    print(f"{len(traces)} traced task/trials\n")
+    print(phase_table(traces, args.group_actions))
+    print("\nLatency percentiles per website\n")
+    print(site_table(traces))
+    if args.merge:
+        merge(traces, args.merge)
+        print(f"\nMerged trace written to {args.merge}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+TRACE_FILE = "trace.json"
+
+
+def site_name(task):
+    """The website a task runs on: its `web_name` where the dataset has one, else the host of its start URL."""
+    return task.get('web_name') or urlparse(task['web']).netloc
+
+
+class TaskTracer:
+    """
+    Timed spans of one task/trial (page loads, screenshots, model calls, actions, settling) in
+    Chrome trace event format, viewable in chrome://tracing or https://ui.perfetto.dev.
+    Timestamps are wall-clock microseconds, so the traces of a run line up when merged by
+    `trace_summary.py`.
+    """
+
+    def __init__(self, task, trial_id):
+        self.label = f'task{task["id"]}-{trial_id}'
+        self.meta = {"task": task["id"], "trial": trial_id, "site": site_name(task), "web": task["web"]}
+        self.origin = time.time() - time.perf_counter()
+        self.events = []
+
+    @contextmanager
+    def span(self, name, **args):
+        """Times the block; keys set on the yielded dict (e.g. token counts) are stored with the span."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.perf_counter(), **args)
+
+    def add(self, name, start, end, **args):
+        """Records a span measured elsewhere, from two `time.perf_counter()` readings."""
+        self.events.append({
+            "name": name,
+            "cat": name.split(":")[0],
+            "ph": "X",
+            "ts": round((self.origin + start) * 1e6),
+            "dur": round((end - start) * 1e6),
+            "pid": 0,
+            "tid": 0,
+            "args": args,
+        })
+
+    def dump(self):
+        thread_name = {"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": self.label}}
+        trace = {"traceEvents": [thread_name] + self.events, "displayTimeUnit": "ms", "otherData": self.meta}
+        return json.dumps(trace).encode()
+
+    def save(self, task_dir):
+        with open(os.path.join(task_dir, TRACE_FILE), "wb") as f:
+            f.write(self.dump())
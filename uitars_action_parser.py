@@ -149,7 +149,13 @@ def parse_action_to_structure_output(text,
                                      origin_resized_width,
                                      model_type="qwen25vl",
                                      max_pixels=16384 * 28 * 28,
-                                     min_pixels=100 * 28 * 28):
+                                     min_pixels=100 * 28 * 28,
+                                     image_size=None):
+    """
+    `image_size` is the (width, height) of the screenshot the model was shown. When given, the
+    model's absolute pixel coordinates are divided by it instead of `factor`, so the returned
+    boxes are fractions of that image whatever resolution it was sent at.
+    """
     text = text.strip()
 
     if "<point>" in text:
@@ -255,6 +261,11 @@ def parse_action_to_structure_output(text,
                         else:
                             float_numbers.append(
                                 float(num / smart_resize_width))
+                elif image_size is not None:
+                    float_numbers = [
+                        float(num) / image_size[num_idx % 2]
+                        for num_idx, num in enumerate(numbers)
+                    ]
                 else:
                     float_numbers = [float(num) / factor for num in numbers]
 
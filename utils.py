@@ -4,6 +4,7 @@ import os
 import json
 import time
 import logging
+from collections import deque
 import numpy as np
 from PIL import Image
 from utils_webarena import fetch_browser_info, fetch_page_accessibility_tree,\
@@ -425,6 +426,52 @@ def clip_message_and_obs_text_only(msg, max_tree_num):
     return clipped_msg
 
 
+class MessageWindow:
+    """
+    Conversation history clipped as messages are appended, instead of rescanning the whole list with
+    `clip_message_and_obs` every step. The result is the same: the newest `max_img_num` observations
+    keep their screenshot, older ones are dropped, and the task message (index 1) is reduced to its
+    text. With `text_only`, every user message is an observation and older ones are reduced as in
+    `clip_message_and_obs_text_only`.
+    """
+
+    def __init__(self, system_msg, max_img_num, text_only=False):
+        # Dropped messages leave a None so the indices in `observations` stay valid
+        self.history = [system_msg]
+        self.max_img_num = max_img_num
+        self.text_only = text_only
+        self.observations = deque()
+
+    def append(self, msg):
+        self.history.append(msg)
+        if msg['role'] == 'user' and (self.text_only or type(msg['content']) != str):
+            self.observations.append(len(self.history) - 1)
+            while len(self.observations) > self.max_img_num:
+                self._demote(self.observations.popleft())
+
+    def extend(self, msgs):
+        for msg in msgs:
+            self.append(msg)
+
+    def _demote(self, idx):
+        msg = self.history[idx]
+        if self.text_only:
+            content = msg['content'].split("Observation:")[0].strip()
+            if "You downloaded a PDF file" in msg['content']:
+                content += "Observation: An accessibility tree and a PDF file. (Omitted in context.)"
+            else:
+                content += "Observation: An accessibility tree. (Omitted in context.)"
+            self.history[idx] = {'role': msg['role'], 'content': content}
+        elif idx == 1:
+            self.history[idx] = {'role': msg['role'], 'content': msg['content'][0]["text"]}
+        else:
+            self.history[idx] = None
+
+    @property
+    def messages(self):
+        return [msg for msg in self.history if msg is not None]
+
+
 def print_message(json_object, save_dir=None):
     remove_b64code_obj = []
     for obj in json_object:
@@ -0,0 +1,208 @@
+"""
+Pre-warmed per-site HTTP caches for rollout browsers (`--cache_dir` of run_uitars.py and
+run_operator.py).
+
+A site's template is the disk cache (`Cache`, and V8's `Code Cache`) of a Chromium profile that
+has visited the site's pages. Each task/trial gets its own copy of it in a fresh profile, cloned
+copy-on-write where the filesystem supports reflinks, so it starts with the site's JS bundles,
+fonts and CSS on disk but with no cookies or storage from any other task. Tasks never write back
+to the template.
+
+Build the templates from the start pages of a task file, plus the pages an earlier run visited:
+
+    python warm_cache.py --test_file data/openwebvoyager_full_clean.jsonl --cache_dir cache --results_dir results/<run>
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import defaultdict
+
+from playwright.async_api import async_playwright
+
+from browser_pool import browser_launch_args
+from step_journal import read_journal
+from tracing import site_name
+
+CACHE_SUBDIRS = ["Cache", "Code Cache"]
+
+
+def site_cache_dir(cache_dir, site):
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9._-]", "_", site))
+
+
+async def copy_tree(src, dst):
+    """Copy-on-write clone where the filesystem supports it (btrfs, XFS), else a plain copy."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    proc = await asyncio.create_subprocess_exec("cp", "-a", "--reflink=auto", src, dst,
+                                                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    _, err = await proc.communicate()
+    if proc.returncode != 0:
+        logging.debug(f"cp failed ({err.decode().strip()}), copying {src} in Python")
+        await asyncio.to_thread(shutil.copytree, src, dst, dirs_exist_ok=True)
+
+
+class WarmCache:
+    """
+    The per-task copy of a site's cache template, and the cache hit rate of the task's pages.
+    Hits are responses Chromium served from its disk cache, counted through the DevTools protocol.
+    """
+
+    def __init__(self, cache_dir, site):
+        self.cache_dir = cache_dir
+        self.site = site
+        self.template = site_cache_dir(cache_dir, site) if cache_dir else None
+        self.profile_dir = None
+        self.sessions = []
+        self.requests = 0
+        self.hits = 0
+        self.network_bytes = 0
+        # Set by the runner: the cold launch of the task's own browser on the profile
+        self.launch_seconds = None
+
+    @classmethod
+    def from_args(cls, args, task):
+        return cls(args.cache_dir, site_name(task))
+
+    @property
+    def enabled(self):
+        return self.cache_dir is not None
+
+    @property
+    def available(self):
+        return self.template is not None and os.path.isdir(os.path.join(self.template, "Default"))
+
+    async def clone(self):
+        """A fresh profile directory holding a copy of the template's caches, or None without a template."""
+        if not self.available:
+            if self.enabled:
+                logging.warning(f"No cache template for {self.site} in {self.cache_dir}; starting cold")
+            return None
+        scratch = os.path.join(self.cache_dir, ".contexts")
+        os.makedirs(scratch, exist_ok=True)
+        self.profile_dir = tempfile.mkdtemp(prefix=os.path.basename(self.template) + "-", dir=scratch)
+        for name in CACHE_SUBDIRS:
+            src = os.path.join(self.template, "Default", name)
+            if os.path.isdir(src):
+                await copy_tree(src, os.path.join(self.profile_dir, "Default", name))
+        return self.profile_dir
+
+    async def attach(self, context):
+        for page in context.pages:
+            await self._watch(context, page)
+        context.on("page", lambda page: asyncio.ensure_future(self._watch(context, page)))
+
+    async def _watch(self, context, page):
+        try:
+            cdp = await context.new_cdp_session(page)
+            cdp.on("Network.responseReceived", self._on_response)
+            cdp.on("Network.loadingFinished", self._on_finished)
+            await cdp.send("Network.enable")
+            self.sessions.append(cdp)
+        except Exception as e:
+            logging.debug(f"Cannot count cache hits of {page.url}: {e}")
+
+    def _on_response(self, params):
+        if params["response"]["url"].startswith(("http:", "https:")):
+            self.requests += 1
+            self.hits += bool(params["response"].get("fromDiskCache"))
+
+    def _on_finished(self, params):
+        self.network_bytes += params.get("encodedDataLength", 0)
+
+    async def close(self):
+        """Deletes the task's profile; call after its browser context is closed."""
+        if self.profile_dir:
+            await asyncio.to_thread(shutil.rmtree, self.profile_dir, True)
+            self.profile_dir = None
+
+    def stats(self):
+        return {"site": self.site, "warm": self.available, "requests": self.requests, "hits": self.hits,
+                "hit_rate": round(self.hits / self.requests, 3) if self.requests else None, "network_bytes": self.network_bytes,
+                "launch_ms": round(self.launch_seconds * 1000) if self.launch_seconds is not None else None}
+
+
+def site_pages(test_file, results_dir, max_pages):
+    """Start URLs of the task file per site, then the page URLs recorded in an earlier run's journals."""
+    tasks = {}
+    pages = defaultdict(list)
+    with open(test_file, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                task = json.loads(line)
+                tasks[str(task["id"])] = task
+                pages[site_name(task)].append(task["web"])
+    if results_dir:
+        for task_dir in sorted(glob.glob(os.path.join(results_dir, "task*-*"))):
+            task = tasks.get(os.path.basename(task_dir)[len("task"):].rsplit("-", 1)[0])
+            if task:
+                pages[site_name(task)].extend(step["url"] for step in read_journal(task_dir)
+                                              if (step.get("url") or "").startswith(("http:", "https:")))
+    return {site: list(dict.fromkeys(urls))[:max_pages] for site, urls in pages.items()}
+
+
+def keep_caches(profile, template):
+    """Moves the caches of a warm-up profile into the template; its cookies, storage and history stay out."""
+    shutil.rmtree(template, ignore_errors=True)
+    for name in CACHE_SUBDIRS:
+        src = os.path.join(profile, "Default", name)
+        if os.path.isdir(src):
+            shutil.move(src, os.path.join(template, "Default", name))
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(template) for f in files)
+
+
+async def warm_site(pw, site, urls, args):
+    template = site_cache_dir(args.cache_dir, site)
+    profile = tempfile.mkdtemp(prefix=os.path.basename(template) + "-warm-", dir=args.cache_dir)
+    try:
+        context = await pw.chromium.launch_persistent_context(
+            profile, headless=True, args=browser_launch_args(args),
+            viewport={"width": args.window_width, "height": args.window_height})
+        page = context.pages[0] if context.pages else await context.new_page()
+        loaded = 0
+        for url in urls:
+            try:
+                await page.goto(url, wait_until="load", timeout=args.timeout * 1000)
+                await page.wait_for_load_state("networkidle", timeout=args.timeout * 1000)
+                loaded += 1
+            except Exception as e:
+                logging.warning(f"{site}: {url}: {e.__class__.__name__}")
+        await context.close()
+        size = await asyncio.to_thread(keep_caches, profile, template)
+        print(f"{site}: {loaded}/{len(urls)} pages, {size / 1024 / 1024:.1f} MB cached")
+    finally:
+        await asyncio.to_thread(shutil.rmtree, profile, True)
+
+
+async def warm_all(args):
+    os.makedirs(args.cache_dir, exist_ok=True)
+    pages = site_pages(args.test_file, args.results_dir, args.max_pages)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with async_playwright() as pw:
+        async def warm_one(site, urls):
+            async with semaphore:
+                await warm_site(pw, site, urls, args)
+        await asyncio.gather(*(warm_one(site, urls) for site, urls in pages.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_file", type=str, default="data/test.json")
+    parser.add_argument("--cache_dir", type=str, default="cache")
+    parser.add_argument("--results_dir", type=str, default=None, help="Also visit the pages recorded in this run's journals")
+    parser.add_argument("--max_pages", type=int, default=50, help="Pages visited per site")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sites warmed at once")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for each page to load and go idle")
+    parser.add_argument("--window_width", type=int, default=1024)
+    parser.add_argument("--window_height", type=int, default=768)
+    args = parser.parse_args()
+    asyncio.run(warm_all(args))
+
+
+if __name__ == '__main__':
+    main()